@@ -0,0 +1,121 @@
+# benchmarks/import_time.py
+"""
+Measure the import cost of the app modules with `python -X importtime`.
+
+Every module is imported in a fresh interpreter, `--runs` times, keeping the
+fastest run. The report lists the cumulative import time of each module and,
+for the first one, the heaviest top-level packages it pulls in.
+
+Usage (from the backend directory):
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py main src.services.ai_agent.agent --runs 5
+    python benchmarks/import_time.py main --budget-ms 1500  # exit 1 above budget
+"""
+
+import argparse
+import json
+import re
+import subprocess
+import sys
+from collections import defaultdict
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+DEFAULT_MODULES = [
+    "main",
+    "src",
+    "src.api.agent.agent_api",
+    "src.cache.agent_state_cache_wrapper",
+    "src.services.ai_agent.agent",
+]
+
+# import time: self [us] | cumulative | imported package
+IMPORT_TIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def measure_import(module: str) -> tuple[float, dict[str, float]]:
+    """
+    Import `module` in a fresh interpreter.
+
+    Returns:
+        tuple: the cumulative import time of the module (ms) and the self time
+            of every top-level package imported on the way (ms).
+    """
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND_DIR,
+        capture_output=True,
+        text=True,
+    )
+    if process.returncode != 0:
+        raise RuntimeError(f"Cannot import {module}:\n{process.stderr[-2000:]}")
+
+    total_ms = 0.0
+    packages_ms = defaultdict(float)
+    for line in process.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, _, name = match.groups()
+        packages_ms[name.split(".")[0]] += int(self_us) / 1000
+        if name == module:
+            total_ms = int(cumulative_us) / 1000
+
+    return total_ms, dict(packages_ms)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument("--runs", type=int, default=3, help="keep the fastest run")
+    parser.add_argument("--top", type=int, default=15, help="packages to list")
+    parser.add_argument("--budget-ms", type=float, default=None)
+    parser.add_argument("--json", action="store_true", help="machine readable output")
+    args = parser.parse_args()
+
+    results = {}
+    for module in args.modules:
+        runs = [measure_import(module) for _ in range(args.runs)]
+        results[module] = min(runs, key=lambda run: run[0])
+
+    over_budget = [
+        module
+        for module, (total_ms, _) in results.items()
+        if args.budget_ms is not None and total_ms > args.budget_ms
+    ]
+
+    if args.json:
+        print(
+            json.dumps(
+                {
+                    module: {"total_ms": total_ms, "packages_ms": packages_ms}
+                    for module, (total_ms, packages_ms) in results.items()
+                },
+                indent=2,
+            )
+        )
+    else:
+        print(f"{'module':<45} {'import ms':>10}")
+        for module, (total_ms, _) in results.items():
+            print(f"{module:<45} {total_ms:>10.1f}")
+
+        first_module = args.modules[0]
+        packages_ms = results[first_module][1]
+        print(f"\nHeaviest top-level packages imported by {first_module}:")
+        for package, package_ms in sorted(
+            packages_ms.items(), key=lambda item: item[1], reverse=True
+        )[: args.top]:
+            print(f"  {package:<43} {package_ms:>10.1f}")
+
+    for module in over_budget:
+        print(
+            f"{module} takes {results[module][0]:.1f}ms to import, "
+            f"over the {args.budget_ms:.0f}ms budget",
+            file=sys.stderr,
+        )
+    return 1 if over_budget else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
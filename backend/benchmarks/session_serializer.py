@@ -0,0 +1,132 @@
+# benchmarks/session_serializer.py
+"""
+Compare the session cache serializers on synthetic 10, 50 and 200 message
+sessions: encode / decode time and stored bytes.
+
+`pydantic-json` is the previous format, the whole AgentStateModel as one JSON
+blob (its decode time includes turning the parsed dicts back into messages, as
+the graph does); the others encode each message of the Redis message log.
+
+Usage (from the backend directory):
+    python benchmarks/session_serializer.py
+    python benchmarks/session_serializer.py --sizes 10 50 200 --repeat 20
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+from typing import Callable, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from langchain_core.messages import (  # noqa: E402
+    AIMessage,
+    HumanMessage,
+    ToolMessage,
+    convert_to_messages,
+)
+
+from src.cache.message_serializer import (  # noqa: E402
+    SERIALIZERS,
+    dumps_message,
+    loads_message,
+)
+from src.models.agent.agent_state_model import AgentStateModel  # noqa: E402
+
+PRODUCT_TEXT = (
+    "Áo thun nam cổ tròn cotton 100%, form regular fit, thấm hút mồ hôi tốt, "
+    "phù hợp mặc đi làm và đi chơi. Màu sắc: trắng, đen, xanh navy. "
+    "Kích thước: S, M, L, XL. Giá: 199000 VND. "
+)
+
+
+def build_messages(size: int) -> List:
+    """
+    A session of `size` messages cycling through a product search turn:
+    question, tool call, tool result with product descriptions, answer.
+    """
+    messages = []
+    while len(messages) < size:
+        turn = len(messages) // 4
+        call_id = f"call_{turn}"
+        messages.extend(
+            [
+                HumanMessage(content=f"Tìm giúp mình áo thun nam dưới 300k ({turn})"),
+                AIMessage(
+                    content="",
+                    tool_calls=[
+                        {
+                            "name": "search_advanced_tool",
+                            "args": {"description": "áo thun nam"},
+                            "id": call_id,
+                        }
+                    ],
+                ),
+                ToolMessage(content=PRODUCT_TEXT * 12, tool_call_id=call_id),
+                AIMessage(content="Mình tìm được vài mẫu áo thun phù hợp. " * 4),
+            ]
+        )
+    return messages[:size]
+
+
+def best_of(repeat: int, func: Callable[[], object]) -> float:
+    timings = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started_at)
+    return min(timings) * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--repeat", type=int, default=10, help="keep the best run")
+    args = parser.parse_args()
+
+    print(
+        f"{'messages':>8} {'serializer':<14} {'encode ms':>10} {'decode ms':>10} {'bytes':>10}"
+    )
+    for size in args.sizes:
+        messages = build_messages(size)
+        agent_state = AgentStateModel(session_id="s", user_id="u", messages=messages)
+
+        blob = agent_state.model_dump_json()
+        rows = [
+            (
+                "pydantic-json",
+                best_of(args.repeat, agent_state.model_dump_json),
+                best_of(
+                    args.repeat,
+                    lambda: convert_to_messages(
+                        AgentStateModel.model_validate_json(blob).messages
+                    ),
+                ),
+                len(blob.encode()),
+            )
+        ]
+        for name in SERIALIZERS:
+            encoded = [dumps_message(message, name) for message in messages]
+            rows.append(
+                (
+                    name,
+                    best_of(
+                        args.repeat,
+                        lambda: [dumps_message(message, name) for message in messages],
+                    ),
+                    best_of(
+                        args.repeat, lambda: [loads_message(data) for data in encoded]
+                    ),
+                    sum(len(data) for data in encoded),
+                )
+            )
+
+        for name, encode_ms, decode_ms, size_bytes in rows:
+            print(
+                f"{size:>8} {name:<14} {encode_ms:>10.2f} {decode_ms:>10.2f} {size_bytes:>10}"
+            )
+
+
+if __name__ == "__main__":
+    main()
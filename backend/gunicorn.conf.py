@@ -1,6 +1,8 @@
 # gunicorn.conf.py
+import gc
 import multiprocessing
 import os
+import shutil
 
 bind = "0.0.0.0:8000"  # Bind address and port
 
@@ -26,6 +28,11 @@ else:
     except (TypeError, ValueError):
         threads = 2
 
+# Load the app in the master before forking (GUNICORN_PRELOAD=True): the AI agent
+# is built once and shared copy-on-write by the workers, which only open their
+# own connections (Milvus, Redis, Postgres, Gemini) on first use.
+preload_app = os.getenv("GUNICORN_PRELOAD", "False") == "True"
+
 # Worker class for FastAPI (using UvicornWorker).
 worker_class = "uvicorn.workers.UvicornWorker"
 
@@ -48,3 +55,36 @@ loglevel = "info"  # Logging level
 
 # Monitoring (uncomment to enable statsd).
 # statsd_host = 'localhost:8125'
+
+# Prometheus multiprocess mode: every worker writes its metrics to this directory
+# and /api/metrics aggregates them. Set before the app is imported so workers inherit it.
+prometheus_multiproc_dir = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", "/tmp/prometheus_multiproc"
+)
+
+
+def on_starting(server):
+    # Drop the metric files of a previous run
+    shutil.rmtree(prometheus_multiproc_dir, ignore_errors=True)
+    os.makedirs(prometheus_multiproc_dir, exist_ok=True)
+
+
+def when_ready(server):
+    if preload_app:
+        # Move the objects built in the master out of the garbage collector's
+        # reach, so collections in the workers do not copy their pages
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    if preload_app:
+        from src import engine
+
+        # Pooled connections must never be shared with the master
+        engine.dispose(close=False)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
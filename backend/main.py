@@ -1,6 +1,8 @@
 from fastapi import FastAPI
 
+from src import PRELOAD_APP
 from src.api import all_routers
+from src.api.agent import agent_api
 
 app = FastAPI(
     docs_url="/api/docs",
@@ -10,3 +12,6 @@ app = FastAPI(
 
 for router in all_routers:
     app.include_router(router, prefix="/api")
+
+if PRELOAD_APP:
+    agent_api.preload_ai_agent()
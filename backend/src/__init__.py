@@ -4,8 +4,6 @@ import os
 from pathlib import Path
 
 import dotenv
-import redis
-from sqlmodel import create_engine
 
 dotenv.load_dotenv()
 
@@ -23,6 +21,23 @@ DATABASE_URL = "postgresql+psycopg2://{}:{}@{}:{}/{}".format(
     POSTGRES_PORT,
     POSTGRES_DB,
 )
+ASYNC_DATABASE_URL = "postgresql+asyncpg://{}:{}@{}:{}/{}".format(
+    POSTGRES_USER,
+    POSTGRES_PASSWORD,
+    POSTGRES_HOST,
+    POSTGRES_PORT,
+    POSTGRES_DB,
+)
+# Run the conversation queries on an asyncpg engine instead of worker threads
+POSTGRES_ASYNC = os.getenv("POSTGRES_ASYNC", "False") == "True"
+# Connection pool of each engine, per worker process
+POSTGRES_POOL_OPTIONS = {
+    "pool_size": int(os.getenv("POSTGRES_POOL_SIZE", "5")),
+    "max_overflow": int(os.getenv("POSTGRES_MAX_OVERFLOW", "10")),
+    "pool_timeout": float(os.getenv("POSTGRES_POOL_TIMEOUT", "30")),
+    "pool_recycle": int(os.getenv("POSTGRES_POOL_RECYCLE", "1800")),
+    "pool_pre_ping": os.getenv("POSTGRES_POOL_PRE_PING", "True") == "True",
+}
 DEBUG = os.getenv("DEBUG", "False") == "True"
 
 MILVUS_HOST = os.getenv("MILVUS_HOST", "localhost")
@@ -36,13 +51,57 @@ REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
 REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
 REDIS_DB = int(os.getenv("REDIS_DB", "0"))
 
-# Create SQLAlchemy engine
-engine = create_engine(DATABASE_URL)
+# Gunicorn configuration
+# Build the AI agent once in the gunicorn master and share it with the workers
+PRELOAD_APP = os.getenv("GUNICORN_PRELOAD", "False") == "True"
+# Open the connections of every worker at startup rather than on the first request
+STARTUP_WARM_UP = os.getenv("STARTUP_WARM_UP", "True") == "True"
 
-# Create Redis client
-redis_client = redis.Redis(
-    host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB, decode_responses=True
-)
+# AI agent configuration
+# Upper bound of graph executions running at once for a single batch request
+AGENT_BATCH_MAX_CONCURRENCY = int(os.getenv("AGENT_BATCH_MAX_CONCURRENCY", "4"))
+
+
+def __getattr__(name: str):
+    """
+    Create the SQLAlchemy engines (`engine`, and `async_engine` with
+    `POSTGRES_ASYNC`) and the Redis clients (`redis_client`, `redis_binary_client`,
+    `async_redis_client` and `async_redis_binary_client`) on first access, so
+    importing `src` does not load SQLAlchemy nor redis.
+    """
+    if name == "engine":
+        from sqlmodel import create_engine
+
+        from src.common.db_pool import InstrumentedQueuePool
+
+        value = create_engine(
+            DATABASE_URL, poolclass=InstrumentedQueuePool, **POSTGRES_POOL_OPTIONS
+        )
+    elif name == "async_engine":
+        from sqlalchemy.ext.asyncio import create_async_engine
+
+        from src.common.db_pool import InstrumentedAsyncQueuePool
+
+        value = create_async_engine(
+            ASYNC_DATABASE_URL,
+            poolclass=InstrumentedAsyncQueuePool,
+            **POSTGRES_POOL_OPTIONS,
+        )
+    elif name in (
+        "redis_client",
+        "redis_binary_client",
+        "async_redis_client",
+        "async_redis_binary_client",
+    ):
+        # The clients of `src.cache`, sharing its connection pools
+        import src.cache
+
+        value = getattr(src.cache, name)
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    globals()[name] = value
+    return value
 
 
 # Tạo thư mục logs nếu chưa tồn tại
@@ -1,65 +1,359 @@
+import json
+import logging
+import time
 from contextlib import asynccontextmanager
 
-from fastapi import APIRouter, FastAPI
+from fastapi import APIRouter, FastAPI, HTTPException, Response
+from fastapi.responses import StreamingResponse
+from langchain_core.messages import AIMessageChunk
 from sqlmodel import SQLModel
 
-from src import engine
+from src import AGENT_BATCH_MAX_CONCURRENCY, STARTUP_WARM_UP, engine
 from src.base.model.base_agent_mess_model import BaseAgentMessModel
-from src.cache.agent_state_cache_wrapper import agent_state_cache_wrapper
+from src.cache import redis_client
+from src.cache.agent_state_cache_wrapper import (
+    agent_state_batch_cache_wrapper,
+    agent_state_cache_wrapper,
+    agent_state_stream_cache_wrapper,
+)
+from src.cache.session_queue import SessionQueueTimeoutError
+from src.cache.session_ttl import session_ttl_manager
+from src.common.admission_controller import (
+    AdmissionRejectedError,
+    agent_admission_controller,
+)
+from src.common.request_timing import (
+    collect_timings,
+    record_timing,
+    summarize_timings,
+    to_server_timing_header,
+)
+from src.common.startup import run_startup_tasks
+from src.models.agent.agent_batch_model import (
+    AgentBatchItemResultModel,
+    AgentBatchRequestModel,
+    AgentBatchResponseModel,
+)
+from src.models.agent.agent_response_model import AgentResponseModel
 from src.models.agent.agent_state_model import AgentStateModel
+from src.repositories.agent.conversation_archive import (
+    ConversationArchiveRepository,  # noqa: F401
+    conversation_maintenance,
+)
 from src.repositories.agent.conversation_repository import (
-    ConversationRepository,  # noqa: F401  # noqa: F401
+    ConversationRepository,  # noqa: F401
+)
+from src.repositories.agent.conversation_writer import (
+    CONVERSATION_WRITE_BEHIND,
+    conversation_writer,
 )
-from src.services.ai_agent.agent import AIAgent
 
 # Load database configuration from environment variables (Docker Compose)
 
 ai_agent = None  # Global variable to hold the AI agent instance
 
+# Nodes whose LLM output is internal (e.g. the raw intent label) and must not be
+# streamed to the user as tokens
+SILENT_STREAM_NODES = {"intent_detection"}
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    global ai_agent
+# Seconds a client should wait before retrying a turn of a busy session
+SESSION_BUSY_RETRY_AFTER_SECONDS = 5
 
-    SQLModel.metadata.create_all(engine)
-    ai_agent = AIAgent(
+
+def create_ai_agent():
+    """
+    Build the AI agent. Its network clients are only opened on first use.
+    """
+    # The agent pulls in LangGraph and the LLM / Milvus SDKs, only load them
+    # when it is built (at startup, or in the gunicorn master with preload)
+    from src.services.ai_agent.agent import AIAgent
+
+    return AIAgent(
         collection_name="e_commerce_ai",
         llm_temperature=0.1,
     )
+
+
+def preload_ai_agent() -> None:
+    """
+    Build the AI agent ahead of the app startup, in the gunicorn master when
+    `preload_app` is on, so the workers share it copy-on-write.
+    """
+    global ai_agent
+
+    ai_agent = create_ai_agent()
+
+
+def create_database_schema() -> None:
+    """
+    Create the missing tables. Existing tables are migrated ahead of a
+    deployment (`python -m src.repositories.agent.conversation_repository`),
+    not by every worker starting.
+    """
+    SQLModel.metadata.create_all(engine)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global ai_agent
+
+    if ai_agent is None:
+        ai_agent = create_ai_agent()
+
+    startup_tasks = {"postgres.create_all": create_database_schema}
+    if STARTUP_WARM_UP:
+        startup_tasks["redis.ping"] = redis_client.ping
+        startup_tasks.update(ai_agent.get_warm_up_tasks())
+    await run_startup_tasks(startup_tasks)
+
+    if CONVERSATION_WRITE_BEHIND:
+        await conversation_writer.start()
+    conversation_maintenance.start()
+    session_ttl_manager.start()
     yield
+    await session_ttl_manager.stop()
+    await conversation_maintenance.stop()
+    await conversation_writer.stop()
 
 
 router = APIRouter(lifespan=lifespan)
 
 
+def to_agent_response(result: AgentStateModel) -> BaseAgentMessModel:
+    """
+    Build the API response from the final agent state.
+    """
+    return BaseAgentMessModel(
+        user_id=result.user_id,
+        session_id=result.session_id,
+        messages=(result.messages[-1].content if result.messages else ""),
+    )
+
+
+def session_busy_error(error: SessionQueueTimeoutError) -> HTTPException:
+    """
+    Build the error returned when a session is still busy with previous turns.
+    """
+    return HTTPException(
+        status_code=503,
+        detail=str(error),
+        headers={"Retry-After": str(SESSION_BUSY_RETRY_AFTER_SECONDS)},
+    )
+
+
+def too_many_requests_error(error: AdmissionRejectedError) -> HTTPException:
+    """
+    Build the error returned when the server is at capacity.
+    """
+    return HTTPException(
+        status_code=429,
+        detail=str(error),
+        headers={"Retry-After": str(error.retry_after)},
+    )
+
+
 @agent_state_cache_wrapper
-def agent_invoke(agent_state: AgentStateModel) -> AgentStateModel:
+async def agent_invoke(agent_state: AgentStateModel) -> AgentStateModel:
     """
     Invoke the AI agent with the provided agent state.
     """
-    result = ai_agent.invoke(agent_state)
+    # Only the graph run holds a slot, not the waits for the session or a duplicate
+    async with agent_admission_controller.slot():
+        result = await ai_agent.ainvoke(agent_state)
     processed_state = AgentStateModel.model_validate(result)
     return processed_state
 
 
-@router.post("/ai_agent")
-def ai_agent_v2_api(request: BaseAgentMessModel) -> BaseAgentMessModel:
+@router.post("/ai_agent", response_model_exclude_none=True)
+async def ai_agent_v2_api(
+    request: BaseAgentMessModel, response: Response, timings: bool = False
+) -> AgentResponseModel:
     """
     Endpoint to handle AI agent requests (v2).
+
+    The wall time of every graph node, tool call and storage operation is
+    reported in the `Server-Timing` header, and in the `timings` field when
+    `?timings=true`.
     """
-    # Load conversation from cache
-    result = agent_invoke(
-        AgentStateModel(
-            session_id=request.session_id,
-            user_id=request.user_id,
-            user_input=request.messages,
-        )
+    started_at = time.perf_counter()
+    with collect_timings() as raw_timings:
+        # Load conversation from cache
+        try:
+            result = await agent_invoke(
+                AgentStateModel(
+                    session_id=request.session_id,
+                    user_id=request.user_id,
+                    user_input=request.messages,
+                )
+            )
+        except AdmissionRejectedError as e:
+            raise too_many_requests_error(e)
+        except SessionQueueTimeoutError as e:
+            raise session_busy_error(e)
+
+        record_timing("total", time.perf_counter() - started_at)
+
+    summary = summarize_timings(raw_timings)
+    response.headers["Server-Timing"] = to_server_timing_header(summary)
+
+    return AgentResponseModel(
+        **to_agent_response(result).model_dump(),
+        timings=summary if timings else None,
     )
 
-    response = BaseAgentMessModel(
-        user_id=result.user_id,
-        session_id=result.session_id,
-        messages=(result.messages[-1].content if result.messages else ""),
+
+@agent_state_stream_cache_wrapper
+async def agent_stream(agent_state: AgentStateModel):
+    """
+    Stream the AI agent execution for the provided agent state.
+    """
+    async with agent_admission_controller.slot():
+        async for mode, chunk in ai_agent.astream(agent_state):
+            yield mode, chunk
+
+
+def format_sse(event: str, data: dict) -> str:
+    """Format a Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@router.post("/ai_agent/stream")
+async def ai_agent_stream_api(request: BaseAgentMessModel) -> StreamingResponse:
+    """
+    Endpoint to handle AI agent requests as Server-Sent Events.
+
+    Events:
+        - `node`: a graph node finished, e.g. intent_detection -> product -> product_tools
+        - `token`: a chunk of the answer generated by the LLM
+        - `end`: the final response, same shape as `/ai_agent`
+        - `error`: the turn failed, with a `retry_after` delay when the server
+          is at capacity or the session busy
+    """
+
+    async def event_generator():
+        final_values = None
+        try:
+            async for mode, chunk in agent_stream(
+                AgentStateModel(
+                    session_id=request.session_id,
+                    user_id=request.user_id,
+                    user_input=request.messages,
+                )
+            ):
+                if mode == "updates":
+                    for node_name in chunk:
+                        yield format_sse("node", {"node": node_name})
+
+                elif mode == "messages":
+                    message, metadata = chunk
+                    node_name = metadata.get("langgraph_node")
+                    if (
+                        isinstance(message, AIMessageChunk)
+                        and isinstance(message.content, str)
+                        and message.content
+                        and node_name not in SILENT_STREAM_NODES
+                    ):
+                        yield format_sse(
+                            "token", {"node": node_name, "content": message.content}
+                        )
+
+                elif mode == "values":
+                    final_values = chunk
+
+        except AdmissionRejectedError as e:
+            yield format_sse("error", {"detail": str(e), "retry_after": e.retry_after})
+            return
+        except SessionQueueTimeoutError as e:
+            yield format_sse(
+                "error",
+                {"detail": str(e), "retry_after": SESSION_BUSY_RETRY_AFTER_SECONDS},
+            )
+            return
+        except Exception as e:
+            logging.exception("Error while streaming AI agent response")
+            yield format_sse("error", {"detail": str(e)})
+            return
+
+        result = AgentStateModel.model_validate(final_values)
+        yield format_sse("end", to_agent_response(result).model_dump())
+
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",  # disable nginx proxy buffering
+        },
     )
 
-    return response
+
+@agent_state_batch_cache_wrapper
+async def agent_invoke_batch(agent_state: AgentStateModel) -> AgentStateModel:
+    """
+    Invoke the AI agent for one turn of a batch.
+    """
+    async with agent_admission_controller.slot():
+        result = await ai_agent.ainvoke(agent_state)
+    return AgentStateModel.model_validate(result)
+
+
+@router.post("/ai_agent/batch", response_model=AgentBatchResponseModel)
+async def ai_agent_batch_api(request: AgentBatchRequestModel, stream: bool = False):
+    """
+    Endpoint to process many AI agent requests concurrently.
+
+    Results are returned in request order, or, with `stream=true`, sent as
+    NDJSON lines in completion order. A failing item does not fail the batch,
+    its error is reported in its own result.
+    """
+    max_concurrency = min(
+        request.max_concurrency or AGENT_BATCH_MAX_CONCURRENCY,
+        AGENT_BATCH_MAX_CONCURRENCY,
+    )
+    batch_results = agent_invoke_batch(
+        [
+            AgentStateModel(
+                session_id=item.session_id,
+                user_id=item.user_id,
+                user_input=item.messages,
+            )
+            for item in request.items
+        ],
+        max_concurrency=max_concurrency,
+    )
+
+    def to_item_result(index: int, result) -> AgentBatchItemResultModel:
+        if isinstance(result, Exception):
+            return AgentBatchItemResultModel(index=index, error=str(result))
+        return AgentBatchItemResultModel(index=index, result=to_agent_response(result))
+
+    if stream:
+
+        async def ndjson_generator():
+            reported_indexes = set()
+            try:
+                async for index, result in batch_results:
+                    reported_indexes.add(index)
+                    yield to_item_result(index, result).model_dump_json() + "\n"
+            except Exception as e:
+                # The response has started, every item left gets an error line
+                logging.exception("Error while streaming AI agent batch results")
+                for index in range(len(request.items)):
+                    if index not in reported_indexes:
+                        yield to_item_result(index, e).model_dump_json() + "\n"
+
+        return StreamingResponse(
+            ndjson_generator(),
+            media_type="application/x-ndjson",
+            headers={"X-Accel-Buffering": "no"},
+        )
+
+    try:
+        item_results = [
+            to_item_result(index, result) async for index, result in batch_results
+        ]
+    except SessionQueueTimeoutError as e:
+        raise session_busy_error(e)
+    return AgentBatchResponseModel(
+        results=sorted(item_results, key=lambda item_result: item_result.index)
+    )
@@ -1,9 +1,23 @@
 import logging
+from typing import Optional
 
-from fastapi import APIRouter
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Response
 from fastapi.responses import RedirectResponse
 
-from src import redis_client
+from src.cache import get_redis_pool_stats
+from src.cache.agent_state_cache_wrapper import (
+    clear_session_cache,
+    get_session_cache_stats,
+)
+from src.cache.cache_namespace import CACHE_NAMESPACES, session_cache_namespace
+from src.cache.embedding_cache import get_embedding_cache_stats
+from src.cache.intent_cache import intent_cache
+from src.cache.local_session_cache import local_session_cache
+from src.common.admission_controller import agent_admission_controller
+from src.common.db_pool import get_postgres_pool_stats
+from src.common.metrics import generate_metrics
+from src.repositories.agent.conversation_archive import conversation_maintenance
+from src.repositories.agent.conversation_writer import conversation_writer
 
 router = APIRouter()
 
@@ -18,11 +32,68 @@ def health_check():
     return {"status": "ok"}
 
 
+@router.get("/stats")
+async def stats():
+    """
+    Endpoint to report load and capacity statistics.
+    """
+    return {
+        "admission": await agent_admission_controller.get_stats(),
+        "session_cache": get_session_cache_stats(),
+        "intent_cache": intent_cache.get_stats(),
+        "embedding_cache": get_embedding_cache_stats(),
+        "conversation_writer": conversation_writer.get_stats(),
+        "conversation_maintenance": conversation_maintenance.get_stats(),
+        "postgres_pool": get_postgres_pool_stats(),
+        "redis_pool": get_redis_pool_stats(),
+    }
+
+
+@router.get("/metrics")
+def metrics():
+    """
+    Endpoint exposing Prometheus metrics.
+    """
+    content, content_type = generate_metrics()
+    return Response(content=content, media_type=content_type)
+
+
 @router.post("/clear_cache")
-def clear_cache():
+async def clear_cache(
+    background_tasks: BackgroundTasks,
+    namespace: Optional[str] = None,
+    user_id: Optional[str] = None,
+    session_id: Optional[str] = None,
+    cleanup: bool = True,
+):
     """
-    Endpoint to clear the Redis cache.
+    Endpoint to clear the cache of a session (`user_id` and `session_id`), of a
+    namespace (session, intent or embedding) or of all of them.
+
+    A namespace is cleared by bumping its version, which never blocks Redis;
+    with `cleanup`, the keys of the previous version are unlinked in the
+    background rather than left to expire.
     """
-    logging.info("Clearing Redis cache...")
-    redis_client.flushdb()
-    return {"status": "Cache cleared"}
+    if user_id is not None and session_id is not None:
+        logging.info(f"Clearing the session cache of {user_id}:{session_id}...")
+        cached = await clear_session_cache(user_id, session_id)
+        return {"status": "Session cache cleared", "cached": cached}
+
+    if namespace is not None and namespace not in CACHE_NAMESPACES:
+        raise HTTPException(
+            status_code=404, detail=f"Unknown cache namespace: {namespace}"
+        )
+    namespaces = (
+        [CACHE_NAMESPACES[namespace]] if namespace else CACHE_NAMESPACES.values()
+    )
+
+    versions = {}
+    for cache_namespace in namespaces:
+        logging.info(f"Clearing the {cache_namespace.name} cache...")
+        version = await cache_namespace.invalidate()
+        versions[cache_namespace.name] = version + 1
+        if cleanup:
+            background_tasks.add_task(cache_namespace.unlink_version, version)
+        if cache_namespace is session_cache_namespace:
+            local_session_cache.clear()
+    return {"status": "Cache cleared", "versions": versions}
@@ -1,8 +1,12 @@
 from typing import List, Optional
 
-from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.utils.function_calling import convert_to_openai_tool
 from pydantic import Field, model_validator, validate_call
 
+from src.common.metrics import record_llm_usage
+from src.common.process_local import ProcessLocal
+
 from .base_llm_service import BaseLlmService
 
 
@@ -26,15 +30,32 @@ class BaseAgentService(BaseLlmService):
             ]
         )
 
-        if self.tools:
-            self._agent = self._llm.bind_tools(self.tools)
-        else:
-            self._agent = self._llm
+        # Tool schemas are converted once, binding them to the client is cheap
+        self._tool_schemas = [convert_to_openai_tool(tool) for tool in self.tools or []]
+        self._bound_agent = ProcessLocal(self._create_agent)
 
         return self
 
+    def _create_agent(self):
+        if self._tool_schemas:
+            return self._llm.bind_tools(self._tool_schemas)
+        return self._llm
+
+    @property
+    def _agent(self):
+        return self._bound_agent.get()
+
     @validate_call
     def run(self, invoke_input: dict):
 
         response = self._agent.invoke(self._prompt.invoke(invoke_input))
+        record_llm_usage(self.llm_model, response)
+        return response
+
+    @validate_call
+    async def arun(self, invoke_input: dict):
+
+        prompt_value = await self._prompt.ainvoke(invoke_input)
+        response = await self._agent.ainvoke(prompt_value)
+        record_llm_usage(self.llm_model, response)
         return response
@@ -1,10 +1,29 @@
+import json
 import logging
-from typing import Optional
+import os
+from typing import TYPE_CHECKING, Optional
+
+import redis
 
 # for validation
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from pydantic import BaseModel, Field, model_validator
 
+from src.cache import redis_client
+from src.common.process_local import ProcessLocal
+
+if TYPE_CHECKING:
+    from src.cache.embedding_cache import CachedEmbeddings
+
+# Output dimension of the embedding models in use, so it never has to be probed.
+# Other models can be declared with e.g. EMBEDDING_DIMS='{"models/my-model": 1024}'
+KNOWN_EMBEDDING_DIMS = {
+    "models/text-embedding-004": 768,
+    "models/embedding-001": 768,
+    **json.loads(os.getenv("EMBEDDING_DIMS", "{}")),
+}
+
+EMBEDDING_DIM_KEY_PREFIX = "embedding_dim:"
+
 
 class BaseEmbeddingService(BaseModel):
     embedding_model: str = Field(
@@ -14,15 +33,82 @@ class BaseEmbeddingService(BaseModel):
     embedding_dim: Optional[int] = Field(
         default=None,
         ge=1,
-        description="The dimension of the embeddings, set after initialization if get_embedding_dim is True.",
+        description="The dimension of the embeddings, probed on first use of get_embedding_dim if not set.",
     )
 
     @model_validator(mode="after")
     def __after_init(self):
-        self._embeddings = GoogleGenerativeAIEmbeddings(model=self.embedding_model)
+        self._embeddings_client = ProcessLocal(self._create_embeddings)
+        return self
 
-        if self.embedding_dim is None:
-            self.embedding_dim = len(self._embeddings.embed_documents([""])[0])
-            logging.info(f"Embedding dimension: {self.embedding_dim}")
+    def _create_embeddings(self) -> "CachedEmbeddings":
+        # The Gemini SDK is slow to import, load it when the first client is built
+        from langchain_google_genai import GoogleGenerativeAIEmbeddings
 
-        return self
+        from src.cache.embedding_cache import CachedEmbeddings
+
+        # Texts already embedded, by any worker, are not sent to the API again
+        return CachedEmbeddings(
+            GoogleGenerativeAIEmbeddings(model=self.embedding_model),
+            model=self.embedding_model,
+        )
+
+    @property
+    def _embeddings(self) -> "CachedEmbeddings":
+        return self._embeddings_client.get()
+
+    def get_embedding_dim(self) -> int:
+        """
+        Return the embedding dimension, looked up in order from:
+        the known dimensions, Redis, the schema of the Milvus collection (for
+        services backed by one) and, as a last resort, a live embedding call.
+        Looked up dimensions are kept in Redis for the other processes.
+        """
+        if self.embedding_dim is not None:
+            return self.embedding_dim
+
+        embedding_dim = KNOWN_EMBEDDING_DIMS.get(self.embedding_model)
+        if embedding_dim is None:
+            embedding_dim = self._get_cached_embedding_dim()
+
+        if embedding_dim is None:
+            get_collection_embedding_dim = getattr(
+                self, "get_collection_embedding_dim", None
+            )
+            if get_collection_embedding_dim is not None:
+                embedding_dim = get_collection_embedding_dim()
+
+            if embedding_dim is None:
+                embedding_dim = len(self._embeddings.embed_documents([""])[0])
+                logging.info(f"Probed embedding dimension: {embedding_dim}")
+
+            self._set_cached_embedding_dim(embedding_dim)
+
+        # Known for the rest of the process, whichever instance asks
+        KNOWN_EMBEDDING_DIMS[self.embedding_model] = embedding_dim
+        self.embedding_dim = embedding_dim
+        return self.embedding_dim
+
+    def _get_cached_embedding_dim(self) -> Optional[int]:
+        try:
+            cached_dim = redis_client.get(
+                EMBEDDING_DIM_KEY_PREFIX + self.embedding_model
+            )
+        except redis.RedisError as e:
+            logging.warning(f"Cannot read the cached embedding dimension: {e}")
+            return None
+        return int(cached_dim) if cached_dim is not None else None
+
+    def _set_cached_embedding_dim(self, embedding_dim: int) -> None:
+        try:
+            redis_client.set(
+                EMBEDDING_DIM_KEY_PREFIX + self.embedding_model, embedding_dim
+            )
+        except redis.RedisError as e:
+            logging.warning(f"Cannot cache the embedding dimension: {e}")
+
+    def warm_up_embeddings(self) -> None:
+        """
+        Build the embedding client of this process ahead of the first request.
+        """
+        self._embeddings_client.get()
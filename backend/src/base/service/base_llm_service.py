@@ -1,12 +1,13 @@
-from typing import Optional
-
-from langchain_google_genai import (
-    ChatGoogleGenerativeAI,
-)
+from typing import TYPE_CHECKING, Optional
 
 # for validation
 from pydantic import BaseModel, Field, model_validator
 
+from src.common.process_local import ProcessLocal
+
+if TYPE_CHECKING:
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
 
 class BaseLlmService(BaseModel):
     llm_model: str = Field(default="gemini-2.0-flash", min_length=5, max_length=100)
@@ -32,10 +33,27 @@ class BaseLlmService(BaseModel):
 
     @model_validator(mode="after")
     def __after_init(self):
-        self._llm = ChatGoogleGenerativeAI(
+        # The client opens a gRPC channel, so it is only built in the process using it
+        self._llm_client = ProcessLocal(self._create_llm)
+        return self
+
+    def _create_llm(self) -> "ChatGoogleGenerativeAI":
+        # The Gemini SDK is slow to import, load it when the first client is built
+        from langchain_google_genai import ChatGoogleGenerativeAI
+
+        return ChatGoogleGenerativeAI(
             model=self.llm_model,
             temperature=self.llm_temperature,
             top_p=self.llm_top_p,
             top_k=self.llm_top_k,
         )
-        return self
+
+    @property
+    def _llm(self) -> "ChatGoogleGenerativeAI":
+        return self._llm_client.get()
+
+    def warm_up(self) -> None:
+        """
+        Build the LLM client of this process ahead of the first request.
+        """
+        self._llm_client.get()
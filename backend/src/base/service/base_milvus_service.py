@@ -1,10 +1,13 @@
 # src.base.service.base_milvus
 import logging
+from typing import Optional
 
 # for validation
 from pydantic import BaseModel, Field, model_validator
-from pymilvus import connections, utility
-from src import MILVUS_URI, MILVUS_TOKEN
+
+from src import MILVUS_TOKEN, MILVUS_URI
+
+# pymilvus is slow to import, it is only loaded by the methods talking to Milvus
 
 
 class BaseMilvusService(BaseModel):
@@ -22,15 +25,40 @@ class BaseMilvusService(BaseModel):
 
     @model_validator(mode="after")
     def __after_init(self):
+        # The connection is opened on first use (see `connect`), not here, so
+        # services can be built in the gunicorn master before workers fork
+        return self
+
+    def connect(self) -> None:
+        """
+        Open the Milvus connection of this process, if not open yet.
+        """
+        from pymilvus import connections
+
         if not connections.has_connection("default"):
             logging.info("Connecting to Milvus database...")
             connections.connect(uri=self.milvus_uri, token=self.milvus_token)
 
-        return self
-
     def is_collection_exists(self):
+        from pymilvus import utility
+
+        self.connect()
         return utility.has_collection(self.collection_name)
 
+    def get_collection_embedding_dim(self) -> Optional[int]:
+        """
+        Return the dimension of the vector field of the collection, if it exists.
+        """
+        from pymilvus import Collection, DataType
+
+        if not self.is_collection_exists():
+            return None
+
+        for field in Collection(name=self.collection_name).schema.fields:
+            if field.dtype == DataType.FLOAT_VECTOR:
+                return int(field.params["dim"])
+        return None
+
     # def create_record(self, data):
     #     assert self.is_collection_exists(), f"'{self.collection_name}' does not exist!"
     #     assert not self.is_id_exists(data['id']), f"id= {data['id']} already exists!"
@@ -1,12 +1,80 @@
 import os
 
 import redis
+import redis.asyncio
 
-# Redis configuration
-REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
-REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
-REDIS_DB = int(os.getenv("REDIS_DB", "0"))
+from src import REDIS_DB, REDIS_HOST, REDIS_PORT
 
-redis_client = redis.Redis(
-    host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB, decode_responses=True
+# Connection pool options, shared by every Redis client of a worker process.
+# When all connections are in use, a command waits up to `timeout` seconds for
+# one instead of failing at once.
+REDIS_POOL_OPTIONS = {
+    "max_connections": int(os.getenv("REDIS_MAX_CONNECTIONS", "64")),
+    "timeout": float(os.getenv("REDIS_POOL_TIMEOUT", "5")),
+    "socket_timeout": float(os.getenv("REDIS_SOCKET_TIMEOUT", "5")),
+    "socket_connect_timeout": float(os.getenv("REDIS_SOCKET_CONNECT_TIMEOUT", "2")),
+    "socket_keepalive": True,
+    "health_check_interval": int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", "30")),
+}
+
+
+def _create_pool(pool_class, decode_responses: bool):
+    return pool_class(
+        host=REDIS_HOST,
+        port=REDIS_PORT,
+        db=REDIS_DB,
+        decode_responses=decode_responses,
+        **REDIS_POOL_OPTIONS,
+    )
+
+
+# Responses are decoded by the connections, so text and binary clients cannot
+# share one: a pool per client, each created once per process
+redis_pool = _create_pool(redis.BlockingConnectionPool, decode_responses=True)
+redis_binary_pool = _create_pool(redis.BlockingConnectionPool, decode_responses=False)
+async_redis_pool = _create_pool(
+    redis.asyncio.BlockingConnectionPool, decode_responses=True
 )
+async_redis_binary_pool = _create_pool(
+    redis.asyncio.BlockingConnectionPool, decode_responses=False
+)
+
+redis_client = redis.Redis(connection_pool=redis_pool)
+
+# Binary client for values that are not text (e.g. packed embedding vectors)
+redis_binary_client = redis.Redis(connection_pool=redis_binary_pool)
+
+# asyncio client for the request path, so cache I/O never blocks the event loop
+async_redis_client = redis.asyncio.Redis(connection_pool=async_redis_pool)
+
+# Binary client for values that are not text (e.g. msgpack encoded messages)
+async_redis_binary_client = redis.asyncio.Redis(connection_pool=async_redis_binary_pool)
+
+
+def _get_pool_stats(pool) -> dict:
+    stats = {"max_connections": pool.max_connections}
+    # Private attributes of redis-py, left out when a release renames them
+    if isinstance(pool, redis.asyncio.ConnectionPool):
+        in_use = getattr(pool, "_in_use_connections", None)
+        available = getattr(pool, "_available_connections", None)
+        if in_use is not None and available is not None:
+            stats.update(in_use=len(in_use), idle=len(available))
+    else:  # The queue holds the idle connections and a None per missing one
+        queue = getattr(pool, "pool", None)
+        connections = getattr(pool, "_connections", None)
+        if queue is not None and connections is not None:
+            in_use = pool.max_connections - queue.qsize()
+            stats.update(in_use=in_use, idle=len(connections) - in_use)
+    return stats
+
+
+def get_redis_pool_stats() -> dict:
+    """
+    Usage of the Redis connection pools of this worker.
+    """
+    return {
+        "sync": _get_pool_stats(redis_pool),
+        "sync_binary": _get_pool_stats(redis_binary_pool),
+        "async": _get_pool_stats(async_redis_pool),
+        "async_binary": _get_pool_stats(async_redis_binary_pool),
+    }
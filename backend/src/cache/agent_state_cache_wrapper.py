@@ -1,54 +1,506 @@
+import asyncio
+import json
 import logging
+import os
 from functools import wraps
+from typing import List, Optional
 
 from pydantic import validate_call
 
-from src.cache import redis_client
+from src.cache import async_redis_binary_client
+from src.cache.cache_namespace import session_cache_namespace
+from src.cache.local_session_cache import local_session_cache
+from src.cache.message_log import (
+    SESSION_HISTORY_WINDOW,
+    MessageLog,
+    delete_message_logs,
+    parse_message_logs,
+    queue_read_message_logs,
+    queue_write_message_logs,
+    read_message_logs,
+    window_history,
+)
+from src.cache.pipeline_script import execute_pipeline
+from src.cache.session_queue import session_lock, single_flight
+from src.cache.session_ttl import session_ttl_manager
+from src.common.message_codec import (
+    LazyMessageList,
+    iter_message_payloads,
+    message_to_dict,
+)
+from src.common.metrics import BACKEND_LATENCY, SESSION_CACHE_REQUESTS, observe_latency
 from src.models.agent.agent_state_model import AgentStateModel
+from src.repositories.agent.conversation_archive import arestore_archived_sessions
 from src.repositories.agent.conversation_repository import (
-    load_conversations,
-    save_conversation,
+    aload_conversations,
+    aload_conversations_many,
+    asave_conversation,
+    asave_conversations,
 )
+from src.repositories.agent.conversation_writer import conversation_writer
+
+# Redis tier lookups of this worker, the local tier counts its own. `cold` ones
+# found the session offloaded and restored it without the database.
+_redis_stats = {"hit": 0, "miss": 0, "cold": 0}
+
+
+def get_cache_key(user_id: str, session_id: str) -> str:
+    return f"conversation[{user_id}:{session_id}]"
+
+
+def _get_log_keys(keys: List[tuple[str, str]], version: int) -> List[str]:
+    """
+    Keys of the cached conversations of the sessions, in a version of the
+    session cache namespace. Session locks keep the unversioned key, so an
+    invalidation never lets two turns of a session run at once.
+    """
+    prefix = session_cache_namespace.prefix(version)
+    return [prefix + get_cache_key(user_id, session_id) for user_id, session_id in keys]
+
+
+def _to_cached_agent_state(
+    agent_state: AgentStateModel, message_log: MessageLog
+) -> AgentStateModel:
+    cached_agent_state = AgentStateModel(
+        session_id=agent_state.session_id,
+        user_id=agent_state.user_id,
+        user_input=agent_state.user_input,
+        messages=message_log.messages,
+        intent=message_log.intent,
+    )
+    cached_agent_state._cache_version = message_log.version
+    return cached_agent_state
+
+
+async def load_agent_state(agent_state: AgentStateModel) -> AgentStateModel:
+    """
+    Restore the conversation for `agent_state` from Redis, falling back to the
+    database and finally to the incoming state itself.
+    """
+    return (await load_agent_states([agent_state]))[0]
+
+
+async def store_agent_state(
+    cached_agent_state: AgentStateModel, result: AgentStateModel
+) -> None:
+    """
+    Append the messages added during this turn to the cache and persist them.
+    """
+    await store_agent_states([(cached_agent_state, result)])
+
+
+async def _read_message_logs(
+    keys: List[tuple[str, str]],
+) -> tuple[List[str], List[Optional[MessageLog]]]:
+    """
+    Read the logs of several sessions, from this worker's memory when Redis
+    confirms the local copy is current, else from Redis (refreshing the copy).
+    The version of the session cache namespace is checked in the same round
+    trip, the logs are read again in the new one after an invalidation.
+
+    Returns:
+        tuple: the cache keys of the logs and the logs.
+    """
+    version = session_cache_namespace.get_cached_version()
+    cache_keys = _get_log_keys(keys, version)
+    async with async_redis_binary_client.pipeline(transaction=False) as pipe:
+        session_cache_namespace.queue_version(pipe)
+        queue_read_message_logs(
+            pipe,
+            cache_keys,
+            session_ttl_manager.get_ttl(),
+            known_versions=[
+                local_session_cache.get_version(cache_key) for cache_key in cache_keys
+            ],
+        )
+        with observe_latency(BACKEND_LATENCY, backend="redis", operation="read_log"):
+            replies = await execute_pipeline(async_redis_binary_client, pipe)
+
+    if session_cache_namespace.update_version(replies[0]) != version:
+        return await _read_message_logs(keys)
+    message_logs = parse_message_logs(replies[1:])
+
+    unavailable_indexes = []
+    for index, (cache_key, message_log) in enumerate(zip(cache_keys, message_logs)):
+        if message_log is None or message_log.cold:
+            continue
+
+        local_message_log = local_session_cache.get(cache_key, message_log.version)
+        if local_message_log is not None:
+            message_logs[index] = local_message_log
+        elif message_log.messages is not None:
+            local_session_cache.set(cache_key, message_log)
+        else:  # The local copy was evicted since its version was sent
+            unavailable_indexes.append(index)
+
+    if unavailable_indexes:
+        reread_message_logs = await read_message_logs(
+            [cache_keys[index] for index in unavailable_indexes],
+            session_ttl_manager.get_ttl(),
+        )
+        for index, message_log in zip(unavailable_indexes, reread_message_logs):
+            message_logs[index] = message_log
+    return cache_keys, message_logs
+
+
+async def load_agent_states(
+    agent_states: List[AgentStateModel],
+) -> List[AgentStateModel]:
+    """
+    Restore the conversations of several agent states: one Redis round trip for
+    all of them (served from memory when unchanged) and a single database query
+    for the cache misses, which are written back to the cache with the turn,
+    see `store_agent_states`.
+
+    Only the last `SESSION_HISTORY_WINDOW` messages are restored when it is set.
+    """
+    cache_keys, message_logs = await _read_message_logs(
+        [(agent_state.user_id, agent_state.session_id) for agent_state in agent_states]
+    )
+
+    # Offloaded sessions are filled again from their cold form, missed ones
+    # from the database
+    fill_indexes = [
+        index
+        for index, message_log in enumerate(message_logs)
+        if message_log is None or message_log.cold
+    ]
+    missed_keys = [
+        (agent_states[index].user_id, agent_states[index].session_id)
+        for index in fill_indexes
+        if message_logs[index] is None
+    ]
+    cold_count = len(fill_indexes) - len(missed_keys)
+    hit_count = len(cache_keys) - len(fill_indexes)
+    logging.info(
+        f"Cache lookup for {cache_keys}: {hit_count} hits, {cold_count} cold, {len(missed_keys)} misses"
+    )
+    _redis_stats["hit"] += hit_count
+    _redis_stats["cold"] += cold_count
+    _redis_stats["miss"] += len(missed_keys)
+    SESSION_CACHE_REQUESTS.labels("redis", "hit").inc(hit_count)
+    SESSION_CACHE_REQUESTS.labels("redis", "cold").inc(cold_count)
+    SESSION_CACHE_REQUESTS.labels("redis", "miss").inc(len(missed_keys))
+    if not fill_indexes:
+        return [
+            _to_cached_agent_state(agent_state, message_log)
+            for agent_state, message_log in zip(agent_states, message_logs)
+        ]
+
+    loaded_conversations = {}
+    if missed_keys:
+        # Sessions idle for long were moved to the archive, bring them back first
+        await arestore_archived_sessions(missed_keys)
+        # The last rows of a session may still be buffered by a writer
+        await conversation_writer.wait_until_saved(missed_keys)
+
+    # Only the window is loaded, long sessions cost no more than short ones
+    last_n = SESSION_HISTORY_WINDOW or None
+    if len(missed_keys) == 1:
+        user_id, session_id = missed_keys[0]
+        loaded_conversation = await aload_conversations(
+            session_id=session_id, user_id=user_id, last_n=last_n
+        )
+        if loaded_conversation:
+            loaded_conversations = {missed_keys[0]: loaded_conversation}
+    elif missed_keys:
+        loaded_conversations = await aload_conversations_many(
+            missed_keys, last_n=last_n
+        )
+
+    for index in fill_indexes:
+        message_log = message_logs[index]
+        if message_log is None:  # Cache miss
+            agent_state = agent_states[index]
+            loaded_agent_state = loaded_conversations.get(
+                (agent_state.user_id, agent_state.session_id), agent_state
+            )
+            message_log = MessageLog(
+                loaded_agent_state.messages, loaded_agent_state.intent
+            )
+        # Not cached until the turn is stored, the history and the turn together
+        message_logs[index] = MessageLog(
+            window_history(message_log.messages), message_log.intent
+        )
+
+    return [
+        _to_cached_agent_state(agent_state, message_log)
+        for agent_state, message_log in zip(agent_states, message_logs)
+    ]
+
+
+async def store_agent_states(
+    items: List[tuple[AgentStateModel, AgentStateModel]],
+) -> None:
+    """
+    Append the messages added during a turn of several sessions to the cache in
+    one Redis round trip (caching the whole history of the sessions restored
+    from the database), and persist them: through the background
+    `conversation_writer` when it runs, the sessions then being marked pending
+    in the same round trip, else in a single database transaction. Either way
+    the rows of the previous turns still buffered by a writer are committed
+    first, so the rows of a session keep the order of its turns.
+
+    Args:
+        items: `(cached_agent_state, result)` pairs.
+    """
+    if not items:
+        return
+
+    new_message_logs = []
+    conversations_to_save = []
+    cache_keys = _get_log_keys(
+        [(result.user_id, result.session_id) for _, result in items],
+        session_cache_namespace.get_cached_version(),
+    )
+    for (cached_agent_state, result), cache_key in zip(items, cache_keys):
+        new_messages = result.messages[len(cached_agent_state.messages) :]
+        if cached_agent_state._cache_version:
+            message_log = MessageLog(
+                new_messages, result.intent, cached_agent_state._cache_version
+            )
+        else:  # Restored from the database or a cold form, cached whole
+            message_log = MessageLog(result.messages, result.intent)
+        new_message_logs.append((cache_key, message_log))
+        if new_messages:
+            conversations_to_save.append((result, len(new_messages)))
+
+    # Persisted in the background when the writer runs, off the request path
+    saved_keys = [
+        (result.user_id, result.session_id) for result, _ in conversations_to_save
+    ]
+    write_behind = bool(saved_keys) and conversation_writer.is_running
+
+    async with async_redis_binary_client.pipeline(transaction=False) as pipe:
+        queue_write_message_logs(pipe, new_message_logs, session_ttl_manager.get_ttl())
+        if write_behind:
+            conversation_writer.queue_pending_markers(pipe, saved_keys)
+        with observe_latency(BACKEND_LATENCY, backend="redis", operation="write_log"):
+            replies = await execute_pipeline(async_redis_binary_client, pipe)
+    versions = [int(version) for version in replies[: len(new_message_logs)]]
+    logging.info(f"Cached {len(items)} conversations")
+
+    # Keep the new state in memory, for the next turn of the session
+    for (_, result), (cache_key, _), version in zip(items, new_message_logs, versions):
+        if version:
+            local_session_cache.set(
+                cache_key,
+                MessageLog(window_history(result.messages), result.intent, version),
+            )
+        else:
+            local_session_cache.discard(cache_key)
+
+    if not saved_keys:
+        return
+    if write_behind:
+        # The previous turn of a session may have been served by another worker
+        other_writer_keys = [
+            key
+            for key, other_tokens in zip(saved_keys, replies[len(new_message_logs) :])
+            if other_tokens
+        ]
+        if other_writer_keys:
+            await conversation_writer.wait_until_saved(other_writer_keys)
+        if conversation_writer.enqueue(conversations_to_save):
+            return
+        # The writer is behind, the rows it buffered are committed first
+        await conversation_writer.wait_until_saved(saved_keys)
+
+    try:
+        if len(conversations_to_save) == 1:
+            agent_state, number_of_last_messages = conversations_to_save[0]
+            await asave_conversation(
+                agent_state=agent_state,
+                number_of_last_messages=number_of_last_messages,
+            )
+        else:
+            await asave_conversations(conversations_to_save)
+    finally:
+        if write_behind:
+            await conversation_writer.clear_pending_markers(saved_keys)
+
+
+async def clear_session_cache(user_id: str, session_id: str) -> bool:
+    """
+    Drop the cached conversation of a session, in Redis and in this worker.
+    Other workers reload it on the next turn of the session, Redis missing it.
+
+    Returns:
+        bool: whether the session was cached in Redis.
+    """
+    cache_key = _get_log_keys(
+        [(user_id, session_id)], await session_cache_namespace.aget_version()
+    )[0]
+    local_session_cache.discard(cache_key)
+    return bool(await delete_message_logs([cache_key]))
+
+
+def get_session_cache_stats() -> dict:
+    """
+    Hit / miss counts of both session cache tiers, and the TTLs and offloads
+    of the Redis one, for this worker.
+    """
+    return {
+        "worker_pid": os.getpid(),
+        "local": local_session_cache.get_stats(),
+        "redis": dict(_redis_stats),
+        "lifecycle": session_ttl_manager.get_stats(),
+        "namespace": session_cache_namespace.get_stats(),
+    }
+
+
+def to_single_flight_result(result: AgentStateModel) -> str:
+    """
+    Serialize the part of a turn result that duplicate requests respond with.
+    """
+    payload = result.model_dump(mode="json", exclude={"messages"})
+    payload["messages"] = [
+        message_to_dict(message)
+        for message in iter_message_payloads(result.messages[-1:])
+    ]
+    return json.dumps(payload, ensure_ascii=False)
+
+
+def from_single_flight_result(result: str) -> AgentStateModel:
+    """
+    Rebuild the result of `to_single_flight_result`, messages included.
+    """
+    payload = json.loads(result)
+    payload["messages"] = LazyMessageList(payload["messages"])
+    return AgentStateModel.model_validate(payload)
 
 
 def agent_state_cache_wrapper(func):
     @wraps(func)
     @validate_call
-    def wrapper(agent_state: AgentStateModel):
-        cache_key = f"conversation[{agent_state.user_id}:{agent_state.session_id}]"
-        cached_agent_state = redis_client.get(cache_key)
-
-        if cached_agent_state:  # Cache hit
-            logging.info(f"Cache hit for {cache_key}")
-            # Deserialize cached state
-            cached_agent_state = AgentStateModel.model_validate_json(cached_agent_state)
-        else:  # Cache miss
-            logging.info(f"Cache miss for {cache_key}")
-
-            loaded_conversations = load_conversations(
-                session_id=agent_state.session_id,
-                user_id=agent_state.user_id,
+    async def wrapper(agent_state: AgentStateModel):
+        cache_key = get_cache_key(agent_state.user_id, agent_state.session_id)
+
+        async with single_flight(cache_key, agent_state.user_input) as flight:
+            if flight.result is not None:  # Duplicate of a turn in flight
+                return from_single_flight_result(flight.result)
+
+            async with session_lock(cache_key):
+                cached_agent_state = await load_agent_state(agent_state)
+
+                result = await func(cached_agent_state)
+
+                await store_agent_state(cached_agent_state, result)
+
+            flight.set_result(to_single_flight_result(result))
+            return result
+
+    return wrapper
+
+
+def agent_state_stream_cache_wrapper(func):
+    """
+    Streaming counterpart of `agent_state_cache_wrapper`.
+
+    `func` is an async generator yielding `(mode, chunk)` tuples from the graph
+    stream. Every chunk is forwarded to the caller; the last `values` chunk is
+    taken as the final state and cached/persisted once the stream finishes.
+    """
+
+    @wraps(func)
+    @validate_call
+    async def wrapper(agent_state: AgentStateModel):
+        cache_key = get_cache_key(agent_state.user_id, agent_state.session_id)
+
+        async with single_flight(cache_key, agent_state.user_input) as flight:
+            if flight.result is not None:  # Duplicate of a turn in flight
+                yield "values", from_single_flight_result(flight.result)
+                return
+
+            async with session_lock(cache_key):
+                cached_agent_state = await load_agent_state(agent_state)
+
+                final_values = None
+                async for mode, chunk in func(cached_agent_state):
+                    if mode == "values":
+                        final_values = chunk
+                    yield mode, chunk
+
+                if final_values is None:
+                    return
+                result = AgentStateModel.model_validate(final_values)
+                await store_agent_state(cached_agent_state, result)
+
+            flight.set_result(to_single_flight_result(result))
+
+    return wrapper
+
+
+def agent_state_batch_cache_wrapper(func):
+    """
+    Batch counterpart of `agent_state_cache_wrapper`.
+
+    The wrapped function takes a list of agent states and a concurrency limit and
+    yields `(index, result)` pairs as turns complete, where `result` is either the
+    new agent state or the exception raised by that turn. Turns belonging to the
+    same session run sequentially, each on top of the previous result; distinct
+    sessions run concurrently. Caching and persistence are batched once all turns
+    have finished.
+    """
+
+    @wraps(func)
+    async def wrapper(agent_states: List[AgentStateModel], max_concurrency: int):
+        # Group turns by session, keeping their original order
+        session_groups = {}
+        for index, agent_state in enumerate(agent_states):
+            session_groups.setdefault(
+                (agent_state.user_id, agent_state.session_id), []
+            ).append(index)
+
+        # Hold every session of the batch, so interactive turns cannot interleave
+        async with session_lock(
+            *[
+                get_cache_key(user_id, session_id)
+                for user_id, session_id in session_groups
+            ]
+        ):
+            loaded_agent_states = await load_agent_states(
+                [agent_states[indexes[0]] for indexes in session_groups.values()]
             )
-            if loaded_conversations:
-                logging.info(f"Loaded conversation from database for {cache_key}")
-                cached_agent_state = loaded_conversations
-            else:
-                logging.info(f"No conversation found in database for {cache_key}")
-                cached_agent_state = agent_state
 
-        cached_agent_state.user_input = agent_state.user_input
+            semaphore = asyncio.Semaphore(max_concurrency)
+            results_queue = asyncio.Queue()
+            finished_sessions = []
 
-        result = func(cached_agent_state)
+            async def run_session(
+                indexes: List[int], cached_agent_state: AgentStateModel
+            ):
+                current_state = cached_agent_state
+                for index in indexes:
+                    turn_state = current_state.model_copy(
+                        update={"user_input": agent_states[index].user_input}
+                    )
+                    try:
+                        async with semaphore:
+                            result = await func(turn_state)
+                    except Exception as e:
+                        logging.exception(f"Batch item {index} failed")
+                        await results_queue.put((index, e))
+                        continue
 
-        logging.info(f"Cached {cache_key}")
-        redis_client.setex(cache_key, 600, result.model_dump_json())
-        number_of_added_messages = len(result.messages) - len(
-            cached_agent_state.messages
-        )
-        save_conversation(
-            agent_state=result,
-            number_of_last_messages=number_of_added_messages,
-        )
-        return result
+                    current_state = result
+                    await results_queue.put((index, result))
+
+                if current_state is not cached_agent_state:
+                    finished_sessions.append((cached_agent_state, current_state))
+
+            tasks = [
+                asyncio.create_task(run_session(indexes, cached_agent_state))
+                for indexes, cached_agent_state in zip(
+                    session_groups.values(), loaded_agent_states
+                )
+            ]
+
+            try:
+                for _ in range(len(agent_states)):
+                    yield await results_queue.get()
+            finally:
+                await asyncio.gather(*tasks, return_exceptions=True)
+                await store_agent_states(finished_sessions)
 
     return wrapper
@@ -0,0 +1,152 @@
+# src.cache.cache_namespace
+import logging
+import os
+import time
+from typing import Optional
+
+from pydantic import BaseModel, model_validator
+
+from src.cache import async_redis_client, redis_client
+
+# Seconds a worker reuses the version of a namespace before reading it again:
+# an invalidation reaches every worker within this delay
+CACHE_NAMESPACE_VERSION_TTL_SECONDS = float(
+    os.getenv("CACHE_NAMESPACE_VERSION_TTL_SECONDS", "1")
+)
+# Keys listed per SCAN call when the keys of an old version are cleaned up
+CACHE_CLEANUP_SCAN_COUNT = int(os.getenv("CACHE_CLEANUP_SCAN_COUNT", "1000"))
+
+
+class CacheNamespace(BaseModel):
+    """
+    Group of cache keys invalidated together in O(1): every key is prefixed
+    with the current version of the namespace, so bumping the version makes
+    the previous keys unreachable. They expire on their own, or are removed in
+    the background by `unlink_version`, without blocking Redis like `FLUSHDB`.
+    """
+
+    name: str
+
+    @model_validator(mode="after")
+    def __after_init(self):
+        self._version: Optional[int] = None
+        self._version_read_at = 0.0
+        self._stats = {"invalidations": 0, "unlinked_keys": 0}
+        return self
+
+    @property
+    def version_key(self) -> str:
+        return f"cache_namespace:{self.name}:version"
+
+    def prefix(self, version: int) -> str:
+        return f"{self.name}:v{version}:"
+
+    def _set_version(self, version: int) -> int:
+        self._version = version
+        self._version_read_at = time.monotonic()
+        return version
+
+    def _get_local_version(self) -> Optional[int]:
+        if (
+            time.monotonic() - self._version_read_at
+            < CACHE_NAMESPACE_VERSION_TTL_SECONDS
+        ):
+            return self._version
+        return None
+
+    def get_cached_version(self) -> int:
+        """
+        Version of the namespace last read by this worker, however old, for
+        callers which check it in the same round trip (see `queue_version`).
+        """
+        return self._version or 0
+
+    def queue_version(self, pipe) -> None:
+        pipe.get(self.version_key)
+
+    def update_version(self, reply) -> int:
+        """
+        Keep the version read by `queue_version`.
+        """
+        return self._set_version(int(reply or 0))
+
+    def get_version(self) -> int:
+        version = self._get_local_version()
+        if version is None:
+            version = self._set_version(int(redis_client.get(self.version_key) or 0))
+        return version
+
+    async def aget_version(self) -> int:
+        version = self._get_local_version()
+        if version is None:
+            version = self._set_version(
+                int(await async_redis_client.get(self.version_key) or 0)
+            )
+        return version
+
+    def key(self, suffix: str) -> str:
+        """
+        Key of `suffix` in the current version of the namespace.
+        """
+        return self.prefix(self.get_version()) + suffix
+
+    async def akey(self, suffix: str) -> str:
+        return self.prefix(await self.aget_version()) + suffix
+
+    async def invalidate(self) -> int:
+        """
+        Make every key of the namespace unreachable, in a single `INCR`.
+
+        Returns:
+            int: the version invalidated, see `unlink_version`.
+        """
+        version = self._set_version(await async_redis_client.incr(self.version_key))
+        self._stats["invalidations"] += 1
+        logging.info(f"Invalidated cache namespace {self.name} (version {version})")
+        return version - 1
+
+    async def unlink_version(self, version: int) -> int:
+        """
+        Remove the keys of a previous version with `SCAN` and `UNLINK`, which
+        frees their memory outside of the Redis main thread.
+
+        Returns:
+            int: the number of keys removed.
+        """
+        unlinked = 0
+        batch = []
+        async for key in async_redis_client.scan_iter(
+            match=f"{self.prefix(version)}*", count=CACHE_CLEANUP_SCAN_COUNT
+        ):
+            batch.append(key)
+            if len(batch) >= CACHE_CLEANUP_SCAN_COUNT:
+                unlinked += await async_redis_client.unlink(*batch)
+                batch = []
+        if batch:
+            unlinked += await async_redis_client.unlink(*batch)
+
+        self._stats["unlinked_keys"] += unlinked
+        logging.info(
+            f"Unlinked {unlinked} keys of cache namespace {self.name} v{version}"
+        )
+        return unlinked
+
+    def get_stats(self) -> dict:
+        return {"version": self._version, **self._stats}
+
+
+# Conversations of the sessions, see `agent_state_cache_wrapper`
+session_cache_namespace = CacheNamespace(name="session")
+# Detected intents, see `IntentCache`
+intent_cache_namespace = CacheNamespace(name="intent")
+# Embedding vectors, see `CachedEmbeddings`
+embedding_cache_namespace = CacheNamespace(name="embedding")
+
+CACHE_NAMESPACES = {
+    namespace.name: namespace
+    for namespace in (
+        session_cache_namespace,
+        intent_cache_namespace,
+        embedding_cache_namespace,
+    )
+}
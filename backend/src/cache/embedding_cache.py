@@ -0,0 +1,263 @@
+# src.cache.embedding_cache
+import hashlib
+import logging
+import os
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import numpy as np
+import redis
+from langchain_core.embeddings import Embeddings
+
+from src.cache import async_redis_binary_client, redis_binary_client
+from src.cache.cache_namespace import embedding_cache_namespace
+from src.common.metrics import EMBEDDING_CACHE_REQUESTS
+
+# Vectors kept in memory by each worker, 0 disables the tier
+EMBEDDING_LOCAL_CACHE_SIZE = int(os.getenv("EMBEDDING_LOCAL_CACHE_SIZE", "4096"))
+# Seconds vectors are kept in Redis, 0 disables the tier
+EMBEDDING_CACHE_TTL_SECONDS = int(os.getenv("EMBEDDING_CACHE_TTL_SECONDS", "2592000"))
+
+# Vectors are stored as little-endian float32, 4 bytes per dimension
+VECTOR_DTYPE = np.dtype("<f4")
+
+
+def _normalize_text(text: str) -> str:
+    # Only what cannot change the embedding: Unicode form and spacing
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class LocalEmbeddingCache:
+    """
+    In-process LRU of embedding vectors, shared by every `CachedEmbeddings`
+    of the worker. It holds the vectors of one version of the embedding cache
+    namespace, see `sync_version`.
+    """
+
+    def __init__(self, max_size: int = EMBEDDING_LOCAL_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._version: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def sync_version(self, version: int) -> None:
+        """
+        Empty the LRU when the namespace was invalidated since it was filled.
+        """
+        with self._lock:
+            if self._version != version:
+                self._entries.clear()
+                self._version = version
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        vectors = {}
+        with self._lock:
+            for key in keys:
+                vector = self._entries.get(key)
+                if vector is not None:
+                    self._entries.move_to_end(key)
+                    vectors[key] = vector
+        return vectors
+
+    def set_many(self, vectors: Dict[str, np.ndarray]) -> None:
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            for key, vector in vectors.items():
+                self._entries[key] = vector
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+local_embedding_cache = LocalEmbeddingCache()
+
+_stats = {"local_hit": 0, "redis_hit": 0, "miss": 0}
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper reusing the vectors of texts already embedded, from the
+    LRU of the worker, then from Redis where they are shared by the workers as
+    packed float32 bytes. Only the texts found in neither are sent to the
+    embedding model, in a single call.
+
+    Vectors are keyed by model, kind (query or document, which the model may
+    embed differently) and a hash of the normalized text.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        model: str,
+        ttl_seconds: int = EMBEDDING_CACHE_TTL_SECONDS,
+    ):
+        self.embeddings = embeddings
+        self.model = model
+        self.ttl_seconds = ttl_seconds
+
+    def _cache_key(self, kind: str, text: str) -> str:
+        text_hash = hashlib.sha1(_normalize_text(text).encode()).hexdigest()
+        return f"{self.model}:{kind}:{text_hash}"
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed("document", texts, self.embeddings.embed_documents)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(
+            "query", [text], lambda texts: [self.embeddings.embed_query(texts[0])]
+        )[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self._aembed("document", texts, self.embeddings.aembed_documents)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        async def embed(texts: List[str]) -> List[List[float]]:
+            return [await self.embeddings.aembed_query(texts[0])]
+
+        return (await self._aembed("query", [text], embed))[0]
+
+    def _embed(
+        self,
+        kind: str,
+        texts: List[str],
+        embed: Callable[[List[str]], List[List[float]]],
+    ) -> List[List[float]]:
+        try:
+            version = embedding_cache_namespace.get_version()
+        except redis.RedisError as e:
+            logging.warning(f"Cannot read the embedding cache version: {e}")
+            version = embedding_cache_namespace.get_cached_version()
+        local_embedding_cache.sync_version(version)
+
+        keys, vectors, missing = self._get_local(kind, texts)
+        if missing and self.ttl_seconds > 0:
+            vectors.update(self._get_redis(list(missing), version))
+
+        missing = {key: text for key, text in missing.items() if key not in vectors}
+        if missing:
+            embedded = self._to_vectors(missing, embed(list(missing.values())))
+            self._set_redis(embedded, version)
+            vectors.update(embedded)
+        return self._finish(keys, vectors)
+
+    async def _aembed(
+        self,
+        kind: str,
+        texts: List[str],
+        embed: Callable[[List[str]], Awaitable[List[List[float]]]],
+    ) -> List[List[float]]:
+        try:
+            version = await embedding_cache_namespace.aget_version()
+        except redis.RedisError as e:
+            logging.warning(f"Cannot read the embedding cache version: {e}")
+            version = embedding_cache_namespace.get_cached_version()
+        local_embedding_cache.sync_version(version)
+
+        keys, vectors, missing = self._get_local(kind, texts)
+        if missing and self.ttl_seconds > 0:
+            vectors.update(await self._aget_redis(list(missing), version))
+
+        missing = {key: text for key, text in missing.items() if key not in vectors}
+        if missing:
+            embedded = self._to_vectors(missing, await embed(list(missing.values())))
+            await self._aset_redis(embedded, version)
+            vectors.update(embedded)
+        return self._finish(keys, vectors)
+
+    def _get_local(self, kind: str, texts: List[str]):
+        """
+        Keys of the texts, the vectors found in the LRU and the texts, by key,
+        of the other ones (each text once).
+        """
+        keys = [self._cache_key(kind, text) for text in texts]
+        vectors = local_embedding_cache.get_many(keys)
+        missing = {key: text for key, text in zip(keys, texts) if key not in vectors}
+        hits = len(set(keys)) - len(missing)
+        _stats["local_hit"] += hits
+        EMBEDDING_CACHE_REQUESTS.labels("local", "hit").inc(hits)
+        EMBEDDING_CACHE_REQUESTS.labels("local", "miss").inc(len(missing))
+        return keys, vectors, missing
+
+    def _to_vectors(
+        self, missing: Dict[str, str], embeddings: List[List[float]]
+    ) -> Dict[str, np.ndarray]:
+        _stats["miss"] += len(missing)
+        return {
+            key: np.asarray(embedding, dtype=VECTOR_DTYPE)
+            for key, embedding in zip(missing, embeddings)
+        }
+
+    def _finish(
+        self, keys: List[str], vectors: Dict[str, np.ndarray]
+    ) -> List[List[float]]:
+        local_embedding_cache.set_many(
+            {key: vectors[key] for key in dict.fromkeys(keys)}
+        )
+        return [vectors[key].tolist() for key in keys]
+
+    def _unpack(self, keys: List[str], blobs: list) -> Dict[str, np.ndarray]:
+        vectors = {
+            key: np.frombuffer(blob, dtype=VECTOR_DTYPE)
+            for key, blob in zip(keys, blobs)
+            if blob is not None
+        }
+        _stats["redis_hit"] += len(vectors)
+        EMBEDDING_CACHE_REQUESTS.labels("redis", "hit").inc(len(vectors))
+        EMBEDDING_CACHE_REQUESTS.labels("redis", "miss").inc(len(keys) - len(vectors))
+        return vectors
+
+    def _get_redis(self, keys: List[str], version: int) -> Dict[str, np.ndarray]:
+        prefix = embedding_cache_namespace.prefix(version)
+        try:
+            blobs = redis_binary_client.mget([prefix + key for key in keys])
+        except redis.RedisError as e:
+            logging.warning(f"Cannot read the cached embeddings: {e}")
+            return {}
+        return self._unpack(keys, blobs)
+
+    async def _aget_redis(self, keys: List[str], version: int) -> Dict[str, np.ndarray]:
+        prefix = embedding_cache_namespace.prefix(version)
+        try:
+            blobs = await async_redis_binary_client.mget([prefix + key for key in keys])
+        except redis.RedisError as e:
+            logging.warning(f"Cannot read the cached embeddings: {e}")
+            return {}
+        return self._unpack(keys, blobs)
+
+    def _set_redis(self, vectors: Dict[str, np.ndarray], version: int) -> None:
+        if self.ttl_seconds <= 0:
+            return
+        prefix = embedding_cache_namespace.prefix(version)
+        try:
+            with redis_binary_client.pipeline(transaction=False) as pipe:
+                for key, vector in vectors.items():
+                    pipe.set(prefix + key, vector.tobytes(), ex=self.ttl_seconds)
+                pipe.execute()
+        except redis.RedisError as e:
+            logging.warning(f"Cannot cache the embeddings: {e}")
+
+    async def _aset_redis(self, vectors: Dict[str, np.ndarray], version: int) -> None:
+        if self.ttl_seconds <= 0:
+            return
+        prefix = embedding_cache_namespace.prefix(version)
+        try:
+            async with async_redis_binary_client.pipeline(transaction=False) as pipe:
+                for key, vector in vectors.items():
+                    pipe.set(prefix + key, vector.tobytes(), ex=self.ttl_seconds)
+                await pipe.execute()
+        except redis.RedisError as e:
+            logging.warning(f"Cannot cache the embeddings: {e}")
+
+
+def get_embedding_cache_stats() -> dict:
+    return {
+        **_stats,
+        "local_size": len(local_embedding_cache),
+        "local_max_size": local_embedding_cache.max_size,
+    }
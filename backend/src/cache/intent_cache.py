@@ -0,0 +1,283 @@
+# src.cache.intent_cache
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+import numpy as np
+import redis
+from pydantic import model_validator
+
+from src.base.service.base_embedding_service import BaseEmbeddingService
+from src.cache import async_redis_client
+from src.cache.cache_namespace import intent_cache_namespace
+from src.common.message_codec import iter_message_payloads
+from src.common.metrics import BACKEND_LATENCY, INTENT_CACHE_REQUESTS, observe_latency
+
+# Seconds a detected intent is reused, 0 disables the cache
+INTENT_CACHE_TTL_SECONDS = int(os.getenv("INTENT_CACHE_TTL_SECONDS", "86400"))
+# Previous user inputs the cached intents depend on, besides the previous intent
+INTENT_CACHE_CONTEXT_MESSAGES = int(os.getenv("INTENT_CACHE_CONTEXT_MESSAGES", "1"))
+# Cosine similarity from which an input reuses the intent of a similar one,
+# above 1 disables the semantic tier
+INTENT_CACHE_SIMILARITY_THRESHOLD = float(
+    os.getenv("INTENT_CACHE_SIMILARITY_THRESHOLD", "0.92")
+)
+# Inputs kept by each worker for the semantic tier, per previous intent
+INTENT_CACHE_SEMANTIC_SIZE = int(os.getenv("INTENT_CACHE_SEMANTIC_SIZE", "2000"))
+
+
+def normalize_text(text: str) -> str:
+    """
+    Case, punctuation and spacing insensitive form of a user input. Diacritics
+    are kept: they tell Vietnamese words apart.
+    """
+    text = unicodedata.normalize("NFC", text).lower()
+    return " ".join(re.sub(r"[^\w\s]", " ", text).split())
+
+
+def _get_user_inputs(messages: list, count: int) -> List[str]:
+    """
+    The last `count` user inputs of a history, normalized, without building the
+    messages of a `LazyMessageList`.
+    """
+    user_inputs = []
+    if count <= 0:
+        return user_inputs
+    for message in reversed(list(iter_message_payloads(messages))):
+        if isinstance(message, dict):
+            message_type, content = message.get("type"), message.get("content")
+        else:
+            message_type, content = message.type, message.content
+        if message_type == "human" and isinstance(content, str) and content.strip():
+            user_inputs.append(normalize_text(content))
+            if len(user_inputs) == count:
+                break
+    return user_inputs[::-1]
+
+
+class _SemanticIndex:
+    """
+    Ring buffer of the unit embeddings of recent inputs and their intents,
+    searched by cosine similarity.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._vectors: Optional[np.ndarray] = None
+        self._intents: List[Optional[str]] = [None] * size
+        self._expires_at = np.zeros(size)
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def search(
+        self, vector: np.ndarray, threshold: float
+    ) -> Optional[Tuple[str, float]]:
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[1] != len(vector):
+                return None
+            scores = self._vectors @ vector
+            # Expired rows and rows never written
+            scores[self._expires_at <= time.monotonic()] = -1.0
+            index = int(np.argmax(scores))
+            if scores[index] < threshold:
+                return None
+            return self._intents[index], float(scores[index])
+
+    def add(self, vector: np.ndarray, intent: str, ttl: int) -> None:
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[1] != len(vector):
+                self._vectors = np.zeros((self.size, len(vector)), dtype=np.float32)
+                self._expires_at[:] = 0
+            self._vectors[self._next] = vector
+            self._intents[self._next] = intent
+            self._expires_at[self._next] = time.monotonic() + ttl
+            self._next = (self._next + 1) % self.size
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(self._expires_at > time.monotonic()))
+
+
+class IntentCache(BaseEmbeddingService):
+    """
+    Intents detected for user inputs, reused instead of calling the intent
+    detection LLM again.
+
+    The exact tier, shared by the workers in Redis, is keyed by the normalized
+    input, the previous intent and a hash of the last user inputs. On a miss,
+    the semantic tier of the worker reuses the intent of a similar input (by
+    the embedding of the last user inputs and the input) detected with the
+    same previous intent, and promotes it to the exact tier.
+
+    The semantic tier is kept by each worker, which only learns from the
+    inputs it served: its hit rate drops as the number of workers grows. The
+    detection starts along the embedding of the input, and is cancelled on a
+    semantic hit: a miss is no slower than without the cache.
+    """
+
+    ttl_seconds: int = INTENT_CACHE_TTL_SECONDS
+    context_messages: int = INTENT_CACHE_CONTEXT_MESSAGES
+    similarity_threshold: float = INTENT_CACHE_SIMILARITY_THRESHOLD
+    semantic_size: int = INTENT_CACHE_SEMANTIC_SIZE
+
+    @model_validator(mode="after")
+    def __after_init(self):
+        self._indexes: dict[tuple, _SemanticIndex] = {}
+        # Namespace version the semantic tier was filled at, see `_sync_version`
+        self._indexes_version: Optional[int] = None
+        self._lock = threading.Lock()
+        self._stats = {"exact_hit": 0, "semantic_hit": 0, "miss": 0}
+        return self
+
+    async def get_or_detect(
+        self,
+        user_input: str,
+        previous_intent: Optional[str],
+        messages: list,
+        detect: Callable[[], Awaitable[Optional[str]]],
+        scope: str = "",
+    ) -> Optional[str]:
+        """
+        Intent of `user_input`, cached or else detected by `detect`, whose
+        result is cached unless it is None.
+
+        Args:
+            messages: the history before `user_input`.
+            scope: identifies the detector (model and prompt), so that a new
+                prompt does not reuse the intents detected by the previous one.
+        """
+        if self.ttl_seconds <= 0:
+            return await detect()
+
+        text = normalize_text(user_input)
+        context = _get_user_inputs(messages, self.context_messages)
+        context_hash = hashlib.sha1("\n".join(context).encode()).hexdigest()
+        exact_key = hashlib.sha1(
+            json.dumps(
+                [scope, previous_intent, context_hash, text], ensure_ascii=False
+            ).encode()
+        ).hexdigest()
+
+        intent = await self._get_exact(exact_key)
+        if intent is not None:
+            self._record("exact", "hit")
+            return intent
+        self._record("exact", "miss")
+
+        if self.semantic_size <= 0 or self.similarity_threshold > 1:
+            self._stats["miss"] += 1
+            intent = await detect()
+            if intent is not None:
+                await self._set_exact(exact_key, intent)
+            return intent
+
+        # The input is embedded and searched during the detection
+        index = self._get_index((scope, previous_intent))
+        detection = asyncio.create_task(detect())
+        try:
+            vector = await self._embed("\n".join(context + [text]))
+            match = None
+            if vector is not None:
+                match = index.search(vector, self.similarity_threshold)
+        except BaseException:
+            detection.cancel()
+            raise
+
+        if match is not None:
+            detection.cancel()
+            intent, similarity = match
+            self._record("semantic", "hit")
+            logging.debug(f"Intent of '{text}' reused at similarity {similarity:.3f}")
+            await self._set_exact(exact_key, intent)
+            return intent
+        if vector is not None:
+            self._record("semantic", "miss")
+
+        self._stats["miss"] += 1
+        intent = await detection
+        if intent is not None:
+            await self._set_exact(exact_key, intent)
+            if vector is not None:
+                index.add(vector, intent, self.ttl_seconds)
+        return intent
+
+    async def _get_exact(self, exact_key: str) -> Optional[str]:
+        # The namespace version is checked in the same round trip as the intent
+        version = intent_cache_namespace.get_cached_version()
+        try:
+            async with async_redis_client.pipeline(transaction=False) as pipe:
+                intent_cache_namespace.queue_version(pipe)
+                pipe.get(intent_cache_namespace.prefix(version) + exact_key)
+                current_version, intent = await pipe.execute()
+        except redis.RedisError as e:
+            logging.warning(f"Cannot read the cached intent: {e}")
+            return None
+
+        current_version = intent_cache_namespace.update_version(current_version)
+        self._sync_version(current_version)
+        if current_version != version:
+            return await self._get_exact(exact_key)
+        return intent
+
+    async def _set_exact(self, exact_key: str, intent: str) -> None:
+        try:
+            await async_redis_client.set(
+                await intent_cache_namespace.akey(exact_key),
+                intent,
+                ex=self.ttl_seconds,
+            )
+        except redis.RedisError as e:
+            logging.warning(f"Cannot cache the detected intent: {e}")
+
+    def _sync_version(self, version: int) -> None:
+        # An invalidation of the namespace empties the semantic tier as well
+        with self._lock:
+            if self._indexes_version != version:
+                self._indexes.clear()
+                self._indexes_version = version
+
+    def _get_index(self, bucket: tuple) -> _SemanticIndex:
+        with self._lock:
+            index = self._indexes.get(bucket)
+            if index is None:
+                index = self._indexes[bucket] = _SemanticIndex(self.semantic_size)
+            return index
+
+    async def _embed(self, text: str) -> Optional[np.ndarray]:
+        try:
+            with observe_latency(
+                BACKEND_LATENCY, backend="embedding", operation="embed_query"
+            ):
+                embedding = await self._embeddings.aembed_query(text)
+        except Exception as e:
+            logging.warning(f"Cannot embed the input for the intent cache: {e}")
+            return None
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def _record(self, tier: str, result: str) -> None:
+        INTENT_CACHE_REQUESTS.labels(tier, result).inc()
+        if result == "hit":
+            self._stats[f"{tier}_hit"] += 1
+
+    def get_stats(self) -> dict:
+        lookups = sum(self._stats.values())
+        hits = self._stats["exact_hit"] + self._stats["semantic_hit"]
+        with self._lock:
+            semantic_entries = sum(len(index) for index in self._indexes.values())
+        return {
+            **self._stats,
+            "hit_rate": round(hits / lookups, 3) if lookups else None,
+            "semantic_entries": semantic_entries,
+            "similarity_threshold": self.similarity_threshold,
+        }
+
+
+intent_cache = IntentCache()
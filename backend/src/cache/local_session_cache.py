@@ -0,0 +1,94 @@
+# src.cache.local_session_cache
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from src.cache.message_log import MessageLog
+from src.common.metrics import SESSION_CACHE_REQUESTS
+
+# Maximum number of sessions kept in memory by each worker, 0 disables the tier
+SESSION_LOCAL_CACHE_SIZE = int(os.getenv("SESSION_LOCAL_CACHE_SIZE", "1024"))
+
+
+class LocalSessionCache:
+    """
+    In-process LRU of deserialized session logs, in front of the Redis message log.
+
+    Entries carry the version of the Redis log they mirror. They are only used
+    once Redis confirmed that version is still the current one, so a session
+    updated by another worker is never served from a stale copy; the check
+    costs a few bytes instead of the whole history.
+    """
+
+    def __init__(self, max_size: int = SESSION_LOCAL_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries: OrderedDict[str, MessageLog] = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hit": 0, "miss": 0, "stale": 0}
+
+    def get_version(self, cache_key: str) -> Optional[int]:
+        """
+        Version of the local copy of a session, if any.
+        """
+        message_log = self._entries.get(cache_key)
+        return message_log.version if message_log is not None else None
+
+    def get(self, cache_key: str, version: int) -> Optional[MessageLog]:
+        """
+        Local copy of a session if it is at `version`, the current version in Redis.
+        """
+        with self._lock:
+            message_log = self._entries.get(cache_key)
+            if message_log is None:
+                result = "miss"
+            elif message_log.version != version:
+                result = "stale"
+                del self._entries[cache_key]
+            else:
+                result = "hit"
+                self._entries.move_to_end(cache_key)
+            self._stats[result] += 1
+
+        SESSION_CACHE_REQUESTS.labels("local", result).inc()
+        if result != "hit":
+            return None
+        # Callers append to the messages, never share the cached list
+        return MessageLog(
+            message_log.messages.copy(), message_log.intent, message_log.version
+        )
+
+    def set(self, cache_key: str, message_log: MessageLog) -> None:
+        """
+        Keep a copy of a session, as stored in Redis at `message_log.version`.
+        """
+        if self.max_size <= 0 or not message_log.version:
+            return
+        with self._lock:
+            self._entries[cache_key] = MessageLog(
+                message_log.messages.copy(), message_log.intent, message_log.version
+            )
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def discard(self, cache_key: str) -> None:
+        with self._lock:
+            self._entries.pop(cache_key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> dict:
+        """
+        Size and hit / miss / stale counts of this worker.
+        """
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            **self._stats,
+        }
+
+
+local_session_cache = LocalSessionCache()
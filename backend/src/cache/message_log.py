@@ -0,0 +1,442 @@
+# src.cache.message_log
+import json
+import os
+import time
+from typing import List, NamedTuple, Optional
+
+import zstandard
+from langchain_core.messages import BaseMessage, HumanMessage, ToolMessage
+from redis.asyncio.client import Pipeline
+
+from src.cache import async_redis_binary_client
+from src.cache.message_serializer import dumps_message, loads_message_dict
+from src.cache.pipeline_script import PipelineScript, execute_pipeline
+from src.common.message_codec import LazyMessageList, iter_message_payloads
+from src.common.metrics import BACKEND_LATENCY, observe_latency
+from src.repositories.agent.conversation_snapshot import (
+    compact_messages,
+    split_summary,
+    summary_message,
+)
+
+# Number of last messages read back for a turn, 0 reads the whole history.
+# The window is aligned on a human message so tool results keep their tool call.
+SESSION_HISTORY_WINDOW = int(os.getenv("SESSION_HISTORY_WINDOW", "0"))
+
+# Every change of a log bumps the `version` field of its meta hash, so copies of
+# the log kept in memory can be checked without transferring the messages. A
+# (re)filled log starts from the current time in microseconds rather than 1, so
+# versions keep increasing when a log expires and is filled again.
+
+# The TTL of a log grows with its activity: `base + turns * extend` seconds,
+# capped by `max`, where `turns` counts the turns appended since it was filled.
+# The expiry time of every log is kept in the `EXPIRY_INDEX_KEY` sorted set, so
+# the logs about to expire can be offloaded to their cold form instead of being
+# dropped, see `offload_expiring_logs`.
+EXPIRY_INDEX_KEY = "session_cache:expiry"
+
+REFRESH_TTL_FUNCTION = """
+local function refresh_ttl(base, extend, max_ttl, now, member)
+    local turns = tonumber(redis.call('HGET', KEYS[2], 'turns') or '0')
+    local ttl = math.min(tonumber(base) + turns * tonumber(extend), tonumber(max_ttl))
+    redis.call('EXPIRE', KEYS[1], ttl)
+    redis.call('EXPIRE', KEYS[2], ttl)
+    redis.call('ZADD', KEYS[4], tonumber(now) + ttl, member)
+end
+"""
+
+# KEYS: messages list, meta hash, cold form, expiry index
+# ARGV: known version, start of the window, base, extend, max, now, cache key
+# Returns nil when not cached, {'cold', cold form} when only the cold form is,
+# else {version, intent[, messages]}: the messages are left out when the
+# version is the known one.
+READ_SCRIPT = REFRESH_TTL_FUNCTION + """
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    local cold = redis.call('GET', KEYS[3])
+    if cold then
+        return {'cold', cold}
+    end
+    return nil
+end
+refresh_ttl(ARGV[3], ARGV[4], ARGV[5], ARGV[6], ARGV[7])
+local version = redis.call('HGET', KEYS[2], 'version') or '0'
+local intent = redis.call('HGET', KEYS[2], 'intent') or ''
+if version == ARGV[1] then
+    return {version, intent}
+end
+return {version, intent, redis.call('LRANGE', KEYS[1], ARGV[2], -1)}
+"""
+
+# KEYS: messages list, meta hash, cold form, expiry index
+# ARGV: version, intent, ttl, now, cache key, messages...
+# (Re)writes a whole log, which starts with no turn, dropping its cold form.
+# Returns the version.
+FILL_SCRIPT = """
+redis.call('DEL', KEYS[1], KEYS[2], KEYS[3])
+for index = 6, #ARGV, 1000 do
+    redis.call('RPUSH', KEYS[1], unpack(ARGV, index, math.min(index + 999, #ARGV)))
+end
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+redis.call('HSET', KEYS[2], 'intent', ARGV[2], 'version', ARGV[1], 'turns', 0)
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+redis.call('ZADD', KEYS[4], tonumber(ARGV[4]) + tonumber(ARGV[3]), ARGV[5])
+return ARGV[1]
+"""
+
+# KEYS: messages list, meta hash, unused, expiry index
+# ARGV: base, extend, max, now, cache key, intent, messages...
+# Appends only if the log still exists: when it expired during the turn, the
+# history has to be refilled from the database on the next turn instead.
+# Returns the new version, or 0 when nothing was appended.
+APPEND_SCRIPT = REFRESH_TTL_FUNCTION + """
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    return 0
+end
+if #ARGV > 6 then
+    redis.call('RPUSH', KEYS[1], unpack(ARGV, 7))
+end
+redis.call('HSET', KEYS[2], 'intent', ARGV[6])
+redis.call('HINCRBY', KEYS[2], 'turns', 1)
+refresh_ttl(ARGV[1], ARGV[2], ARGV[3], ARGV[4], ARGV[5])
+return redis.call('HINCRBY', KEYS[2], 'version', 1)
+"""
+
+# KEYS: messages list, meta hash, cold form, expiry index
+# ARGV: cache key, version read, expiry deadline, cold TTL, cold form
+# Replaces the log by its cold form if it is still at the version read and due
+# to expire before the deadline. Returns 1 when offloaded, 0 when the log was
+# used since (its TTL was extended), -1 when it expired or changed meanwhile.
+OFFLOAD_SCRIPT = """
+local expires_at = redis.call('ZSCORE', KEYS[4], ARGV[1])
+if expires_at and tonumber(expires_at) > tonumber(ARGV[3]) then
+    return 0
+end
+redis.call('ZREM', KEYS[4], ARGV[1])
+if redis.call('HGET', KEYS[2], 'version') ~= ARGV[2] then
+    return -1
+end
+redis.call('SET', KEYS[3], ARGV[5], 'EX', ARGV[4])
+redis.call('DEL', KEYS[1], KEYS[2])
+return 1
+"""
+
+_read = PipelineScript(READ_SCRIPT)
+_fill = PipelineScript(FILL_SCRIPT)
+_append = PipelineScript(APPEND_SCRIPT)
+_offload = PipelineScript(OFFLOAD_SCRIPT)
+
+
+class SessionTtl(NamedTuple):
+    """
+    TTL of a session log, in seconds: `base + turns * extend`, capped by `max`.
+    """
+
+    base: int
+    extend: int
+    max: int
+
+
+class MessageLog:
+    """
+    Cached conversation of a session: its messages (or the last window of
+    them), its intent and the version of the log they were read from.
+
+    `messages` is None when the log was read as unchanged from a known version,
+    and `version` is 0 for a log not cached yet.
+    """
+
+    def __init__(
+        self,
+        messages: Optional[List[BaseMessage]],
+        intent: Optional[str],
+        version: int = 0,
+        cold: bool = False,
+    ):
+        self.messages = messages
+        self.intent = intent
+        self.version = version
+        # Restored from the cold form of an offloaded log, to be filled again
+        self.cold = cold
+
+
+def _messages_key(cache_key: str) -> str:
+    return f"{cache_key}:messages"
+
+
+def _meta_key(cache_key: str) -> str:
+    return f"{cache_key}:meta"
+
+
+def _cold_key(cache_key: str) -> str:
+    return f"{cache_key}:cold"
+
+
+def _keys(cache_key: str) -> List[str]:
+    return [
+        _messages_key(cache_key),
+        _meta_key(cache_key),
+        _cold_key(cache_key),
+        EXPIRY_INDEX_KEY,
+    ]
+
+
+def _dumps_cold_form(raw_messages: List[bytes], intent: Optional[str]) -> bytes:
+    """
+    Compact form of a log: its last messages and a summary of the older ones
+    (see `compact_messages`) with its intent, compressed.
+    """
+    messages, summary = split_summary(
+        [loads_message_dict(raw_message) for raw_message in raw_messages]
+    )
+    messages, summary = compact_messages(messages, summary)
+    return zstandard.ZstdCompressor().compress(
+        json.dumps(
+            {"messages": messages, "summary": summary, "intent": intent},
+            ensure_ascii=False,
+        ).encode()
+    )
+
+
+def _loads_cold_form(data: bytes) -> MessageLog:
+    cold_form = json.loads(zstandard.ZstdDecompressor().decompress(data))
+    messages = LazyMessageList(cold_form["messages"])
+    if cold_form["summary"]:
+        messages.insert(0, summary_message(cold_form["summary"]))
+    return MessageLog(messages, cold_form["intent"], cold=True)
+
+
+def align_history_window(messages: List[BaseMessage]) -> List[BaseMessage]:
+    """
+    Drop the leading messages of a window up to its first human message, so it
+    does not start in the middle of a tool call exchange.
+    """
+    for index, message in enumerate(messages):
+        if isinstance(message, HumanMessage):
+            return messages[index:]
+    # No human message in the window, at least never start with a tool result
+    index = 0
+    while index < len(messages) and isinstance(messages[index], ToolMessage):
+        index += 1
+    return messages[index:]
+
+
+def window_history(messages: List[BaseMessage]) -> List[BaseMessage]:
+    """
+    Keep the last `SESSION_HISTORY_WINDOW` messages of a history, aligned.
+    """
+    if SESSION_HISTORY_WINDOW <= 0 or len(messages) <= SESSION_HISTORY_WINDOW:
+        return messages
+    return align_history_window(messages[-SESSION_HISTORY_WINDOW:])
+
+
+def queue_read_message_logs(
+    pipe: Pipeline,
+    cache_keys: List[str],
+    ttl: SessionTtl,
+    known_versions: Optional[List[Optional[int]]] = None,
+) -> None:
+    """
+    Queue the reads of `read_message_logs` in a pipeline of the binary client,
+    see `parse_message_logs` for their replies.
+    """
+    start = -SESSION_HISTORY_WINDOW if SESSION_HISTORY_WINDOW > 0 else 0
+    known_versions = known_versions or [None] * len(cache_keys)
+    now = int(time.time())
+    for cache_key, known_version in zip(cache_keys, known_versions):
+        _read.queue(
+            pipe,
+            keys=_keys(cache_key),
+            args=[known_version or "", start, *ttl, now, cache_key],
+        )
+
+
+def parse_message_logs(replies: list) -> List[Optional[MessageLog]]:
+    """
+    The logs read by `queue_read_message_logs`, from the replies of its commands.
+    """
+    message_logs = []
+    for reply in replies:
+        if reply is None:
+            message_logs.append(None)
+            continue
+        if reply[0] == b"cold":
+            message_logs.append(_loads_cold_form(reply[1]))
+            continue
+
+        version, intent = int(reply[0]), reply[1].decode() or None
+        if len(reply) < 3:  # Unchanged since the known version
+            message_logs.append(MessageLog(None, intent, version))
+            continue
+
+        # Only the messages a turn reads are built, see `LazyMessageList`
+        messages = LazyMessageList(
+            loads_message_dict(raw_message) for raw_message in reply[2]
+        )
+        if SESSION_HISTORY_WINDOW > 0:
+            messages = align_history_window(messages)
+        message_logs.append(MessageLog(messages, intent, version))
+    return message_logs
+
+
+async def read_message_logs(
+    cache_keys: List[str],
+    ttl: SessionTtl,
+    known_versions: Optional[List[Optional[int]]] = None,
+) -> List[Optional[MessageLog]]:
+    """
+    Read the cached conversations of several sessions in one round trip,
+    refreshing their TTL.
+
+    Args:
+        cache_keys: the cache keys of the sessions.
+        ttl: the TTL of the logs.
+        known_versions: the version of the copy already held for each session,
+            if any; the messages of a log still at that version are not read.
+    Returns:
+        List[Optional[MessageLog]]: the log of every session, None when not
+            cached. A log only cached in its cold form is returned with `cold`
+            set, and has to be filled again.
+    """
+    if not cache_keys:
+        return []
+    async with async_redis_binary_client.pipeline(transaction=False) as pipe:
+        queue_read_message_logs(pipe, cache_keys, ttl, known_versions)
+        with observe_latency(BACKEND_LATENCY, backend="redis", operation="read_log"):
+            replies = await execute_pipeline(async_redis_binary_client, pipe)
+    return parse_message_logs(replies)
+
+
+def queue_write_message_logs(
+    pipe: Pipeline, items: List[tuple[str, MessageLog]], ttl: SessionTtl
+) -> None:
+    """
+    Queue the writes of `write_message_logs` in a pipeline of the binary
+    client, each replying the new version of its log.
+    """
+    fill_version = time.time_ns() // 1000
+    now = int(time.time())
+    for cache_key, message_log in items:
+        raw_messages = [
+            dumps_message(message)
+            for message in iter_message_payloads(message_log.messages)
+        ]
+        if message_log.version:
+            _append.queue(
+                pipe,
+                keys=_keys(cache_key),
+                args=[
+                    *ttl,
+                    now,
+                    cache_key,
+                    message_log.intent or "",
+                    *raw_messages,
+                ],
+            )
+        else:
+            _fill.queue(
+                pipe,
+                keys=_keys(cache_key),
+                args=[
+                    fill_version,
+                    message_log.intent or "",
+                    ttl.base,
+                    now,
+                    cache_key,
+                    *raw_messages,
+                ],
+            )
+
+
+async def write_message_logs(
+    items: List[tuple[str, MessageLog]], ttl: SessionTtl
+) -> List[int]:
+    """
+    Write the turns of several sessions to their cached conversation, in one
+    round trip, extending their TTL:
+
+    - a log at version 0 is written whole, e.g. the history loaded from the
+      database followed by the new messages;
+    - any other log holds the new messages of a turn, appended if the cached
+      conversation still exists. When it expired during the turn, it is
+      refilled from the database when next read instead.
+
+    Args:
+        items: `(cache_key, message_log)` pairs.
+        ttl: the TTL of the logs.
+    Returns:
+        List[int]: the new version of every log, 0 for the expired ones.
+    """
+    if not items:
+        return []
+    async with async_redis_binary_client.pipeline(transaction=False) as pipe:
+        queue_write_message_logs(pipe, items, ttl)
+        with observe_latency(BACKEND_LATENCY, backend="redis", operation="write_log"):
+            versions = await execute_pipeline(async_redis_binary_client, pipe)
+    return [int(version) for version in versions]
+
+
+async def delete_message_logs(cache_keys: List[str]) -> int:
+    """
+    Remove the cached conversation of several sessions, hot and cold.
+
+    Returns:
+        int: the number of sessions which had a cached conversation.
+    """
+    async with async_redis_binary_client.pipeline(transaction=False) as pipe:
+        for cache_key in cache_keys:
+            pipe.unlink(
+                _messages_key(cache_key), _meta_key(cache_key), _cold_key(cache_key)
+            )
+        if cache_keys:
+            pipe.zrem(EXPIRY_INDEX_KEY, *cache_keys)
+        replies = await pipe.execute() if cache_keys else []
+    return sum(1 for deleted in replies[: len(cache_keys)] if deleted)
+
+
+async def offload_expiring_logs(margin: int, cold_ttl: int, limit: int) -> dict:
+    """
+    Replace the logs expiring within `margin` seconds by their cold form, kept
+    `cold_ttl` seconds: the session is then restored from Redis rather than
+    from the database when its user comes back.
+
+    Returns:
+        dict: the number of logs `offloaded`, `extended` (used since they were
+            listed) and `expired` (gone before they could be offloaded).
+    """
+    deadline = int(time.time()) + margin
+    cache_keys = [
+        cache_key.decode()
+        for cache_key in await async_redis_binary_client.zrangebyscore(
+            EXPIRY_INDEX_KEY, "-inf", deadline, start=0, num=limit
+        )
+    ]
+    report = {"offloaded": 0, "extended": 0, "expired": 0}
+    if not cache_keys:
+        return report
+
+    async with async_redis_binary_client.pipeline(transaction=False) as pipe:
+        for cache_key in cache_keys:
+            pipe.lrange(_messages_key(cache_key), 0, -1)
+            pipe.hmget(_meta_key(cache_key), "version", "intent")
+        with observe_latency(BACKEND_LATENCY, backend="redis", operation="read_log"):
+            replies = await pipe.execute()
+
+    async with async_redis_binary_client.pipeline(transaction=False) as pipe:
+        for index, cache_key in enumerate(cache_keys):
+            raw_messages, (version, intent) = replies[2 * index : 2 * index + 2]
+            cold_form = b""
+            if version is not None:
+                cold_form = _dumps_cold_form(
+                    raw_messages, intent.decode() if intent else None
+                )
+            _offload.queue(
+                pipe,
+                keys=_keys(cache_key),
+                args=[cache_key, version or b"", deadline, cold_ttl, cold_form],
+            )
+        with observe_latency(BACKEND_LATENCY, backend="redis", operation="offload_log"):
+            results = await execute_pipeline(async_redis_binary_client, pipe)
+
+    for result in results:
+        report[{1: "offloaded", 0: "extended", -1: "expired"}[int(result)]] += 1
+    return report
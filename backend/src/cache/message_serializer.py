@@ -0,0 +1,131 @@
+# src.cache.message_serializer
+import json
+import os
+from typing import Any, Dict
+
+from langchain_core.messages import BaseMessage
+
+from src.common.message_codec import message_from_dict, message_to_dict
+
+# Format used to write cached messages: "json", "msgpack" or "msgpack+zstd".
+# Every format is always readable, so a new one can be rolled out by deploying
+# first and switching this setting once every worker runs the new code.
+SESSION_CACHE_SERIALIZER = os.getenv("SESSION_CACHE_SERIALIZER", "json")
+# Messages smaller than this are not worth compressing with "msgpack+zstd"
+SESSION_CACHE_COMPRESS_MIN_BYTES = int(
+    os.getenv("SESSION_CACHE_COMPRESS_MIN_BYTES", "256")
+)
+SESSION_CACHE_COMPRESS_LEVEL = int(os.getenv("SESSION_CACHE_COMPRESS_LEVEL", "3"))
+
+# Version tags prefixed to the encoded messages. JSON stays untagged, as written
+# before tags existed (a JSON object always starts with "{").
+MSGPACK_TAG = b"m1:"
+ZSTD_MSGPACK_TAG = b"z1:"
+
+
+class JsonMessageSerializer:
+    """
+    Plain JSON, as stored in the database.
+    """
+
+    def dumps(self, message: Any) -> bytes:
+        if isinstance(message, BaseMessage):
+            # Same output as `message_to_dict`, serialized by pydantic-core
+            return message.model_dump_json().encode()
+        return json.dumps(message_to_dict(message), ensure_ascii=False).encode()
+
+    def loads_dict(self, data: bytes) -> dict:
+        return json.loads(data)
+
+    def loads(self, data: bytes) -> BaseMessage:
+        return message_from_dict(self.loads_dict(data))
+
+
+class MsgpackMessageSerializer:
+    """
+    msgpack: smaller than JSON and several times faster to decode.
+    """
+
+    def dumps(self, message: Any) -> bytes:
+        import msgpack
+
+        return MSGPACK_TAG + msgpack.packb(
+            message_to_dict(message), use_bin_type=True, default=str
+        )
+
+    def loads_dict(self, data: bytes) -> dict:
+        import msgpack
+
+        return msgpack.unpackb(data[len(MSGPACK_TAG) :])
+
+    def loads(self, data: bytes) -> BaseMessage:
+        return message_from_dict(self.loads_dict(data))
+
+
+class ZstdMsgpackMessageSerializer(MsgpackMessageSerializer):
+    """
+    msgpack compressed with zstd when large enough, e.g. tool results carrying
+    product descriptions.
+    """
+
+    def dumps(self, message: Any) -> bytes:
+        import zstandard
+
+        data = super().dumps(message)
+        if len(data) < SESSION_CACHE_COMPRESS_MIN_BYTES:
+            return data
+        return ZSTD_MSGPACK_TAG + zstandard.compress(
+            data[len(MSGPACK_TAG) :], SESSION_CACHE_COMPRESS_LEVEL
+        )
+
+    def loads_dict(self, data: bytes) -> dict:
+        import zstandard
+
+        if not data.startswith(ZSTD_MSGPACK_TAG):
+            return super().loads_dict(data)
+        return super().loads_dict(
+            MSGPACK_TAG + zstandard.decompress(data[len(ZSTD_MSGPACK_TAG) :])
+        )
+
+
+SERIALIZERS: Dict[str, Any] = {
+    "json": JsonMessageSerializer(),
+    "msgpack": MsgpackMessageSerializer(),
+    "msgpack+zstd": ZstdMsgpackMessageSerializer(),
+}
+
+if SESSION_CACHE_SERIALIZER not in SERIALIZERS:
+    raise ValueError(
+        f"Unknown SESSION_CACHE_SERIALIZER '{SESSION_CACHE_SERIALIZER}', "
+        f"expected one of {list(SERIALIZERS)}"
+    )
+
+
+def dumps_message(message: Any, serializer: str = SESSION_CACHE_SERIALIZER) -> bytes:
+    """
+    Encode a message for the session cache with the configured serializer.
+    """
+    return SERIALIZERS[serializer].dumps(message)
+
+
+def _serializer_of(data: bytes) -> Any:
+    if data.startswith(ZSTD_MSGPACK_TAG):
+        return SERIALIZERS["msgpack+zstd"]
+    if data.startswith(MSGPACK_TAG):
+        return SERIALIZERS["msgpack"]
+    return SERIALIZERS["json"]
+
+
+def loads_message(data: bytes) -> BaseMessage:
+    """
+    Decode a cached message, whichever serializer wrote it.
+    """
+    return _serializer_of(data).loads(data)
+
+
+def loads_message_dict(data: bytes) -> dict:
+    """
+    Decode a cached message into its flattened dict (see `message_to_dict`),
+    for a `LazyMessageList`.
+    """
+    return _serializer_of(data).loads_dict(data)
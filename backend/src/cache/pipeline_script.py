@@ -0,0 +1,84 @@
+# src.cache.pipeline_script
+import hashlib
+from typing import List
+
+from redis.asyncio import Redis
+from redis.asyncio.client import Pipeline
+from redis.exceptions import NoScriptError
+
+# Source of every `PipelineScript` by SHA1, to load the ones Redis lost
+_SCRIPTS: dict[str, str] = {}
+# SHA1 of the scripts this process loaded, see `PipelineScript.load`
+_loaded_scripts: set[str] = set()
+
+
+class PipelineScript:
+    """
+    Lua script queued in pipelines as a bare `EVALSHA`.
+
+    redis-py checks the scripts of a pipeline with `SCRIPT EXISTS` before every
+    execution, an extra round trip; here a script is only loaded when Redis
+    does not know it (after a restart or `SCRIPT FLUSH`), see `execute_pipeline`.
+    Transactions cannot run a refused call again on its own, call `load` before
+    queueing a script in one.
+    """
+
+    def __init__(self, script: str):
+        self.script = script
+        self.sha = hashlib.sha1(script.encode()).hexdigest()
+        _SCRIPTS[self.sha] = script
+
+    def queue(self, pipe: Pipeline, keys: List, args: List) -> None:
+        pipe.evalsha(self.sha, len(keys), *keys, *args)
+
+    async def load(self, client: Redis) -> None:
+        """
+        Load the script into Redis, unless this process did already.
+        """
+        if self.sha not in _loaded_scripts:
+            await _load_scripts(client, [self.sha])
+
+
+async def _load_scripts(client: Redis, shas) -> None:
+    async with client.pipeline(transaction=False) as pipe:
+        for sha in shas:
+            pipe.script_load(_SCRIPTS[sha])
+        await pipe.execute()
+    _loaded_scripts.update(shas)
+
+
+async def execute_pipeline(client: Redis, pipe: Pipeline) -> list:
+    """
+    Execute a pipeline of `client` holding `PipelineScript` calls, in a single
+    round trip unless a script has to be loaded first: the calls refused with
+    `NOSCRIPT` are then run again once the scripts are loaded.
+
+    Raises:
+        NoScriptError: for a transaction, whose other commands ran already.
+            The scripts are loaded, so the transaction can be run again.
+    """
+    commands = list(pipe.command_stack)
+    replies = await pipe.execute(raise_on_error=False)
+
+    missing = [
+        index for index, reply in enumerate(replies) if isinstance(reply, NoScriptError)
+    ]
+    if missing and pipe.is_transaction:
+        _loaded_scripts.clear()  # Redis lost them, e.g. on a restart
+        await _load_scripts(client, {commands[index][0][1] for index in missing})
+        raise replies[missing[0]]
+    if missing:
+        async with client.pipeline(transaction=False) as retry_pipe:
+            for script in {commands[index][0][1] for index in missing}:
+                retry_pipe.script_load(_SCRIPTS[script])
+            for index in missing:
+                args, options = commands[index]
+                retry_pipe.execute_command(*args, **options)
+            retried = await retry_pipe.execute(raise_on_error=False)
+        for index, reply in zip(missing, retried[-len(missing) :]):
+            replies[index] = reply
+
+    for reply in replies:
+        if isinstance(reply, Exception):
+            raise reply
+    return replies
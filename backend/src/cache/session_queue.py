@@ -0,0 +1,285 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+import redis
+
+from src.cache import async_redis_client
+from src.cache.pipeline_script import PipelineScript, execute_pipeline
+from src.common.request_timing import record_timing
+
+# Seconds a queue ticket / in-flight marker stays valid without a heartbeat,
+# after which it is considered abandoned (e.g. the worker was killed)
+SESSION_QUEUE_LEASE_SECONDS = int(os.getenv("SESSION_QUEUE_LEASE_SECONDS", "30"))
+# Maximum seconds a turn waits for the previous turns of its session
+SESSION_QUEUE_TIMEOUT_SECONDS = float(os.getenv("SESSION_QUEUE_TIMEOUT_SECONDS", "120"))
+SESSION_QUEUE_POLL_INTERVAL_SECONDS = float(
+    os.getenv("SESSION_QUEUE_POLL_INTERVAL_SECONDS", "0.05")
+)
+# Seconds the result of a coalesced turn is kept for its duplicates to read
+SINGLE_FLIGHT_RESULT_TTL_SECONDS = int(
+    os.getenv("SINGLE_FLIGHT_RESULT_TTL_SECONDS", "10")
+)
+
+ALIVE_KEY_PREFIX = "session_queue:alive:"
+
+# Returns 1 if `token` is at the head of the queue, 0 if it has to keep waiting and
+# -1 if it is no longer queued. Abandoned tickets (no heartbeat) at the head are dropped.
+TRY_ACQUIRE_SCRIPT = """
+if not redis.call('LPOS', KEYS[1], ARGV[1]) then
+    return -1
+end
+local head = redis.call('LINDEX', KEYS[1], 0)
+while head do
+    if head == ARGV[1] then
+        return 1
+    end
+    if redis.call('EXISTS', ARGV[2] .. head) == 1 then
+        return 0
+    end
+    redis.call('LPOP', KEYS[1])
+    head = redis.call('LINDEX', KEYS[1], 0)
+end
+return -1
+"""
+
+_try_acquire = PipelineScript(TRY_ACQUIRE_SCRIPT)
+
+# In-process single-flight, so duplicates served by the same worker do not poll Redis
+_local_flights: dict[str, asyncio.Future] = {}
+
+
+class SessionQueueTimeoutError(TimeoutError):
+    """Raised when a turn waited too long for the previous turns of its session."""
+
+
+def _queue_key(key: str) -> str:
+    return f"{key}:queue"
+
+
+async def _enqueue(token: str, keys: list[str]) -> list[str]:
+    """
+    Queue a ticket at the tail of every session queue, moving it there from
+    the queues still holding it, and try to acquire them in the same round
+    trip. Returns the keys still held by earlier turns.
+    """
+    # A single MULTI/EXEC keeps the relative order of two tickets identical on every
+    # queue they share, so acquiring several sessions at once cannot deadlock.
+    await _try_acquire.load(async_redis_client)
+    try:
+        replies = await _enqueue_transaction(token, keys)
+    except redis.exceptions.NoScriptError:
+        # Redis lost the script since it was loaded, it is loaded again. The
+        # transaction only moves the ticket to the tail, running it again is safe.
+        replies = await _enqueue_transaction(token, keys)
+    acquired = replies[-len(keys) :]
+    return [key for key, reply in zip(keys, acquired) if reply != 1]
+
+
+async def _enqueue_transaction(token: str, keys: list[str]) -> list:
+    async with async_redis_client.pipeline(transaction=True) as pipe:
+        pipe.set(ALIVE_KEY_PREFIX + token, 1, ex=SESSION_QUEUE_LEASE_SECONDS)
+        for key in keys:
+            pipe.lrem(_queue_key(key), 0, token)
+            pipe.rpush(_queue_key(key), token)
+            pipe.expire(_queue_key(key), SESSION_QUEUE_LEASE_SECONDS * 4)
+        for key in keys:
+            _try_acquire.queue(pipe, [_queue_key(key)], [token, ALIVE_KEY_PREFIX])
+        return await execute_pipeline(async_redis_client, pipe)
+
+
+async def _dequeue(token: str, keys: list[str]) -> None:
+    async with async_redis_client.pipeline(transaction=False) as pipe:
+        for key in keys:
+            pipe.lrem(_queue_key(key), 1, token)
+        pipe.delete(ALIVE_KEY_PREFIX + token)
+        await pipe.execute()
+
+
+async def _heartbeat(token: str, keys: list[str]) -> None:
+    while True:
+        await asyncio.sleep(SESSION_QUEUE_LEASE_SECONDS / 3)
+        # A failed beat is retried on the next one, the lease outlives two of them
+        try:
+            async with async_redis_client.pipeline(transaction=False) as pipe:
+                pipe.expire(ALIVE_KEY_PREFIX + token, SESSION_QUEUE_LEASE_SECONDS)
+                for key in keys:
+                    pipe.expire(_queue_key(key), SESSION_QUEUE_LEASE_SECONDS * 4)
+                await pipe.execute()
+        except redis.RedisError as e:
+            logging.warning(f"Session queue heartbeat failed for {keys}: {e}")
+
+
+@asynccontextmanager
+async def session_lock(*keys: str) -> AsyncIterator[None]:
+    """
+    Serialize turns per session across every worker.
+
+    Each caller takes a ticket in a Redis list per session and runs once its ticket
+    reaches the head of every list, so concurrent turns of a session run one at a
+    time in arrival order. Tickets are kept alive by a heartbeat; the ticket of a
+    crashed worker expires and is skipped by the next waiter.
+
+    Args:
+        keys: the cache keys of the sessions to lock.
+    Raises:
+        SessionQueueTimeoutError: if the sessions are not free within
+            `SESSION_QUEUE_TIMEOUT_SECONDS`.
+    """
+    keys = sorted(set(keys))
+    token = uuid.uuid4().hex
+    started_at = time.monotonic()
+    pending_keys = await _enqueue(token, keys)
+    heartbeat = asyncio.create_task(_heartbeat(token, keys))
+
+    try:
+        while pending_keys:
+            if time.monotonic() - started_at > SESSION_QUEUE_TIMEOUT_SECONDS:
+                raise SessionQueueTimeoutError(
+                    f"Timed out waiting for the previous turns of {pending_keys}"
+                )
+            await asyncio.sleep(SESSION_QUEUE_POLL_INTERVAL_SECONDS)
+
+            async with async_redis_client.pipeline(transaction=False) as pipe:
+                for key in pending_keys:
+                    _try_acquire.queue(
+                        pipe, [_queue_key(key)], [token, ALIVE_KEY_PREFIX]
+                    )
+                replies = await execute_pipeline(async_redis_client, pipe)
+            if -1 in replies:
+                # Our ticket was dropped from a queue (missed heartbeats): give up
+                # the sessions acquired so far and queue again on all of them at
+                # once, keeping the ticket in the same order on every queue
+                pending_keys = await _enqueue(token, keys)
+                continue
+            pending_keys = [
+                key for key, acquired in zip(pending_keys, replies) if acquired != 1
+            ]
+
+        waited = time.monotonic() - started_at
+        record_timing("session_queue.wait", waited)
+        if waited > SESSION_QUEUE_POLL_INTERVAL_SECONDS:
+            logging.info(f"Waited {waited:.2f}s for session queue {keys}")
+        yield
+
+    finally:
+        heartbeat.cancel()
+        await _dequeue(token, keys)
+
+
+class SingleFlight:
+    """
+    Handle of a `single_flight` block.
+
+    `result` is set when an identical turn already ran and its result can be
+    reused. Otherwise the caller is the leader and must call `set_result` once
+    its turn succeeds. Results are kept small: they only need to carry what the
+    duplicate requests respond with.
+    """
+
+    def __init__(self, result: Optional[str] = None):
+        self.result = result
+        self._result_to_publish = None
+
+    def set_result(self, result: str) -> None:
+        self._result_to_publish = result
+
+
+def _flight_key(key: str, user_input: str) -> str:
+    input_hash = hashlib.sha256(user_input.encode()).hexdigest()
+    return f"{key}:flight:{input_hash}"
+
+
+async def _wait_for_leader(flight_key: str, leader_token: str) -> Optional[str]:
+    """
+    Wait for the turn run by another worker, returning its result, or None if
+    the leader went away without one.
+    """
+    started_at = time.monotonic()
+    while time.monotonic() - started_at < SESSION_QUEUE_TIMEOUT_SECONDS:
+        async with async_redis_client.pipeline(transaction=True) as pipe:
+            pipe.get(f"{flight_key}:result:{leader_token}")
+            pipe.get(f"{flight_key}:leader")
+            result, current_leader = await pipe.execute()
+        if result is not None:
+            return result
+        if current_leader != leader_token:
+            return None
+        await asyncio.sleep(SESSION_QUEUE_POLL_INTERVAL_SECONDS)
+
+    raise SessionQueueTimeoutError(f"Timed out waiting for duplicate turn {flight_key}")
+
+
+async def _leader_heartbeat(flight_key: str) -> None:
+    while True:
+        await asyncio.sleep(SESSION_QUEUE_LEASE_SECONDS / 3)
+        try:
+            await async_redis_client.expire(
+                f"{flight_key}:leader", SESSION_QUEUE_LEASE_SECONDS
+            )
+        except redis.RedisError as e:
+            logging.warning(f"Single-flight heartbeat failed for {flight_key}: {e}")
+
+
+@asynccontextmanager
+async def single_flight(key: str, user_input: str) -> AsyncIterator[SingleFlight]:
+    """
+    Coalesce identical turns of a session that are in flight at the same time.
+
+    The first caller becomes the leader and runs the turn; exact duplicates that
+    arrive while it runs (in this worker or another one) wait and reuse its
+    result instead of paying for the same LLM calls again.
+
+    Args:
+        key: the cache key of the session.
+        user_input: the user input of the turn.
+    """
+    flight_key = _flight_key(key, user_input)
+    token = uuid.uuid4().hex
+
+    while True:
+        local_flight = _local_flights.get(flight_key)
+        if local_flight is not None:
+            result = await asyncio.shield(local_flight)
+        else:
+            is_leader = await async_redis_client.set(
+                f"{flight_key}:leader", token, nx=True, ex=SESSION_QUEUE_LEASE_SECONDS
+            )
+            if is_leader:
+                break
+
+            leader_token = await async_redis_client.get(f"{flight_key}:leader")
+            if leader_token is None:
+                continue
+            result = await _wait_for_leader(flight_key, leader_token)
+
+        if result is not None:
+            logging.info(f"Coalesced duplicate turn {flight_key}")
+            yield SingleFlight(result=result)
+            return
+
+    local_flight = asyncio.get_running_loop().create_future()
+    _local_flights[flight_key] = local_flight
+    heartbeat = asyncio.create_task(_leader_heartbeat(flight_key))
+    flight = SingleFlight()
+    try:
+        yield flight
+
+    finally:
+        heartbeat.cancel()
+        async with async_redis_client.pipeline(transaction=False) as pipe:
+            if flight._result_to_publish is not None:
+                pipe.set(
+                    f"{flight_key}:result:{token}",
+                    flight._result_to_publish,
+                    ex=SINGLE_FLIGHT_RESULT_TTL_SECONDS,
+                )
+            pipe.delete(f"{flight_key}:leader")
+            await pipe.execute()
+        _local_flights.pop(flight_key, None)
+        local_flight.set_result(flight._result_to_publish)
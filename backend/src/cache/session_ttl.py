@@ -0,0 +1,159 @@
+# src.cache.session_ttl
+import asyncio
+import logging
+import os
+from typing import Optional
+
+from pydantic import BaseModel, model_validator
+
+from src.cache import async_redis_client
+from src.cache.message_log import SessionTtl, offload_expiring_logs
+
+# TTL of a session log: the base one once filled, extended by every turn up to
+# the max one, so active sessions outlive short pauses and one-shot sessions
+# leave early
+SESSION_CACHE_TTL_SECONDS = int(os.getenv("SESSION_CACHE_TTL_SECONDS", "300"))
+SESSION_CACHE_TTL_EXTEND_SECONDS = int(
+    os.getenv("SESSION_CACHE_TTL_EXTEND_SECONDS", "300")
+)
+SESSION_CACHE_MAX_TTL_SECONDS = int(os.getenv("SESSION_CACHE_MAX_TTL_SECONDS", "3600"))
+# TTL of the cold form a log is offloaded to before it expires, 0 lets logs expire
+SESSION_CACHE_COLD_TTL_SECONDS = int(
+    os.getenv("SESSION_CACHE_COLD_TTL_SECONDS", "86400")
+)
+# Seconds between two sweeps offloading the logs about to expire
+SESSION_CACHE_SWEEP_INTERVAL_SECONDS = int(
+    os.getenv("SESSION_CACHE_SWEEP_INTERVAL_SECONDS", "15")
+)
+SESSION_CACHE_SWEEP_LIMIT = int(os.getenv("SESSION_CACHE_SWEEP_LIMIT", "500"))
+# Past this share of Redis `maxmemory`, TTLs shrink linearly down to the min factor
+SESSION_CACHE_MEMORY_PRESSURE = float(
+    os.getenv("SESSION_CACHE_MEMORY_PRESSURE", "0.75")
+)
+SESSION_CACHE_MIN_TTL_FACTOR = float(os.getenv("SESSION_CACHE_MIN_TTL_FACTOR", "0.2"))
+
+SWEEP_LOCK_KEY = "session_cache:sweep_lock"
+
+
+class SessionTtlManager(BaseModel):
+    """
+    Activity-aware TTLs of the session logs, shortened under Redis memory
+    pressure, and background sweeps offloading the logs about to expire to
+    their cold form (see `offload_expiring_logs`).
+
+    Every worker follows the memory pressure, a Redis lock lets a single one
+    sweep per interval.
+    """
+
+    base_ttl_seconds: int = SESSION_CACHE_TTL_SECONDS
+    extend_seconds: int = SESSION_CACHE_TTL_EXTEND_SECONDS
+    max_ttl_seconds: int = SESSION_CACHE_MAX_TTL_SECONDS
+    cold_ttl_seconds: int = SESSION_CACHE_COLD_TTL_SECONDS
+    sweep_interval_seconds: int = SESSION_CACHE_SWEEP_INTERVAL_SECONDS
+    sweep_limit: int = SESSION_CACHE_SWEEP_LIMIT
+    memory_pressure: float = SESSION_CACHE_MEMORY_PRESSURE
+    min_ttl_factor: float = SESSION_CACHE_MIN_TTL_FACTOR
+
+    @model_validator(mode="after")
+    def __after_init(self):
+        self._task: Optional[asyncio.Task] = None
+        self._ttl_factor = 1.0
+        self._memory: dict = {}
+        self._stats = {"offloaded": 0, "extended": 0, "expired": 0, "sweeps": 0}
+        return self
+
+    def get_ttl(self) -> SessionTtl:
+        """
+        TTL of the session logs, scaled down under memory pressure.
+        """
+        return SessionTtl(
+            base=max(int(self.base_ttl_seconds * self._ttl_factor), 1),
+            extend=int(self.extend_seconds * self._ttl_factor),
+            max=max(int(self.max_ttl_seconds * self._ttl_factor), 1),
+        )
+
+    def start(self) -> None:
+        if self.sweep_interval_seconds and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.refresh_memory_pressure()
+            except Exception:
+                logging.exception("Redis memory check failed")
+            try:
+                if self.cold_ttl_seconds and await async_redis_client.set(
+                    SWEEP_LOCK_KEY,
+                    os.getpid(),
+                    nx=True,
+                    ex=self.sweep_interval_seconds,
+                ):
+                    await self.sweep()
+            except Exception:
+                logging.exception("Session cache sweep failed")
+            await asyncio.sleep(self.sweep_interval_seconds)
+
+    async def refresh_memory_pressure(self) -> None:
+        """
+        Scale the TTLs by the memory usage of Redis: unchanged below the
+        pressure threshold, down to `min_ttl_factor` when `maxmemory` is reached.
+        """
+        memory = await async_redis_client.info("memory")
+        evictions = await async_redis_client.info("stats")
+        used, limit = int(memory.get("used_memory", 0)), int(memory.get("maxmemory", 0))
+        usage = used / limit if limit else 0.0
+
+        factor = 1.0
+        if usage > self.memory_pressure:
+            excess = (usage - self.memory_pressure) / (1 - self.memory_pressure)
+            factor = max(1 - excess * (1 - self.min_ttl_factor), self.min_ttl_factor)
+        if factor != self._ttl_factor:
+            logging.info(f"Session cache TTL factor {factor:.2f} at {usage:.0%} memory")
+        self._ttl_factor = factor
+        self._memory = {
+            "used_memory": used,
+            "maxmemory": limit,
+            "usage": round(usage, 3),
+            "evicted_keys": int(evictions.get("evicted_keys", 0)),
+            "expired_keys": int(evictions.get("expired_keys", 0)),
+        }
+
+    async def sweep(self) -> dict:
+        """
+        Offload the logs expiring before the next sweep, and the one after it.
+        """
+        report = await offload_expiring_logs(
+            margin=2 * self.sweep_interval_seconds,
+            cold_ttl=max(int(self.cold_ttl_seconds * self._ttl_factor), 1),
+            limit=self.sweep_limit,
+        )
+        self._stats["sweeps"] += 1
+        for name, count in report.items():
+            self._stats[name] += count
+        if any(report.values()):
+            logging.info(f"Session cache sweep: {report}")
+        return report
+
+    def get_stats(self) -> dict:
+        return {
+            "running": self._task is not None,
+            "ttl": self.get_ttl()._asdict(),
+            "ttl_factor": round(self._ttl_factor, 3),
+            "cold_ttl_seconds": self.cold_ttl_seconds,
+            "redis_memory": self._memory,
+            **self._stats,
+        }
+
+
+session_ttl_manager = SessionTtlManager()
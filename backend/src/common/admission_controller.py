@@ -0,0 +1,221 @@
+# src.common.admission_controller
+import asyncio
+import logging
+import os
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+import redis
+
+# for validation
+from pydantic import BaseModel, Field, model_validator
+
+from src.cache import async_redis_client
+from src.common.metrics import ADMISSION_REJECTIONS
+from src.common.request_timing import record_timing
+
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "32"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "64"))
+ADMISSION_MAX_WAIT_SECONDS = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "10"))
+ADMISSION_LEASE_SECONDS = int(os.getenv("ADMISSION_LEASE_SECONDS", "30"))
+ADMISSION_RETRY_AFTER_SECONDS = int(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", "5"))
+ADMISSION_POLL_INTERVAL_SECONDS = float(
+    os.getenv("ADMISSION_POLL_INTERVAL_SECONDS", "0.05")
+)
+
+# Drops the waiters whose lease expired (they died without leaving the queue).
+# KEYS: waiting zset (by arrival), waiting leases zset (by expiry); ARGV: now
+PURGE_WAITING = """
+local function purge_waiting(waiting, leases, now)
+    for _, token in ipairs(redis.call('ZRANGEBYSCORE', leases, '-inf', now)) do
+        redis.call('ZREM', waiting, token)
+    end
+    redis.call('ZREMRANGEBYSCORE', leases, '-inf', now)
+end
+"""
+
+# KEYS: in_flight zset, waiting zset, waiting leases zset, stats hash
+# ARGV: token, now, lease, max_in_flight
+# Expired leases (holders that died without releasing) are purged before counting.
+# Waiters are admitted in arrival order: a free slot goes to one of the first
+# waiters, and to a new arrival only when nobody waits.
+TRY_ADMIT_SCRIPT = PURGE_WAITING + """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[2])
+purge_waiting(KEYS[2], KEYS[3], ARGV[2])
+local free = tonumber(ARGV[4]) - redis.call('ZCARD', KEYS[1])
+if free <= 0 then
+    return 0
+end
+local rank = redis.call('ZRANK', KEYS[2], ARGV[1])
+if rank then
+    if rank >= free then
+        return 0
+    end
+elseif redis.call('ZCARD', KEYS[2]) > 0 then
+    return 0
+end
+redis.call('ZADD', KEYS[1], tonumber(ARGV[2]) + tonumber(ARGV[3]), ARGV[1])
+redis.call('ZREM', KEYS[2], ARGV[1])
+redis.call('ZREM', KEYS[3], ARGV[1])
+redis.call('HINCRBY', KEYS[4], 'admitted', 1)
+return 1
+"""
+
+# KEYS: waiting zset, waiting leases zset, stats hash
+# ARGV: token, now, lease, max_queue
+ENQUEUE_SCRIPT = PURGE_WAITING + """
+purge_waiting(KEYS[1], KEYS[2], ARGV[2])
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[4]) then
+    redis.call('HINCRBY', KEYS[3], 'rejected_queue_full', 1)
+    return 0
+end
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+redis.call('ZADD', KEYS[2], tonumber(ARGV[2]) + tonumber(ARGV[3]), ARGV[1])
+return 1
+"""
+
+
+class AdmissionRejectedError(Exception):
+    """Raised when a request cannot be admitted, it should be retried later."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionController(BaseModel):
+    """
+    Global limit of concurrent LLM-bound turns, shared by every worker through Redis.
+
+    Requests beyond `max_in_flight` wait in a bounded queue for at most
+    `max_wait_seconds`, and are admitted in arrival order; when the queue is full or the wait times out they are
+    rejected right away, so they can be answered with a fast 429 instead of
+    piling up until the worker timeout.
+    """
+
+    name: str = Field(default="ai_agent", min_length=1, max_length=100)
+    max_in_flight: int = Field(default=ADMISSION_MAX_IN_FLIGHT, ge=1)
+    max_queue: int = Field(default=ADMISSION_MAX_QUEUE, ge=0)
+    max_wait_seconds: float = Field(default=ADMISSION_MAX_WAIT_SECONDS, ge=0)
+    lease_seconds: int = Field(
+        default=ADMISSION_LEASE_SECONDS,
+        ge=1,
+        description="Seconds a slot or queue position is kept without a heartbeat.",
+    )
+    retry_after_seconds: int = Field(default=ADMISSION_RETRY_AFTER_SECONDS, ge=1)
+
+    @model_validator(mode="after")
+    def __after_init(self):
+        self._in_flight_key = f"admission:{self.name}:in_flight"
+        self._waiting_key = f"admission:{self.name}:waiting"
+        self._waiting_leases_key = f"admission:{self.name}:waiting_leases"
+        self._stats_key = f"admission:{self.name}:stats"
+
+        self._try_admit = async_redis_client.register_script(TRY_ADMIT_SCRIPT)
+        self._enqueue = async_redis_client.register_script(ENQUEUE_SCRIPT)
+        return self
+
+    async def _try_admit_token(self, token: str) -> bool:
+        admitted = await self._try_admit(
+            keys=[
+                self._in_flight_key,
+                self._waiting_key,
+                self._waiting_leases_key,
+                self._stats_key,
+            ],
+            args=[token, time.time(), self.lease_seconds, self.max_in_flight],
+        )
+        return admitted == 1
+
+    async def _heartbeat(self, key: str, token: str) -> None:
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            # A failed beat is retried on the next one, the lease outlives two of them
+            try:
+                await async_redis_client.zadd(
+                    key, {token: time.time() + self.lease_seconds}, xx=True
+                )
+            except redis.RedisError as e:
+                logging.warning(f"Admission heartbeat failed for '{self.name}': {e}")
+
+    async def _wait_for_slot(self, token: str) -> bool:
+        if not await self._enqueue(
+            keys=[self._waiting_key, self._waiting_leases_key, self._stats_key],
+            args=[token, time.time(), self.lease_seconds, self.max_queue],
+        ):
+            ADMISSION_REJECTIONS.labels(self.name, "queue_full").inc()
+            return False
+
+        heartbeat = asyncio.create_task(
+            self._heartbeat(self._waiting_leases_key, token)
+        )
+        try:
+            deadline = time.monotonic() + self.max_wait_seconds
+            while time.monotonic() < deadline:
+                await asyncio.sleep(ADMISSION_POLL_INTERVAL_SECONDS)
+                if await self._try_admit_token(token):
+                    return True
+
+            await async_redis_client.hincrby(self._stats_key, "rejected_timeout", 1)
+            ADMISSION_REJECTIONS.labels(self.name, "timeout").inc()
+            return False
+        finally:
+            heartbeat.cancel()
+            async with async_redis_client.pipeline(transaction=False) as pipe:
+                pipe.zrem(self._waiting_key, token)
+                pipe.zrem(self._waiting_leases_key, token)
+                await pipe.execute()
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """
+        Hold one in-flight slot for the duration of the block.
+
+        Raises:
+            AdmissionRejectedError: if no slot frees up in time or the wait queue is full.
+        """
+        token = uuid.uuid4().hex
+        started_at = time.perf_counter()
+
+        if not await self._try_admit_token(token):
+            admitted = await self._wait_for_slot(token)
+            record_timing("admission.wait", time.perf_counter() - started_at)
+            if not admitted:
+                logging.warning(f"Admission rejected for '{self.name}'")
+                raise AdmissionRejectedError(
+                    f"Too many requests in flight for '{self.name}', retry later.",
+                    retry_after=self.retry_after_seconds,
+                )
+
+        heartbeat = asyncio.create_task(self._heartbeat(self._in_flight_key, token))
+        try:
+            yield
+        finally:
+            heartbeat.cancel()
+            await async_redis_client.zrem(self._in_flight_key, token)
+
+    async def get_stats(self) -> dict:
+        """
+        Current load and counters, to size capacity.
+        """
+        now = time.time()
+        async with async_redis_client.pipeline(transaction=False) as pipe:
+            pipe.zcount(self._in_flight_key, now, "+inf")
+            pipe.zcount(self._waiting_leases_key, now, "+inf")
+            pipe.hgetall(self._stats_key)
+            in_flight, queue_depth, counters = await pipe.execute()
+
+        return {
+            "in_flight": in_flight,
+            "queue_depth": queue_depth,
+            "max_in_flight": self.max_in_flight,
+            "max_queue": self.max_queue,
+            "admitted": int(counters.get("admitted", 0)),
+            "rejected_queue_full": int(counters.get("rejected_queue_full", 0)),
+            "rejected_timeout": int(counters.get("rejected_timeout", 0)),
+        }
+
+
+agent_admission_controller = AdmissionController(name="ai_agent")
@@ -0,0 +1,76 @@
+# src.common.db_pool
+import time
+
+from sqlalchemy import exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+import src
+from src.common.metrics import DB_POOL_TIMEOUTS, DB_POOL_WAIT
+
+
+class PoolStatsMixin:
+    """
+    Count the checkouts of a queue pool, and the ones that had to wait for a
+    connection to be returned because the pool and its overflow were in use.
+    """
+
+    pool_name = "postgres"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats = {"checkouts": 0, "waits": 0, "wait_seconds": 0.0, "timeouts": 0}
+
+    def _do_get(self):
+        # Every connection exists and is checked out: `QueuePool._do_get` blocks
+        saturated = (
+            self._max_overflow > -1
+            and self._overflow >= self._max_overflow
+            and self.checkedin() == 0
+        )
+        started_at = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            self._stats["timeouts"] += 1
+            DB_POOL_TIMEOUTS.labels(self.pool_name).inc()
+            raise
+        finally:
+            self._stats["checkouts"] += 1
+            if saturated:
+                wait = time.perf_counter() - started_at
+                self._stats["waits"] += 1
+                self._stats["wait_seconds"] += wait
+                DB_POOL_WAIT.labels(self.pool_name).observe(wait)
+
+    def get_stats(self) -> dict:
+        """
+        Current usage of the pool and its counters, for this worker.
+        """
+        return {
+            "size": self.size(),
+            "max_overflow": self._max_overflow,
+            "checked_out": self.checkedout(),
+            "checked_in": self.checkedin(),
+            "overflow": max(self.overflow(), 0),
+            **self._stats,
+            "wait_seconds": round(self._stats["wait_seconds"], 3),
+        }
+
+
+class InstrumentedQueuePool(PoolStatsMixin, QueuePool):
+    pool_name = "postgres"
+
+
+class InstrumentedAsyncQueuePool(PoolStatsMixin, AsyncAdaptedQueuePool):
+    pool_name = "postgres_async"
+
+
+def get_postgres_pool_stats() -> dict:
+    """
+    Usage of the pools of the Postgres engines created in this worker.
+    """
+    return {
+        name: vars(src)[name].pool.get_stats()
+        for name in ("engine", "async_engine")
+        if name in vars(src)
+    }
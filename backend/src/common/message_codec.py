@@ -0,0 +1,181 @@
+# src.common.message_codec
+import json
+import logging
+from typing import Any, Iterable
+
+from langchain_core.messages import (
+    AIMessage,
+    BaseMessage,
+    HumanMessage,
+    SystemMessage,
+    ToolMessage,
+)
+
+MESSAGE_CLASSES = {
+    "human": HumanMessage,
+    "ai": AIMessage,
+    "AIMessageChunk": AIMessage,  # streamed messages are stored as plain AI messages
+    "tool": ToolMessage,
+    "system": SystemMessage,  # summaries of the older turns, see conversation_snapshot
+}
+
+
+def message_to_dict(message: Any) -> dict:
+    """
+    Flatten a message into a dict carrying its `type`. A message already
+    flattened, e.g. from a `LazyMessageList`, is returned as it is.
+    """
+    if isinstance(message, BaseMessage):
+        message_dict = message.model_dump()
+        message_dict["type"] = message.type
+    elif isinstance(message, dict) and "type" in message:
+        message_dict = message
+    else:
+        message_dict = {"content": str(message), "type": "unknown"}
+    return message_dict
+
+
+def message_from_dict(message_dict: dict) -> BaseMessage:
+    """
+    Rebuild a message flattened by `message_to_dict`.
+
+    Raises:
+        ValueError: if the message type is not supported.
+    """
+    message_type = message_dict.get("type", "unknown")
+    if message_type not in MESSAGE_CLASSES:
+        raise ValueError(f"Unsupported message type: {message_type}")
+    # The class sets its own type, e.g. "ai" for a stored "AIMessageChunk"
+    fields = {key: value for key, value in message_dict.items() if key != "type"}
+    return MESSAGE_CLASSES[message_type](**fields)
+
+
+def is_supported_message(message_dict: dict) -> bool:
+    return message_dict.get("type", "unknown") in MESSAGE_CLASSES
+
+
+def message_to_json(message: Any) -> str:
+    return json.dumps(message_to_dict(message), ensure_ascii=False)
+
+
+def message_from_json(message_json: str) -> BaseMessage:
+    return message_from_dict(json.loads(message_json))
+
+
+class _LazyMessage:
+    """
+    A message kept as its flattened dict until first accessed. Shared by the
+    copies of a `LazyMessageList`, so it is built once whichever copy reads it.
+    """
+
+    __slots__ = ("payload", "message")
+
+    def __init__(self, payload: dict):
+        self.payload = payload
+        self.message = None
+
+    def get(self) -> BaseMessage:
+        if self.message is None:
+            self.message = message_from_dict(self.payload)
+            self.payload = None
+        return self.message
+
+    def get_payload(self) -> Any:
+        return self.message if self.message is not None else self.payload
+
+
+def _check_supported(message_dict: dict) -> bool:
+    if is_supported_message(message_dict):
+        return True
+    logging.warning(
+        f"Skipping a stored message of unsupported type: {message_dict.get('type')}"
+    )
+    return False
+
+
+class LazyMessageList(list):
+    """
+    List of messages built when first accessed, from their flattened dicts (see
+    `message_to_dict`): a long history restored from the database or the cache
+    of which a turn only reads the last messages costs little more than its
+    dicts. Other items, e.g. the messages added during a turn, are kept as they
+    are. Dicts of an unsupported type (e.g. "unknown", see `message_to_dict`)
+    are dropped with a warning rather than failing the whole history.
+
+    Reading it through the `list` C API (e.g. `json.dumps`) sees the unbuilt
+    messages as placeholders, use `iter_message_payloads` to serialize it.
+    """
+
+    def __init__(self, items: Iterable[Any] = ()):
+        super().__init__(
+            _LazyMessage(item) if isinstance(item, dict) else item
+            for item in items
+            if not isinstance(item, dict) or _check_supported(item)
+        )
+
+    @classmethod
+    def _from_items(cls, items: Iterable[Any]) -> "LazyMessageList":
+        lazy_messages = cls()
+        list.extend(lazy_messages, items)
+        return lazy_messages
+
+    def _message(self, index: int) -> Any:
+        item = list.__getitem__(self, index)
+        return item.get() if isinstance(item, _LazyMessage) else item
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._from_items(list.__getitem__(self, index))
+        return self._message(index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self._message(index)
+
+    def __reversed__(self):
+        for index in range(len(self) - 1, -1, -1):
+            yield self._message(index)
+
+    def __contains__(self, message: Any) -> bool:
+        return any(item == message for item in self)
+
+    def __eq__(self, other: Any) -> bool:
+        return (
+            isinstance(other, list)
+            and len(self) == len(other)
+            and all(item == other_item for item, other_item in zip(self, other))
+        )
+
+    def __add__(self, other: list) -> "LazyMessageList":
+        other_items = (
+            list.__iter__(other) if isinstance(other, LazyMessageList) else other
+        )
+        return self._from_items([*list.__iter__(self), *other_items])
+
+    def __repr__(self) -> str:
+        return f"LazyMessageList({list(iter_message_payloads(self))!r})"
+
+    def copy(self) -> "LazyMessageList":
+        return self._from_items(list.__iter__(self))
+
+    def message_ids(self) -> set:
+        """
+        Ids of the messages, without building the ones not accessed yet.
+        """
+        return {
+            item.get("id") if isinstance(item, dict) else item.id
+            for item in iter_message_payloads(self)
+        }
+
+
+def iter_message_payloads(messages: list) -> Iterable[Any]:
+    """
+    The messages of a list, the ones of a `LazyMessageList` not built yet as
+    their dicts.
+    """
+    if not isinstance(messages, LazyMessageList):
+        return iter(messages)
+    return (
+        item.get_payload() if isinstance(item, _LazyMessage) else item
+        for item in list.__iter__(messages)
+    )
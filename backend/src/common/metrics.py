@@ -0,0 +1,194 @@
+# src.common.metrics
+import os
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+from src.common.request_timing import record_timing
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+AGENT_NODE_LATENCY = Histogram(
+    "agent_node_duration_seconds",
+    "Wall time of each LangGraph node execution.",
+    ["node"],
+    buckets=LATENCY_BUCKETS,
+)
+AGENT_TOOL_LATENCY = Histogram(
+    "agent_tool_duration_seconds",
+    "Wall time of each agent tool call.",
+    ["tool"],
+    buckets=LATENCY_BUCKETS,
+)
+BACKEND_LATENCY = Histogram(
+    "backend_operation_duration_seconds",
+    "Wall time of storage and search backend operations.",
+    ["backend", "operation"],
+    buckets=LATENCY_BUCKETS,
+)
+SESSION_CACHE_REQUESTS = Counter(
+    "session_cache_requests_total",
+    "Session cache lookups by tier (local / redis) and result (hit / miss / stale / cold).",
+    ["tier", "result"],
+)
+INTENT_CACHE_REQUESTS = Counter(
+    "intent_cache_requests_total",
+    "Intent detection cache lookups by tier (exact / semantic) and result (hit / miss).",
+    ["tier", "result"],
+)
+EMBEDDING_CACHE_REQUESTS = Counter(
+    "embedding_cache_requests_total",
+    "Embedding cache lookups by tier (local / redis) and result (hit / miss).",
+    ["tier", "result"],
+)
+LLM_TOKENS = Counter(
+    "llm_tokens_total",
+    "LLM tokens consumed, by model and token type (input / output).",
+    ["model", "type"],
+)
+DB_POOL_WAIT = Histogram(
+    "db_pool_wait_seconds",
+    "Time spent waiting for a connection of a saturated database pool.",
+    ["pool"],
+    buckets=LATENCY_BUCKETS,
+)
+DB_POOL_TIMEOUTS = Counter(
+    "db_pool_timeouts_total",
+    "Connection checkouts that timed out on a saturated database pool.",
+    ["pool"],
+)
+ADMISSION_REJECTIONS = Counter(
+    "admission_rejections_total",
+    "Requests rejected by admission control, by reason.",
+    ["controller", "reason"],
+)
+
+
+@contextmanager
+def observe_latency(histogram: Histogram, **labels: str) -> Iterator[None]:
+    """
+    Record the wall time of the block in `histogram`, including when it raises.
+    The duration is also added to the current request timings, named after the
+    label values (e.g. `redis.get`).
+
+    Example:
+        with observe_latency(BACKEND_LATENCY, backend="redis", operation="get"):
+            value = await redis_client.get(key)
+    """
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - started_at
+        histogram.labels(**labels).observe(duration)
+        record_timing(".".join(labels.values()), duration)
+
+
+def record_llm_usage(model: str, message: Any) -> None:
+    """
+    Count the tokens reported in the `usage_metadata` of an LLM response.
+    """
+    usage_metadata = getattr(message, "usage_metadata", None)
+    if not usage_metadata:
+        return
+    LLM_TOKENS.labels(model=model, type="input").inc(
+        usage_metadata.get("input_tokens", 0)
+    )
+    LLM_TOKENS.labels(model=model, type="output").inc(
+        usage_metadata.get("output_tokens", 0)
+    )
+
+
+class AgentMetricsCallbackHandler(BaseCallbackHandler):
+    """
+    LangChain callback recording the latency of every graph node and tool call,
+    both in the histograms and in the current request timings.
+
+    Node runs are recognised as the chain runs named after the node they run in
+    (`metadata["langgraph_node"]`); the chains nested inside a node share that
+    metadata but carry their own name.
+    """
+
+    run_inline = True  # cheap bookkeeping, no need for an executor hop
+
+    def __init__(self):
+        self._started_runs: Dict[UUID, tuple[Histogram, str, str, float]] = {}
+
+    def _start(self, run_id: UUID, histogram: Histogram, kind: str, label: str) -> None:
+        self._started_runs[run_id] = (histogram, kind, label, time.perf_counter())
+
+    def _end(self, run_id: UUID) -> None:
+        started_run = self._started_runs.pop(run_id, None)
+        if started_run is None:
+            return
+        histogram, kind, label, started_at = started_run
+        duration = time.perf_counter() - started_at
+        histogram.labels(label).observe(duration)
+        record_timing(f"{kind}.{label}", duration)
+
+    def on_chain_start(
+        self,
+        serialized: Dict[str, Any],
+        inputs: Dict[str, Any],
+        *,
+        run_id: UUID,
+        metadata: Optional[Dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> None:
+        node_name = (metadata or {}).get("langgraph_node")
+        if node_name and kwargs.get("name") == node_name:
+            self._start(run_id, AGENT_NODE_LATENCY, "node", node_name)
+
+    def on_chain_end(self, outputs: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id)
+
+    def on_chain_error(
+        self, error: BaseException, *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        self._end(run_id)
+
+    def on_tool_start(
+        self,
+        serialized: Dict[str, Any],
+        input_str: str,
+        *,
+        run_id: UUID,
+        **kwargs: Any,
+    ) -> None:
+        tool_name = kwargs.get("name") or (serialized or {}).get("name", "unknown")
+        self._start(run_id, AGENT_TOOL_LATENCY, "tool", tool_name)
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id)
+
+    def on_tool_error(
+        self, error: BaseException, *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        self._end(run_id)
+
+
+def generate_metrics() -> tuple[bytes, str]:
+    """
+    Render all metrics in the Prometheus text format.
+
+    With several gunicorn workers, `PROMETHEUS_MULTIPROC_DIR` is set (see
+    gunicorn.conf.py) and the metrics of every worker are aggregated from it.
+    """
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,31 @@
+# src.common.process_local
+import os
+import threading
+from typing import Callable, Generic, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class ProcessLocal(Generic[T]):
+    """
+    A value built on first use and built again in every forked process.
+
+    Clients holding sockets (gRPC, HTTP, database) must not cross a fork: with
+    gunicorn's `preload_app` the agent is built once in the master, and each
+    worker opens its own connections the first time it needs them.
+    """
+
+    def __init__(self, factory: Callable[[], T]):
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._pid: Optional[int] = None
+        self._value: Optional[T] = None
+
+    def get(self) -> T:
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    self._value = self._factory()
+                    self._pid = pid
+        return self._value
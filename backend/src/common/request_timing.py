@@ -0,0 +1,74 @@
+# src.common.request_timing
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, List, Optional
+
+# for validation
+from pydantic import BaseModel, Field
+
+# Timings of the current request. The list is shared by reference with every task
+# and thread started from the request (contextvars are copied into them), so
+# durations recorded in executors land in the same list.
+_request_timings: ContextVar[Optional[List[tuple[str, float]]]] = ContextVar(
+    "request_timings", default=None
+)
+
+
+class TimingModel(BaseModel):
+    """
+    Wall time spent in one component while handling a request.
+    """
+
+    name: str = Field(description="Component, e.g. 'node.product' or 'redis.get'")
+    duration_ms: float = Field(description="Total wall time, in milliseconds")
+    count: int = Field(default=1, description="Number of calls")
+
+
+def record_timing(name: str, duration: float) -> None:
+    """
+    Add `duration` (seconds) to the timings of the current request, if any.
+    """
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((name, duration))
+
+
+@contextmanager
+def collect_timings() -> Iterator[List[tuple[str, float]]]:
+    """
+    Collect the timings recorded while the block runs.
+    """
+    token = _request_timings.set([])
+    try:
+        yield _request_timings.get()
+    finally:
+        _request_timings.reset(token)
+
+
+def summarize_timings(timings: List[tuple[str, float]]) -> List[TimingModel]:
+    """
+    Aggregate raw timings per component, in order of first appearance.
+    """
+    summary = {}
+    for name, duration in timings:
+        if name not in summary:
+            summary[name] = TimingModel(name=name, duration_ms=0, count=0)
+        summary[name].duration_ms += duration * 1000
+        summary[name].count += 1
+
+    for timing in summary.values():
+        timing.duration_ms = round(timing.duration_ms, 2)
+    return list(summary.values())
+
+
+def to_server_timing_header(timings: List[TimingModel]) -> str:
+    """
+    Format timings as a `Server-Timing` header value.
+    """
+    entries = []
+    for timing in timings:
+        entry = f"{timing.name};dur={timing.duration_ms}"
+        if timing.count > 1:
+            entry += f';desc="x{timing.count}"'
+        entries.append(entry)
+    return ", ".join(entries)
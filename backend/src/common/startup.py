@@ -0,0 +1,44 @@
+# src.common.startup
+import asyncio
+import logging
+import time
+from typing import Any, Callable, Dict
+
+
+async def _run_timed(task: Callable[[], Any]) -> float:
+    started_at = time.perf_counter()
+    await asyncio.to_thread(task)
+    return time.perf_counter() - started_at
+
+
+async def run_startup_tasks(tasks: Dict[str, Callable[[], Any]]) -> Dict[str, float]:
+    """
+    Run independent blocking startup tasks concurrently and log a timing report.
+
+    Args:
+        tasks (Dict[str, Callable]): startup steps by name, e.g. `milvus.connect`.
+    Returns:
+        Dict[str, float]: the duration of every step, in seconds.
+    Raises:
+        Exception: the first error raised by a step, once every step is done.
+    """
+    started_at = time.perf_counter()
+    results = await asyncio.gather(
+        *(_run_timed(task) for task in tasks.values()), return_exceptions=True
+    )
+    total = time.perf_counter() - started_at
+
+    timings = {}
+    report = []
+    for name, result in zip(tasks, results):
+        if isinstance(result, BaseException):
+            report.append(f"{name}=failed ({result!r})")
+        else:
+            timings[name] = result
+            report.append(f"{name}={result * 1000:.0f}ms")
+    logging.info(f"Startup timings (total {total * 1000:.0f}ms): {', '.join(report)}")
+
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return timings
@@ -0,0 +1,53 @@
+from typing import List, Optional
+
+# for validation
+from pydantic import BaseModel, Field
+
+from src.base.model.base_agent_mess_model import BaseAgentMessModel
+
+
+class AgentBatchRequestModel(BaseModel):
+    """
+    Represents a batch of messages to be processed by the AI agent.
+    """
+
+    items: List[BaseAgentMessModel] = Field(
+        min_length=1,
+        max_length=1000,
+        description="Messages to be processed, turns of the same session run in order",
+    )
+
+    max_concurrency: Optional[int] = Field(
+        default=None,
+        ge=1,
+        description="Maximum number of turns processed at once, capped by the server limit",
+    )
+
+
+class AgentBatchItemResultModel(BaseModel):
+    """
+    Represents the outcome of a single item of a batch request.
+    """
+
+    index: int = Field(description="Position of the item in the request")
+
+    result: Optional[BaseAgentMessModel] = Field(
+        default=None,
+        description="Response of the AI agent, if the item succeeded",
+    )
+
+    error: Optional[str] = Field(
+        default=None,
+        description="Error message, if the item failed",
+    )
+
+
+class AgentBatchResponseModel(BaseModel):
+    """
+    Represents the results of a batch request, in request order.
+    """
+
+    results: List[AgentBatchItemResultModel] = Field(
+        default_factory=list,
+        description="Result of every item, in the same order as the request",
+    )
@@ -0,0 +1,19 @@
+from typing import List, Optional
+
+# for validation
+from pydantic import Field
+
+from src.base.model.base_agent_mess_model import BaseAgentMessModel
+from src.common.request_timing import TimingModel
+
+
+class AgentResponseModel(BaseAgentMessModel):
+    """
+    Represents the response of the AI agent, with an optional timing breakdown.
+    """
+
+    timings: Optional[List[TimingModel]] = Field(
+        default=None,
+        description="Wall time of each graph node, tool call and storage operation, "
+        "only returned when requested",
+    )
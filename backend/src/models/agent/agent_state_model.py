@@ -1,13 +1,69 @@
+import uuid
 from typing import Annotated, List, Optional
 
-from langgraph.graph.message import add_messages
-from pydantic import Field
+from pydantic import Field, PlainSerializer, PrivateAttr, WrapValidator
 
 from src.base.model.base_agent_mess_model import BaseAgentMessModel
+from src.common.message_codec import LazyMessageList
 
 # for validation
 
 
+def _to_appended_messages(left: LazyMessageList, right) -> Optional[List]:
+    """
+    The messages of an update that only appends to `left`, given ids as
+    LangGraph's `add_messages` does. None when it removes or replaces messages.
+    """
+    from langchain_core.messages import (
+        RemoveMessage,
+        convert_to_messages,
+        message_chunk_to_message,
+    )
+
+    if not isinstance(right, list):
+        right = [right]
+    messages = [message_chunk_to_message(m) for m in convert_to_messages(right)]
+
+    ids = left.message_ids()
+    for message in messages:
+        if isinstance(message, RemoveMessage) or (
+            message.id is not None and message.id in ids
+        ):
+            return None
+        if message.id is None:
+            message.id = str(uuid.uuid4())
+        ids.add(message.id)
+    return messages
+
+
+def add_messages(left: List, right: List) -> List:
+    """
+    Reducer of `messages`: LangGraph's `add_messages`, imported on first use so
+    the model can be loaded (cache, API) without importing LangGraph.
+
+    A restored history (`LazyMessageList`) is appended to without building its
+    messages, unless the update removes or replaces some of them.
+    """
+    from langgraph.graph.message import add_messages as langgraph_add_messages
+
+    if isinstance(right, LazyMessageList) and not left:
+        return right
+    if isinstance(left, LazyMessageList):
+        appended_messages = _to_appended_messages(left, right)
+        if appended_messages is not None:
+            return left + appended_messages
+        left = list(left)
+
+    return langgraph_add_messages(left, right)
+
+
+def _validate_messages(value, handler):
+    # A `LazyMessageList` is copied as it is, validating it would build its messages
+    if isinstance(value, LazyMessageList):
+        return value.copy()
+    return handler(value)
+
+
 class AgentStateModel(BaseAgentMessModel):
     """
     Represents the state of an AI agent, including its name, description, and current status.
@@ -31,4 +87,13 @@ class AgentStateModel(BaseAgentMessModel):
         default="greeting",  # Default intent if not specified
         description="Intent of the AI agent, e.g., 'greeting', 'search', etc.",
     )
-    messages: Annotated[List, add_messages] = []  # Messages in string format
+    messages: Annotated[
+        List,
+        WrapValidator(_validate_messages),
+        PlainSerializer(list),
+        add_messages,  # LangGraph takes the last annotation as the reducer
+    ] = []  # Messages in string format
+
+    # Version of the cached conversation the state was restored from, 0 when it
+    # is not cached yet and is written whole once the turn is stored
+    _cache_version: int = PrivateAttr(default=0)
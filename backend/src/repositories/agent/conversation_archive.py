@@ -0,0 +1,317 @@
+# src.repositories.agent.conversation_archive
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+import zstandard
+from pydantic import BaseModel, model_validator
+from sqlalchemy import (
+    Column,
+    DateTime,
+    LargeBinary,
+    delete,
+    func,
+    insert,
+    text,
+    tuple_,
+)
+from sqlmodel import Field, Session, SQLModel, select
+
+from src import engine
+from src.cache import async_redis_client
+from src.common.metrics import BACKEND_LATENCY, observe_latency
+from src.repositories.agent.conversation_repository import (
+    INSERT_BATCH_SIZE,
+    ConversationRepository,
+    drop_empty_conversation_partitions,
+    ensure_conversation_partitions,
+)
+from src.repositories.agent.conversation_snapshot import ConversationSnapshotRepository
+
+# Sessions without a new message for this many days are archived, 0 to disable
+CONVERSATION_ARCHIVE_IDLE_DAYS = int(os.getenv("CONVERSATION_ARCHIVE_IDLE_DAYS", "30"))
+# Sessions archived per transaction, and transactions per maintenance run
+CONVERSATION_ARCHIVE_BATCH_SIZE = int(
+    os.getenv("CONVERSATION_ARCHIVE_BATCH_SIZE", "200")
+)
+CONVERSATION_ARCHIVE_MAX_BATCHES = int(
+    os.getenv("CONVERSATION_ARCHIVE_MAX_BATCHES", "50")
+)
+CONVERSATION_ARCHIVE_COMPRESS_LEVEL = int(
+    os.getenv("CONVERSATION_ARCHIVE_COMPRESS_LEVEL", "10")
+)
+# Seconds between two maintenance runs (partitions and archival), 0 to disable
+CONVERSATION_MAINTENANCE_INTERVAL_SECONDS = int(
+    os.getenv("CONVERSATION_MAINTENANCE_INTERVAL_SECONDS", "3600")
+)
+
+MAINTENANCE_LOCK_KEY = "conversation_maintenance:lock"
+
+# Sessions whose rows are older than the cutoff and that have no newer row
+IDLE_SESSIONS_QUERY = f"""
+SELECT DISTINCT old.user_id, old.session_id
+FROM {ConversationRepository.__tablename__} AS old
+WHERE old.created_at < :cutoff
+AND NOT EXISTS (
+    SELECT 1 FROM {ConversationRepository.__tablename__} AS recent
+    WHERE recent.user_id = old.user_id
+    AND recent.session_id = old.session_id
+    AND recent.created_at >= :cutoff
+)
+LIMIT :limit
+"""
+
+
+class ConversationArchiveRepository(SQLModel, table=True):
+    """
+    Cold storage of an idle session: its conversation rows, compressed.
+    """
+
+    user_id: str = Field(primary_key=True)
+    session_id: str = Field(primary_key=True)
+    # zstd-compressed JSON list of the rows, see `_compress_rows`
+    rows: bytes = Field(sa_column=Column(LargeBinary, nullable=False))
+    message_count: int
+    archived_at: Optional[datetime] = Field(
+        default=None,
+        sa_column=Column(
+            DateTime(timezone=True), nullable=False, server_default=func.now()
+        ),
+    )
+
+
+def _compress_rows(rows: list[dict]) -> bytes:
+    return zstandard.ZstdCompressor(level=CONVERSATION_ARCHIVE_COMPRESS_LEVEL).compress(
+        json.dumps(rows, ensure_ascii=False).encode()
+    )
+
+
+def _decompress_rows(data: bytes) -> list[dict]:
+    return json.loads(zstandard.ZstdDecompressor().decompress(data))
+
+
+def archive_idle_sessions(idle_days: int, limit: int) -> int:
+    """
+    Move up to `limit` sessions idle for more than `idle_days` days from the
+    conversation table to the archive, in one transaction.
+
+    Returns:
+        int: the number of sessions archived.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(days=idle_days)
+    with observe_latency(BACKEND_LATENCY, backend="postgres", operation="archive"):
+        with Session(engine) as session:
+            keys = [
+                tuple(key)
+                for key in session.connection().execute(
+                    text(IDLE_SESSIONS_QUERY), {"cutoff": cutoff, "limit": limit}
+                )
+            ]
+            if not keys:
+                return 0
+
+            # A row written since the query makes the session active again
+            records = session.exec(
+                select(ConversationRepository)
+                .where(
+                    tuple_(
+                        ConversationRepository.user_id,
+                        ConversationRepository.session_id,
+                    ).in_(keys),
+                    ConversationRepository.created_at < cutoff,
+                )
+                .order_by(ConversationRepository.id)
+            ).all()
+
+            grouped_rows = {}
+            for record in records:
+                grouped_rows.setdefault((record.user_id, record.session_id), []).append(
+                    {
+                        "id": record.id,
+                        "messages": record.messages,
+                        "message_type": record.message_type,
+                        "intent": record.intent,
+                    }
+                )
+
+            for (user_id, session_id), rows in grouped_rows.items():
+                archive = session.get(
+                    ConversationArchiveRepository, (user_id, session_id)
+                )
+                if archive is None:
+                    archive = ConversationArchiveRepository(
+                        user_id=user_id,
+                        session_id=session_id,
+                        rows=b"",
+                        message_count=0,
+                    )
+                else:  # Archived before, without being restored since
+                    rows = _decompress_rows(archive.rows) + rows
+                archive.rows = _compress_rows(rows)
+                archive.message_count = len(rows)
+                session.add(archive)
+
+            session.exec(
+                delete(ConversationRepository).where(
+                    ConversationRepository.id.in_([record.id for record in records])
+                )
+            )
+            # Derived from the rows, it is taken again once they are restored
+            session.exec(
+                delete(ConversationSnapshotRepository).where(
+                    tuple_(
+                        ConversationSnapshotRepository.user_id,
+                        ConversationSnapshotRepository.session_id,
+                    ).in_(list(grouped_rows))
+                )
+            )
+            session.commit()
+
+    logging.info(f"Archived {len(grouped_rows)} idle sessions ({len(records)} rows)")
+    return len(grouped_rows)
+
+
+def restore_archived_sessions(keys: list[tuple[str, str]]) -> list[tuple[str, str]]:
+    """
+    Move archived sessions back to the conversation table, e.g. when their
+    user returns. The rows keep their ids, so their order is preserved.
+
+    Args:
+        keys (list[tuple[str, str]]): `(user_id, session_id)` pairs, archived or not.
+    Returns:
+        list[tuple[str, str]]: the keys of the sessions restored.
+    """
+    if not keys:
+        return []
+
+    with observe_latency(BACKEND_LATENCY, backend="postgres", operation="restore"):
+        with Session(engine) as session:
+            # Locked, so a concurrent restore waits and then finds nothing
+            archives = session.exec(
+                select(ConversationArchiveRepository)
+                .where(
+                    tuple_(
+                        ConversationArchiveRepository.user_id,
+                        ConversationArchiveRepository.session_id,
+                    ).in_(keys)
+                )
+                .with_for_update()
+            ).all()
+            if not archives:
+                return []
+
+            rows = []
+            for archive in archives:
+                for row in _decompress_rows(archive.rows):
+                    rows.append(
+                        {
+                            **row,
+                            "user_id": archive.user_id,
+                            "session_id": archive.session_id,
+                        }
+                    )
+                session.delete(archive)
+
+            for start in range(0, len(rows), INSERT_BATCH_SIZE):
+                session.exec(
+                    insert(ConversationRepository).values(
+                        rows[start : start + INSERT_BATCH_SIZE]
+                    )
+                )
+            session.commit()
+
+    restored_keys = [(archive.user_id, archive.session_id) for archive in archives]
+    logging.info(f"Restored archived sessions {restored_keys}")
+    return restored_keys
+
+
+async def arestore_archived_sessions(
+    keys: list[tuple[str, str]],
+) -> list[tuple[str, str]]:
+    """
+    Async variant of `restore_archived_sessions`, run off the event loop.
+    """
+    return await asyncio.to_thread(restore_archived_sessions, keys)
+
+
+def run_conversation_maintenance(
+    idle_days: int = CONVERSATION_ARCHIVE_IDLE_DAYS,
+    batch_size: int = CONVERSATION_ARCHIVE_BATCH_SIZE,
+    max_batches: int = CONVERSATION_ARCHIVE_MAX_BATCHES,
+) -> dict:
+    """
+    Create the coming partitions, archive the idle sessions and drop the old
+    partitions left empty.
+    """
+    report = {
+        "partitions_created": ensure_conversation_partitions(),
+        "sessions_archived": 0,
+        "partitions_dropped": [],
+    }
+    if idle_days > 0:
+        for _ in range(max_batches):
+            archived = archive_idle_sessions(idle_days, batch_size)
+            report["sessions_archived"] += archived
+            if archived < batch_size:
+                break
+
+        report["partitions_dropped"] = drop_empty_conversation_partitions(
+            before=datetime.now(timezone.utc) - timedelta(days=idle_days)
+        )
+    return report
+
+
+class ConversationMaintenance(BaseModel):
+    """
+    Background runs of `run_conversation_maintenance`, every
+    `interval_seconds`. A Redis lock lets a single worker run it per interval.
+    """
+
+    interval_seconds: int = CONVERSATION_MAINTENANCE_INTERVAL_SECONDS
+
+    @model_validator(mode="after")
+    def __after_init(self):
+        self._task: Optional[asyncio.Task] = None
+        self._last_report: Optional[dict] = None
+        return self
+
+    def start(self) -> None:
+        if self.interval_seconds and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if await async_redis_client.set(
+                    MAINTENANCE_LOCK_KEY, os.getpid(), nx=True, ex=self.interval_seconds
+                ):
+                    self._last_report = await asyncio.to_thread(
+                        run_conversation_maintenance
+                    )
+                    logging.info(f"Conversation maintenance: {self._last_report}")
+            except Exception:
+                logging.exception("Conversation maintenance failed")
+            await asyncio.sleep(self.interval_seconds)
+
+    def get_stats(self) -> dict:
+        return {
+            "running": self._task is not None,
+            "interval_seconds": self.interval_seconds,
+            "last_report": self._last_report,
+        }
+
+
+conversation_maintenance = ConversationMaintenance()
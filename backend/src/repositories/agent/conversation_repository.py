@@ -1,54 +1,350 @@
 # src.repositories.agent.conversation_repository
+import asyncio
+import csv
+import io
 import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Optional
 
-from langchain_core.messages import (
-    AIMessage,
-    BaseMessage,
-    HumanMessage,
+from sqlalchemy import (
+    JSON,
+    Column,
+    DateTime,
+    Index,
+    Text,
+    and_,
+    cast,
+    event,
+    exc,
+    func,
+    insert,
+    inspect,
+    or_,
+    text,
+    tuple_,
 )
-from langchain_core.messages.tool import ToolMessage
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlmodel import Field, Session, SQLModel, select
 
-from src import engine
+import src
+from src import POSTGRES_ASYNC, engine
+from src.common.message_codec import LazyMessageList, message_to_dict
+from src.common.metrics import BACKEND_LATENCY, observe_latency
 from src.models.agent.agent_state_for_db_model import AgentStateForDbModel
 from src.models.agent.agent_state_model import AgentStateModel
+from src.repositories.agent.conversation_snapshot import (
+    CONVERSATION_SNAPSHOT_BYTES,
+    CONVERSATION_SNAPSHOT_MESSAGES,
+    CONVERSATION_SNAPSHOT_SETTLE_SECONDS,
+    ConversationSnapshotRepository,
+    build_snapshot,
+    is_snapshot_enabled,
+    snapshot_to_messages,
+)
+
+# Rows per multi-row INSERT statement
+INSERT_BATCH_SIZE = int(os.getenv("CONVERSATION_INSERT_BATCH_SIZE", "500"))
+# Batches of at least this many rows are streamed with COPY on Postgres
+COPY_MIN_ROWS = int(os.getenv("CONVERSATION_COPY_MIN_ROWS", "2000"))
+
+# Monthly partitions created ahead of the current month
+PARTITION_MONTHS_AHEAD = int(os.getenv("CONVERSATION_PARTITION_MONTHS_AHEAD", "2"))
+
+COPY_COLUMNS = ("session_id", "user_id", "messages", "message_type", "intent")
+
+# Sessions whose rows inserted by this worker are counted, to tell when they
+# may be due for a snapshot, see `_get_due_sessions`
+SNAPSHOT_TRACKED_SESSIONS = int(
+    os.getenv("CONVERSATION_SNAPSHOT_TRACKED_SESSIONS", "10000")
+)
 
 
 class ConversationRepository(AgentStateForDbModel, SQLModel, table=True):
-    id: int = Field(default=None, primary_key=True)
+    # Serves the loads of a session, rows come out of it in insertion order
+    __table_args__ = (
+        Index("ix_conversation_user_session_id", "user_id", "session_id", "id"),
+        # Monthly partitions on Postgres, see `ensure_conversation_partitions`
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+
+    id: int = Field(
+        default=None, primary_key=True, sa_column_kwargs={"autoincrement": True}
+    )
+    # The message flattened by `message_to_dict`, JSONB on Postgres
+    messages: dict = Field(
+        sa_column=Column(JSON().with_variant(JSONB(), "postgresql"), nullable=False)
+    )
+    message_type: Optional[str] = Field(
+        default=None,
+        max_length=32,
+        description="Type of the message, e.g. 'human', 'ai', 'tool'.",
+    )
+    # Partition key, part of the primary key as Postgres requires
+    created_at: Optional[datetime] = Field(
+        default=None,
+        sa_column=Column(
+            DateTime(timezone=True),
+            primary_key=True,
+            nullable=False,
+            server_default=func.now(),
+        ),
+    )
+
+
+def _month_start(moment: datetime, months: int = 0) -> datetime:
+    """
+    Start of the month `months` months after the one of `moment`, in UTC.
+    """
+    month_index = moment.year * 12 + moment.month - 1 + months
+    return datetime(month_index // 12, month_index % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def _partition_name(month_start: datetime) -> str:
+    return f"{ConversationRepository.__tablename__}_p{month_start:%Y%m}"
+
+
+def _lock_conversation_table(connection) -> None:
+    """
+    Serialize the schema changes of the workers starting at the same time, for
+    the rest of the transaction.
+    """
+    connection.execute(
+        text("SELECT pg_advisory_xact_lock(hashtext(:name))"),
+        {"name": ConversationRepository.__tablename__},
+    )
+
+
+def _partition_existing_table(connection) -> None:
+    """
+    Turn a plain conversation table into the partitioned one: the table
+    becomes the partition of the current month, holding every older row too.
+    Attaching it scans the table to validate its bounds.
+
+    The plain table has no timestamp to backfill `created_at` from: its rows
+    are dated to the migration, so their sessions are only archived once idle
+    for `idle_days` after it (see `conversation_archive`).
+    """
+    table_name = ConversationRepository.__tablename__
+    month_start = _month_start(datetime.now(timezone.utc))
+    legacy_name = _partition_name(month_start)
+    sequence_name = connection.execute(
+        text("SELECT pg_get_serial_sequence(:table_name, 'id')"),
+        {"table_name": table_name},
+    ).scalar()
 
+    # Free the names the partitioned table is created with, and give the table
+    # the primary key of a partition
+    for statement in (
+        f"ALTER TABLE {table_name} RENAME TO {legacy_name}",
+        f"ALTER TABLE {legacy_name} DROP CONSTRAINT {table_name}_pkey",
+        "ALTER INDEX IF EXISTS ix_conversation_user_session_id "
+        f"RENAME TO {legacy_name}_user_session_id_idx",
+        f"ALTER SEQUENCE {sequence_name} RENAME TO {legacy_name}_id_seq",
+        f"ALTER TABLE {legacy_name} "
+        "ADD COLUMN created_at TIMESTAMPTZ NOT NULL DEFAULT now()",
+        f"ALTER TABLE {legacy_name} ADD PRIMARY KEY (id, created_at)",
+    ):
+        connection.execute(text(statement))
 
-def load_conversations(session_id: str, user_id: str) -> AgentStateModel | None:
+    ConversationRepository.__table__.create(connection)
+    connection.execute(
+        text(
+            f"SELECT setval(pg_get_serial_sequence('{table_name}', 'id'), "
+            f"(SELECT coalesce(max(id), 0) + 1 FROM {legacy_name}), false)"
+        )
+    )
+    connection.execute(
+        text(
+            f"ALTER TABLE {table_name} ATTACH PARTITION {legacy_name} "
+            f"FOR VALUES FROM (MINVALUE) TO ('{_month_start(month_start, 1).isoformat()}')"
+        )
+    )
+
+
+def upgrade_conversation_table() -> None:
+    """
+    Bring an existing conversation table to the current layout, which
+    `SQLModel.metadata.create_all` does not do:
+    - `messages` from JSON text to JSONB, and `message_type` filled from it.
+    - a plain table into monthly partitions (`_partition_existing_table`).
+    - the indexes added since the table was created.
+    - the partitions of the coming months.
+    The first two rewrite or scan the table under an exclusive lock, so it is
+    not run by the workers starting: run it ahead of a deployment, in a
+    maintenance window for a large table
+    (`python -m src.repositories.agent.conversation_repository`).
+    """
+    table_name = ConversationRepository.__tablename__
+    if engine.dialect.name == "postgresql":
+        with engine.begin() as connection:
+            _lock_conversation_table(connection)
+            inspector = inspect(connection)
+            if inspector.has_table(table_name):
+                columns = {
+                    column["name"]: column["type"]
+                    for column in inspector.get_columns(table_name)
+                }
+                if "message_type" not in columns:
+                    connection.execute(
+                        text(
+                            f"ALTER TABLE {table_name} ADD COLUMN message_type VARCHAR(32)"
+                        )
+                    )
+                if not isinstance(columns["messages"], JSONB):
+                    connection.execute(
+                        text(
+                            f"ALTER TABLE {table_name} ALTER COLUMN messages TYPE JSONB "
+                            "USING messages::jsonb"
+                        )
+                    )
+                    connection.execute(
+                        text(
+                            f"UPDATE {table_name} SET message_type = messages->>'type' "
+                            "WHERE message_type IS NULL"
+                        )
+                    )
+
+                is_partitioned = connection.execute(
+                    text(
+                        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table "
+                        "WHERE partrelid = to_regclass(:table_name))"
+                    ),
+                    {"table_name": table_name},
+                ).scalar()
+                if not is_partitioned:
+                    _partition_existing_table(connection)
+
+    for index in ConversationRepository.__table__.indexes:
+        index.create(engine, checkfirst=True)
+
+    ensure_conversation_partitions()
+
+
+def ensure_conversation_partitions(
+    months_ahead: int = PARTITION_MONTHS_AHEAD,
+) -> list[str]:
     """
-    Retrieve a conversation by session ID and user ID.
+    Create the missing monthly partitions, from the current month to
+    `months_ahead` months ahead. Only Postgres tables are partitioned.
+
+    Returns:
+        list[str]: the names of the partitions created.
     """
-    all_records = None
-    with Session(engine) as session:
-        all_records = session.exec(
-            select(ConversationRepository).where(
-                ConversationRepository.session_id == session_id,
-                ConversationRepository.user_id == user_id,
+    if engine.dialect.name != "postgresql":
+        return []
+
+    with engine.begin() as connection:
+        return _create_partitions(connection, months_ahead)
+
+
+def _create_partitions(connection, months_ahead: int) -> list[str]:
+    table_name = ConversationRepository.__tablename__
+    current_month_start = _month_start(datetime.now(timezone.utc))
+    created_partitions = []
+    _lock_conversation_table(connection)
+    for months in range(months_ahead + 1):
+        month_start = _month_start(current_month_start, months)
+        partition_name = _partition_name(month_start)
+        if connection.execute(
+            text("SELECT to_regclass(:name)"), {"name": partition_name}
+        ).scalar():
+            continue
+
+        connection.execute(
+            text(
+                f"CREATE TABLE {partition_name} PARTITION OF {table_name} "
+                f"FOR VALUES FROM ('{month_start.isoformat()}') "
+                f"TO ('{_month_start(month_start, 1).isoformat()}')"
             )
-        ).all()
+        )
+        created_partitions.append(partition_name)
 
-    messages = []
-    last_intent = None
+    return created_partitions
 
-    if len(all_records) == 0:
-        return None
 
-    for record in all_records:
-        parsed_messages = json.loads(record.messages)
-        message_type = parsed_messages.get("type", "unknown")
-        if message_type == "human":
-            message = HumanMessage(**parsed_messages)
-        elif message_type == "ai":
-            message = AIMessage(**parsed_messages)
-        elif message_type == "tool":
-            message = ToolMessage(**parsed_messages)
+@event.listens_for(ConversationRepository.__table__, "after_create")
+def _create_first_partitions(table, connection, **kwargs) -> None:
+    # A new table, e.g. from `SQLModel.metadata.create_all`, can take rows at
+    # once. A table being partitioned by `_partition_existing_table` already
+    # holds the partition of the current month under its legacy name.
+    if connection.dialect.name == "postgresql":
+        _create_partitions(connection, PARTITION_MONTHS_AHEAD)
+
+
+def drop_empty_conversation_partitions(before: datetime) -> list[str]:
+    """
+    Drop the monthly partitions ending before `before` that no longer hold any
+    row, e.g. once their sessions were archived.
+
+    Returns:
+        list[str]: the names of the partitions dropped.
+    """
+    if engine.dialect.name != "postgresql":
+        return []
+
+    dropped_partitions = []
+    with engine.begin() as connection:
+        _lock_conversation_table(connection)
+        partition_names = connection.execute(
+            text(
+                "SELECT child.relname FROM pg_inherits "
+                "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+                "WHERE pg_inherits.inhparent = to_regclass(:table_name)"
+            ),
+            {"table_name": ConversationRepository.__tablename__},
+        ).scalars()
+        for partition_name in partition_names:
+            match = re.search(r"_p(\d{4})(\d{2})$", partition_name)
+            if match is None:
+                continue
+            month_start = datetime(int(match[1]), int(match[2]), 1, tzinfo=timezone.utc)
+            if _month_start(month_start, 1) > before:
+                continue
+            if connection.execute(
+                text(f"SELECT EXISTS (SELECT 1 FROM {partition_name})")
+            ).scalar():
+                continue
+
+            connection.execute(text(f"DROP TABLE {partition_name}"))
+            dropped_partitions.append(partition_name)
+
+    return dropped_partitions
+
+
+def _records_to_agent_state(
+    records: list[ConversationRepository],
+    session_id: str,
+    user_id: str,
+    snapshot: Optional[ConversationSnapshotRepository] = None,
+    last_n: Optional[int] = None,
+) -> AgentStateModel:
+    """
+    Rebuild an agent state from its conversation records, written after
+    `snapshot` when there is one.
+
+    Args:
+        last_n (Optional[int]): only restore the last `last_n` messages, after
+            the summary of the snapshot.
+    """
+    # Built when used, a turn may only read the last messages
+    messages = LazyMessageList(record.messages for record in records)
+    last_intent = snapshot.intent if snapshot is not None else None
+    if records:
+        last_intent = records[-1].intent
 
-        messages.append(message)
-        last_intent = record.intent
+    if snapshot is not None:
+        messages = (
+            snapshot_to_messages(
+                snapshot, max(last_n - len(messages), 0) if last_n else None
+            )
+            + messages
+        )
 
     return AgentStateModel(
         session_id=session_id,
@@ -58,6 +354,448 @@ def load_conversations(session_id: str, user_id: str) -> AgentStateModel | None:
     )
 
 
+def _to_conversation_rows(
+    items: list[tuple[AgentStateModel, int]],
+) -> list[dict]:
+    """
+    Convert the last messages of several agent states into conversation rows.
+
+    Args:
+        items (list[tuple[AgentStateModel, int]]): `(agent_state, number_of_last_messages)` pairs.
+    """
+    rows = []
+    for agent_state, number_of_last_messages in items:
+        for message in agent_state.messages[-number_of_last_messages:]:
+            message_dict = message_to_dict(message)
+            rows.append(
+                {
+                    "session_id": agent_state.session_id,
+                    "user_id": agent_state.user_id,
+                    "messages": message_dict,
+                    "message_type": message_dict["type"],
+                    "intent": agent_state.intent,
+                }
+            )
+
+    return rows
+
+
+def _fetch_records(statement, operation: str) -> list[ConversationRepository]:
+    with observe_latency(BACKEND_LATENCY, backend="postgres", operation=operation):
+        with Session(engine) as session:
+            return session.exec(statement).all()
+
+
+async def _afetch_records(statement, operation: str) -> list[ConversationRepository]:
+    """
+    Run a query on the asyncpg engine (`POSTGRES_ASYNC`).
+    """
+    from sqlmodel.ext.asyncio.session import AsyncSession
+
+    with observe_latency(BACKEND_LATENCY, backend="postgres", operation=operation):
+        async with AsyncSession(src.async_engine) as session:
+            return (await session.exec(statement)).all()
+
+
+def _page_statement(
+    session_id: str, user_id: str, limit: int, before_id: Optional[int]
+):
+    statement = select(ConversationRepository).where(
+        ConversationRepository.user_id == user_id,
+        ConversationRepository.session_id == session_id,
+    )
+    if before_id is not None:
+        statement = statement.where(ConversationRepository.id < before_id)
+    # One extra row tells whether a previous page exists
+    return statement.order_by(ConversationRepository.id.desc()).limit(limit + 1)
+
+
+def _to_conversation_page(
+    records: list[ConversationRepository], session_id: str, user_id: str, limit: int
+) -> tuple[AgentStateModel | None, Optional[int]]:
+    if not records:
+        return None, None
+
+    has_previous_page = len(records) > limit
+    records = records[:limit][::-1]
+    return (
+        _records_to_agent_state(records, session_id, user_id),
+        records[0].id if has_previous_page else None,
+    )
+
+
+def _snapshots_statement(keys: list[tuple[str, str]]):
+    return select(ConversationSnapshotRepository).where(
+        tuple_(
+            ConversationSnapshotRepository.user_id,
+            ConversationSnapshotRepository.session_id,
+        ).in_(keys)
+    )
+
+
+def _sessions_filter(keys: list[tuple[str, str]], after_ids: dict):
+    """
+    The rows of the sessions `keys`, after the id in `after_ids` (the last one
+    covered by their snapshot) for the sessions that have one.
+    """
+    conditions = []
+    plain_keys = [key for key in keys if key not in after_ids]
+    if plain_keys:
+        conditions.append(
+            tuple_(
+                ConversationRepository.user_id,
+                ConversationRepository.session_id,
+            ).in_(plain_keys)
+        )
+    for user_id, session_id in keys:
+        if (user_id, session_id) in after_ids:
+            conditions.append(
+                and_(
+                    ConversationRepository.user_id == user_id,
+                    ConversationRepository.session_id == session_id,
+                    ConversationRepository.id > after_ids[(user_id, session_id)],
+                )
+            )
+    return or_(*conditions)
+
+
+def _conversation_statement(
+    session_id: str, user_id: str, after_id: Optional[int], last_n: Optional[int]
+):
+    statement = select(ConversationRepository).where(
+        ConversationRepository.user_id == user_id,
+        ConversationRepository.session_id == session_id,
+    )
+    if after_id is not None:
+        statement = statement.where(ConversationRepository.id > after_id)
+    if last_n:
+        return statement.order_by(ConversationRepository.id.desc()).limit(last_n)
+    return statement.order_by(ConversationRepository.id)
+
+
+def _conversations_many_statement(
+    keys: list[tuple[str, str]], last_n: Optional[int], after_ids: dict
+):
+    sessions_filter = _sessions_filter(keys, after_ids)
+    if not last_n:
+        return (
+            select(ConversationRepository)
+            .where(sessions_filter)
+            .order_by(ConversationRepository.id)
+        )
+
+    position = (
+        func.row_number()
+        .over(
+            partition_by=(
+                ConversationRepository.user_id,
+                ConversationRepository.session_id,
+            ),
+            order_by=ConversationRepository.id.desc(),
+        )
+        .label("position")
+    )
+    windowed = (
+        select(ConversationRepository.id, position).where(sessions_filter).subquery()
+    )
+    return (
+        select(ConversationRepository)
+        .join(windowed, ConversationRepository.id == windowed.c.id)
+        .where(windowed.c.position <= last_n)
+        .order_by(ConversationRepository.id)
+    )
+
+
+def _to_snapshots(
+    snapshots: list[ConversationSnapshotRepository],
+) -> dict[tuple[str, str], ConversationSnapshotRepository]:
+    return {(snapshot.user_id, snapshot.session_id): snapshot for snapshot in snapshots}
+
+
+def _to_agent_state(
+    records: list[ConversationRepository],
+    session_id: str,
+    user_id: str,
+    snapshot: Optional[ConversationSnapshotRepository],
+    last_n: Optional[int],
+) -> AgentStateModel | None:
+    if not records and snapshot is None:
+        return None
+    if last_n:  # Loaded latest first
+        records = records[::-1]
+    return _records_to_agent_state(records, session_id, user_id, snapshot, last_n)
+
+
+def _group_conversations(
+    records: list[ConversationRepository],
+    snapshots: dict[tuple[str, str], ConversationSnapshotRepository],
+    last_n: Optional[int],
+) -> dict[tuple[str, str], AgentStateModel]:
+    grouped_records = {key: [] for key in snapshots}
+    for record in records:
+        grouped_records.setdefault((record.user_id, record.session_id), []).append(
+            record
+        )
+
+    return {
+        (user_id, session_id): _records_to_agent_state(
+            records, session_id, user_id, snapshots.get((user_id, session_id)), last_n
+        )
+        for (user_id, session_id), records in grouped_records.items()
+    }
+
+
+def load_conversation_page(
+    session_id: str,
+    user_id: str,
+    limit: int,
+    before_id: Optional[int] = None,
+) -> tuple[AgentStateModel | None, Optional[int]]:
+    """
+    Retrieve the `limit` messages of a conversation preceding the message
+    `before_id`, the latest ones by default. The query walks the
+    `(user_id, session_id, id)` index backwards, so its cost does not grow with
+    the length of the conversation.
+
+    Returns:
+        tuple: the agent state holding the page in chronological order (None if
+            it is empty), and the `before_id` of the previous page (None if
+            this page starts the conversation).
+    """
+    records = _fetch_records(
+        _page_statement(session_id, user_id, limit, before_id), "load_page"
+    )
+    return _to_conversation_page(records, session_id, user_id, limit)
+
+
+def load_conversations(
+    session_id: str, user_id: str, last_n: Optional[int] = None
+) -> AgentStateModel | None:
+    """
+    Retrieve a conversation by session ID and user ID: its snapshot, if any,
+    and the messages written after it.
+
+    Args:
+        last_n (Optional[int]): only load the last `last_n` messages.
+    """
+    snapshot = None
+    if is_snapshot_enabled():
+        snapshot = next(
+            iter(
+                _fetch_records(
+                    _snapshots_statement([(user_id, session_id)]), "load_snapshot"
+                )
+            ),
+            None,
+        )
+
+    records = _fetch_records(
+        _conversation_statement(
+            session_id, user_id, snapshot and snapshot.last_message_id, last_n
+        ),
+        "load",
+    )
+    return _to_agent_state(records, session_id, user_id, snapshot, last_n)
+
+
+def load_conversations_many(
+    keys: list[tuple[str, str]],
+    last_n: Optional[int] = None,
+) -> dict[tuple[str, str], AgentStateModel]:
+    """
+    Retrieve several conversations with a single query, after a query for
+    their snapshots.
+
+    Args:
+        keys (list[tuple[str, str]]): `(user_id, session_id)` pairs to load.
+        last_n (Optional[int]): only load the last `last_n` messages of each conversation.
+    Returns:
+        dict: the agent state of every conversation found, keyed by `(user_id, session_id)`.
+    """
+    if not keys:
+        return {}
+
+    snapshots = {}
+    if is_snapshot_enabled():
+        snapshots = _to_snapshots(
+            _fetch_records(_snapshots_statement(keys), "load_snapshot")
+        )
+    after_ids = {key: snapshot.last_message_id for key, snapshot in snapshots.items()}
+    return _group_conversations(
+        _fetch_records(_conversations_many_statement(keys, last_n, after_ids), "load"),
+        snapshots,
+        last_n,
+    )
+
+
+def _due_snapshots_statement(keys: list[tuple[str, str]], settled_before: datetime):
+    """
+    The sessions among `keys` whose settled rows not covered by their snapshot
+    reach the message or byte threshold.
+    """
+    snapshotted_id = (
+        select(ConversationSnapshotRepository.last_message_id)
+        .where(
+            ConversationSnapshotRepository.user_id == ConversationRepository.user_id,
+            ConversationSnapshotRepository.session_id
+            == ConversationRepository.session_id,
+        )
+        .scalar_subquery()
+    )
+    thresholds = []
+    if CONVERSATION_SNAPSHOT_MESSAGES > 0:
+        thresholds.append(func.count() >= CONVERSATION_SNAPSHOT_MESSAGES)
+    if CONVERSATION_SNAPSHOT_BYTES > 0:
+        thresholds.append(
+            func.sum(func.octet_length(cast(ConversationRepository.messages, Text)))
+            >= CONVERSATION_SNAPSHOT_BYTES
+        )
+
+    return (
+        select(ConversationRepository.user_id, ConversationRepository.session_id)
+        .where(
+            tuple_(
+                ConversationRepository.user_id,
+                ConversationRepository.session_id,
+            ).in_(keys),
+            ConversationRepository.id > func.coalesce(snapshotted_id, 0),
+            ConversationRepository.created_at < settled_before,
+        )
+        .group_by(ConversationRepository.user_id, ConversationRepository.session_id)
+        .having(or_(*thresholds))
+    )
+
+
+def snapshot_conversations(keys: list[tuple[str, str]]) -> list[tuple[str, str]]:
+    """
+    Fold the rows of the sessions among `keys` into their snapshot, for the
+    ones with `CONVERSATION_SNAPSHOT_MESSAGES` messages or
+    `CONVERSATION_SNAPSHOT_BYTES` bytes written since their last snapshot.
+    Rows younger than `CONVERSATION_SNAPSHOT_SETTLE_SECONDS` are left out.
+
+    Returns:
+        list[tuple[str, str]]: the keys of the sessions snapshotted.
+    """
+    if not keys or not is_snapshot_enabled():
+        return []
+
+    settled_before = datetime.now(timezone.utc) - timedelta(
+        seconds=CONVERSATION_SNAPSHOT_SETTLE_SECONDS
+    )
+    with observe_latency(BACKEND_LATENCY, backend="postgres", operation="snapshot"):
+        with Session(engine) as session:
+            due_keys = [
+                tuple(key)
+                for key in session.exec(_due_snapshots_statement(keys, settled_before))
+            ]
+            if not due_keys:
+                return []
+
+            # Locked, so concurrent snapshots of a session are taken one by one
+            snapshots = _to_snapshots(
+                session.exec(_snapshots_statement(due_keys).with_for_update()).all()
+            )
+            after_ids = {
+                key: snapshot.last_message_id for key, snapshot in snapshots.items()
+            }
+            records = session.exec(
+                select(ConversationRepository)
+                .where(
+                    _sessions_filter(due_keys, after_ids),
+                    ConversationRepository.created_at < settled_before,
+                )
+                .order_by(ConversationRepository.id)
+            ).all()
+
+            grouped_rows = {}
+            for record in records:
+                grouped_rows.setdefault((record.user_id, record.session_id), []).append(
+                    {
+                        "id": record.id,
+                        "messages": record.messages,
+                        "intent": record.intent,
+                    }
+                )
+            for (user_id, session_id), rows in grouped_rows.items():
+                session.add(
+                    build_snapshot(
+                        snapshots.get((user_id, session_id)), user_id, session_id, rows
+                    )
+                )
+
+            try:
+                session.commit()
+            except exc.IntegrityError:
+                # Another worker took the first snapshot of one of the sessions
+                logging.info(f"Concurrent snapshot of {list(grouped_rows)}, skipped")
+                return []
+
+    return list(grouped_rows)
+
+
+# Messages and bytes inserted by this worker for each session since it was
+# last checked for a snapshot, and the time of its next check
+_inserted_since_check: OrderedDict[tuple[str, str], list] = OrderedDict()
+_inserted_since_check_lock = threading.Lock()
+
+
+def _get_due_sessions(rows: list[dict]) -> list[tuple[str, str]]:
+    """
+    Count the rows just inserted per session, in memory, and return the
+    sessions which may be due for a snapshot: the ones this worker inserted
+    enough messages or bytes for since their last check. Only these are
+    checked in the database, at most once per settle period: the rows of a
+    session inserted by other workers only delay its snapshot.
+    """
+    if not is_snapshot_enabled():
+        return []
+
+    now = time.monotonic()
+    due_keys = []
+    with _inserted_since_check_lock:
+        for row in rows:
+            key = (row["user_id"], row["session_id"])
+            counts = _inserted_since_check.setdefault(key, [0, 0, 0.0])
+            _inserted_since_check.move_to_end(key)
+            counts[0] += 1
+            if CONVERSATION_SNAPSHOT_BYTES > 0:
+                counts[1] += len(json.dumps(row["messages"], ensure_ascii=False))
+
+        for key in dict.fromkeys((row["user_id"], row["session_id"]) for row in rows):
+            message_count, byte_count, next_check_at = _inserted_since_check[key]
+            if next_check_at > now:
+                continue
+            if (
+                0 < CONVERSATION_SNAPSHOT_MESSAGES <= message_count
+                or 0 < CONVERSATION_SNAPSHOT_BYTES <= byte_count
+            ):
+                # Rows younger than the settle period are not snapshotted yet
+                _inserted_since_check[key][2] = (
+                    now + CONVERSATION_SNAPSHOT_SETTLE_SECONDS
+                )
+                due_keys.append(key)
+
+        while len(_inserted_since_check) > SNAPSHOT_TRACKED_SESSIONS:
+            _inserted_since_check.popitem(last=False)
+    return due_keys
+
+
+def _snapshot_sessions(keys: list[tuple[str, str]]) -> None:
+    """
+    Snapshot the sessions found by `_get_due_sessions`, if due. The rows are
+    committed, so a failure here is only logged.
+    """
+    try:
+        snapshotted_keys = snapshot_conversations(keys)
+    except Exception:
+        logging.exception("Failed to snapshot conversations")
+        return
+
+    with _inserted_since_check_lock:
+        for key in snapshotted_keys:
+            _inserted_since_check.pop(key, None)
+
+
 def save_conversation(
     agent_state: AgentStateModel,
     number_of_last_messages: int = 1,
@@ -65,34 +803,243 @@ def save_conversation(
     """
     Save a conversation in the agent state.
     """
+    save_conversations([(agent_state, number_of_last_messages)])
 
-    # Save to database
-    with Session(engine) as session:
-        for message in agent_state.messages[-number_of_last_messages:]:
-            if isinstance(message, BaseMessage):
-                message_dict = message.model_dump()
-                message_dict["type"] = message.type
+
+def save_conversations(items: list[tuple[AgentStateModel, int]]) -> None:
+    """
+    Save the last messages of several agent states in a single transaction.
+
+    Args:
+        items (list[tuple[AgentStateModel, int]]): `(agent_state, number_of_last_messages)` pairs.
+    """
+    insert_conversation_rows(_to_conversation_rows(items))
+
+
+def _copy_conversation_rows(session: Session, rows: list[dict]) -> None:
+    """
+    Stream conversation rows into the table with a Postgres COPY, within the
+    transaction of `session`.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(
+            [
+                row["session_id"],
+                row["user_id"],
+                json.dumps(row["messages"], ensure_ascii=False),
+                row["message_type"],
+                row["intent"],  # None is written unquoted, read back as NULL
+            ]
+        )
+
+    # Sent as UTF-8 bytes, whatever the client encoding of the connection
+    cursor = session.connection().connection.cursor()
+    cursor.copy_expert(
+        f"COPY {ConversationRepository.__tablename__} ({', '.join(COPY_COLUMNS)}) "
+        "FROM STDIN WITH (FORMAT csv, ENCODING 'UTF8')",
+        io.BytesIO(buffer.getvalue().encode()),
+    )
+
+
+def insert_conversation_rows(
+    rows: list[dict], batch_size: int = INSERT_BATCH_SIZE
+) -> None:
+    """
+    Insert conversation rows with multi-row INSERT statements of at most
+    `batch_size` rows each, or a single COPY for large batches on Postgres,
+    all committed in a single transaction.
+
+    Args:
+        rows (list[dict]): rows built by `_to_conversation_rows`.
+    """
+    if not rows:
+        return
+
+    with observe_latency(BACKEND_LATENCY, backend="postgres", operation="save"):
+        with Session(engine) as session:
+            if engine.dialect.name == "postgresql" and len(rows) >= COPY_MIN_ROWS:
+                _copy_conversation_rows(session, rows)
             else:
-                message_dict = {"content": str(message), "type": "unknown"}
+                for start in range(0, len(rows), batch_size):
+                    session.exec(
+                        insert(ConversationRepository).values(
+                            rows[start : start + batch_size]
+                        )
+                    )
 
-            agent_state_for_db = AgentStateForDbModel(
-                session_id=agent_state.session_id,
-                user_id=agent_state.user_id,
-                messages=json.dumps(message_dict, ensure_ascii=False),
-                intent=agent_state.intent,
-            )
+            session.commit()
 
-            conversation_record = ConversationRepository.model_validate(
-                agent_state_for_db
-            )
-            session.add(conversation_record)
+    due_keys = _get_due_sessions(rows)
+    if due_keys:
+        _snapshot_sessions(due_keys)
 
-        session.commit()
 
+def drop_saved_conversation_rows(rows: list[dict]) -> list[dict]:
+    """
+    The rows not saved yet, telling saved ones by their session and the id of
+    their message, so rows replayed after a crash are not saved twice. Rows
+    whose message has no id are kept.
 
-if __name__ == "__main__":
-    session_id = "00000000-0000-0000-0000-000000000000"
-    user_id = "0"
+    Args:
+        rows (list[dict]): rows built by `_to_conversation_rows`.
+    """
+    message_ids = {row["messages"].get("id") for row in rows} - {None}
+    if not message_ids:
+        return rows
+
+    message_id = ConversationRepository.messages["id"].as_string()
+    saved = {
+        tuple(record)
+        for record in _fetch_records(
+            select(ConversationRepository.session_id, message_id).where(
+                tuple_(
+                    ConversationRepository.user_id,
+                    ConversationRepository.session_id,
+                ).in_({(row["user_id"], row["session_id"]) for row in rows}),
+                message_id.in_(message_ids),
+            ),
+            "load_saved",
+        )
+    }
+    return [
+        row
+        for row in rows
+        if (row["session_id"], row["messages"].get("id")) not in saved
+    ]
+
+
+async def ainsert_conversation_rows(
+    rows: list[dict], batch_size: int = INSERT_BATCH_SIZE
+) -> None:
+    """
+    Async variant of `insert_conversation_rows`, on the asyncpg engine with
+    `POSTGRES_ASYNC` (multi-row INSERTs only), else run off the event loop.
+    """
+    if not POSTGRES_ASYNC:
+        await asyncio.to_thread(insert_conversation_rows, rows, batch_size)
+        return
+    if not rows:
+        return
+
+    from sqlmodel.ext.asyncio.session import AsyncSession
+
+    with observe_latency(BACKEND_LATENCY, backend="postgres", operation="save"):
+        async with AsyncSession(src.async_engine) as session:
+            for start in range(0, len(rows), batch_size):
+                await session.exec(
+                    insert(ConversationRepository).values(
+                        rows[start : start + batch_size]
+                    )
+                )
+
+            await session.commit()
+
+    due_keys = _get_due_sessions(rows)
+    if due_keys:
+        await asyncio.to_thread(_snapshot_sessions, due_keys)
+
+
+async def aload_conversation_page(
+    session_id: str,
+    user_id: str,
+    limit: int,
+    before_id: Optional[int] = None,
+) -> tuple[AgentStateModel | None, Optional[int]]:
+    """
+    Async variant of `load_conversation_page`, on the asyncpg engine with
+    `POSTGRES_ASYNC`, else run off the event loop.
+    """
+    if not POSTGRES_ASYNC:
+        return await asyncio.to_thread(
+            load_conversation_page, session_id, user_id, limit, before_id
+        )
 
-    conversation = load_conversations(session_id, user_id)
-    # print(conversation)
+    records = await _afetch_records(
+        _page_statement(session_id, user_id, limit, before_id), "load_page"
+    )
+    return _to_conversation_page(records, session_id, user_id, limit)
+
+
+async def aload_conversations(
+    session_id: str, user_id: str, last_n: Optional[int] = None
+) -> AgentStateModel | None:
+    """
+    Async variant of `load_conversations`, on the asyncpg engine with
+    `POSTGRES_ASYNC`, else run off the event loop.
+    """
+    if not POSTGRES_ASYNC:
+        return await asyncio.to_thread(
+            load_conversations, session_id=session_id, user_id=user_id, last_n=last_n
+        )
+
+    snapshot = None
+    if is_snapshot_enabled():
+        snapshot = next(
+            iter(
+                await _afetch_records(
+                    _snapshots_statement([(user_id, session_id)]), "load_snapshot"
+                )
+            ),
+            None,
+        )
+
+    records = await _afetch_records(
+        _conversation_statement(
+            session_id, user_id, snapshot and snapshot.last_message_id, last_n
+        ),
+        "load",
+    )
+    return _to_agent_state(records, session_id, user_id, snapshot, last_n)
+
+
+async def aload_conversations_many(
+    keys: list[tuple[str, str]],
+    last_n: Optional[int] = None,
+) -> dict[tuple[str, str], AgentStateModel]:
+    """
+    Async variant of `load_conversations_many`, on the asyncpg engine with
+    `POSTGRES_ASYNC`, else run off the event loop.
+    """
+    if not POSTGRES_ASYNC:
+        return await asyncio.to_thread(load_conversations_many, keys, last_n)
+    if not keys:
+        return {}
+
+    snapshots = {}
+    if is_snapshot_enabled():
+        snapshots = _to_snapshots(
+            await _afetch_records(_snapshots_statement(keys), "load_snapshot")
+        )
+    after_ids = {key: snapshot.last_message_id for key, snapshot in snapshots.items()}
+    return _group_conversations(
+        await _afetch_records(
+            _conversations_many_statement(keys, last_n, after_ids), "load"
+        ),
+        snapshots,
+        last_n,
+    )
+
+
+async def asave_conversation(
+    agent_state: AgentStateModel,
+    number_of_last_messages: int = 1,
+) -> None:
+    """
+    Async variant of `save_conversation`.
+    """
+    await asave_conversations([(agent_state, number_of_last_messages)])
+
+
+async def asave_conversations(items: list[tuple[AgentStateModel, int]]) -> None:
+    """
+    Async variant of `save_conversations`.
+    """
+    await ainsert_conversation_rows(_to_conversation_rows(items))
+
+
+if __name__ == "__main__":
+    # Migrate the conversation table ahead of a deployment
+    SQLModel.metadata.create_all(engine)
+    upgrade_conversation_table()
@@ -0,0 +1,175 @@
+# src.repositories.agent.conversation_snapshot
+import os
+from datetime import datetime
+from typing import Optional
+
+from langchain_core.messages import SystemMessage
+from sqlalchemy import JSON, Column, DateTime, func
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlmodel import Field, SQLModel
+
+from src.common.message_codec import LazyMessageList
+
+# A session is snapshotted once the rows written since its last snapshot reach
+# this many messages or bytes of messages, 0 disables the trigger
+CONVERSATION_SNAPSHOT_MESSAGES = int(os.getenv("CONVERSATION_SNAPSHOT_MESSAGES", "50"))
+CONVERSATION_SNAPSHOT_BYTES = int(os.getenv("CONVERSATION_SNAPSHOT_BYTES", "262144"))
+# Last messages a snapshot keeps as they are, the older ones are summarized
+CONVERSATION_SNAPSHOT_KEEP_MESSAGES = int(
+    os.getenv("CONVERSATION_SNAPSHOT_KEEP_MESSAGES", "20")
+)
+CONVERSATION_SNAPSHOT_SUMMARY_MAX_CHARS = int(
+    os.getenv("CONVERSATION_SNAPSHOT_SUMMARY_MAX_CHARS", "4000")
+)
+# Rows younger than this are left out of snapshots, so a row committed late by
+# a concurrent transaction (with a lower id) is never skipped
+CONVERSATION_SNAPSHOT_SETTLE_SECONDS = int(
+    os.getenv("CONVERSATION_SNAPSHOT_SETTLE_SECONDS", "60")
+)
+
+SUMMARY_LINE_MAX_CHARS = 200
+SUMMARY_ROLES = {"human": "User", "ai": "Assistant", "AIMessageChunk": "Assistant"}
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+
+
+class ConversationSnapshotRepository(SQLModel, table=True):
+    """
+    Compacted state of a session, covering its conversation rows up to
+    `last_message_id`: the last messages, the last intent and a summary of the
+    older turns.
+    """
+
+    user_id: str = Field(primary_key=True)
+    session_id: str = Field(primary_key=True)
+    last_message_id: int
+    # Messages covered by the snapshot, kept ones and summarized ones
+    message_count: int
+    # The kept messages, flattened by `message_to_dict`
+    messages: list = Field(
+        sa_column=Column(JSON().with_variant(JSONB(), "postgresql"), nullable=False)
+    )
+    summary: Optional[str] = None
+    intent: Optional[str] = None
+    updated_at: Optional[datetime] = Field(
+        default=None,
+        sa_column=Column(
+            DateTime(timezone=True),
+            nullable=False,
+            server_default=func.now(),
+            onupdate=func.now(),
+        ),
+    )
+
+
+def is_snapshot_enabled() -> bool:
+    return CONVERSATION_SNAPSHOT_MESSAGES > 0 or CONVERSATION_SNAPSHOT_BYTES > 0
+
+
+def _summary_line(message: dict) -> Optional[str]:
+    role = SUMMARY_ROLES.get(message["type"])
+    content = message.get("content")
+    if role is None or not isinstance(content, str) or not content.strip():
+        return None  # Tool results and tool calls carry no turn of their own
+
+    content = " ".join(content.split())
+    if len(content) > SUMMARY_LINE_MAX_CHARS:
+        content = content[: SUMMARY_LINE_MAX_CHARS - 1] + "…"
+    return f"{role}: {content}"
+
+
+def summarize_messages(messages: list[dict], summary: Optional[str]) -> Optional[str]:
+    """
+    Extend `summary` with one line per turn of `messages`, dropping its oldest
+    lines past `CONVERSATION_SNAPSHOT_SUMMARY_MAX_CHARS`.
+    """
+    lines = summary.splitlines() if summary else []
+    lines += [line for line in map(_summary_line, messages) if line is not None]
+
+    length = 0
+    for index in range(len(lines) - 1, -1, -1):
+        length += len(lines[index]) + 1
+        if length > CONVERSATION_SNAPSHOT_SUMMARY_MAX_CHARS:
+            lines = lines[index + 1 :]
+            break
+    return "\n".join(lines) or None
+
+
+def compact_messages(
+    messages: list[dict], summary: Optional[str]
+) -> tuple[list[dict], Optional[str]]:
+    """
+    Split messages into the last ones kept as they are and a summary of the
+    others. The kept ones start with a human message when there is one, so
+    they never start in the middle of a tool call exchange.
+    """
+    start = max(len(messages) - CONVERSATION_SNAPSHOT_KEEP_MESSAGES, 0)
+    for index in range(start, len(messages)):
+        if messages[index]["type"] == "human":
+            start = index
+            break
+
+    return messages[start:], summarize_messages(messages[:start], summary)
+
+
+def build_snapshot(
+    snapshot: Optional[ConversationSnapshotRepository],
+    user_id: str,
+    session_id: str,
+    rows: list[dict],
+) -> ConversationSnapshotRepository:
+    """
+    Fold conversation rows, in id order, into the snapshot of their session.
+
+    Args:
+        rows (list[dict]): `id`, `messages` and `intent` of the rows written
+            after the snapshot.
+    """
+    if snapshot is None:
+        snapshot = ConversationSnapshotRepository(
+            user_id=user_id,
+            session_id=session_id,
+            last_message_id=0,
+            message_count=0,
+            messages=[],
+        )
+
+    snapshot.messages, snapshot.summary = compact_messages(
+        snapshot.messages + [row["messages"] for row in rows], snapshot.summary
+    )
+    snapshot.last_message_id = rows[-1]["id"]
+    snapshot.message_count += len(rows)
+    snapshot.intent = rows[-1]["intent"]
+    return snapshot
+
+
+def summary_message(summary: str) -> SystemMessage:
+    return SystemMessage(SUMMARY_PREFIX + summary)
+
+
+def split_summary(messages: list[dict]) -> tuple[list[dict], Optional[str]]:
+    """
+    Split restored messages into the conversation and the summary held by
+    their leading system message, if any (see `snapshot_to_messages`).
+    """
+    if messages and messages[0]["type"] == "system":
+        content = messages[0].get("content")
+        if isinstance(content, str) and content.startswith(SUMMARY_PREFIX):
+            return messages[1:], content[len(SUMMARY_PREFIX) :] or None
+    return messages, None
+
+
+def snapshot_to_messages(
+    snapshot: ConversationSnapshotRepository, last_n: Optional[int] = None
+) -> LazyMessageList:
+    """
+    The messages restored from a snapshot, the last `last_n` kept ones only when
+    set, after a system message holding the summary of the older turns.
+    """
+    kept_messages = snapshot.messages
+    if last_n is not None:
+        kept_messages = kept_messages[max(len(kept_messages) - last_n, 0) :]
+
+    messages = LazyMessageList(kept_messages)
+    if snapshot.summary:
+        messages.insert(0, summary_message(snapshot.summary))
+    return messages
@@ -0,0 +1,471 @@
+# src.repositories.agent.conversation_writer
+import asyncio
+import glob
+import json
+import logging
+import os
+import time
+import uuid
+from typing import List, Optional
+
+import redis
+
+# for validation
+from pydantic import BaseModel, Field, model_validator
+from redis.asyncio.client import Pipeline
+
+from src.cache import async_redis_client
+from src.cache.pipeline_script import PipelineScript
+from src.models.agent.agent_state_model import AgentStateModel
+from src.repositories.agent.conversation_repository import (
+    _to_conversation_rows,
+    ainsert_conversation_rows,
+    drop_saved_conversation_rows,
+    insert_conversation_rows,
+)
+
+# Persist conversations in the background instead of on the request path. Rows
+# buffered by a crashed worker are lost unless the spool directory is set
+CONVERSATION_WRITE_BEHIND = (
+    os.getenv("CONVERSATION_WRITE_BEHIND", "False").lower() == "true"
+)
+# A batch is committed once it holds this many rows, or after the flush interval
+CONVERSATION_WRITER_BATCH_SIZE = int(os.getenv("CONVERSATION_WRITER_BATCH_SIZE", "500"))
+CONVERSATION_WRITER_FLUSH_INTERVAL_SECONDS = float(
+    os.getenv("CONVERSATION_WRITER_FLUSH_INTERVAL_SECONDS", "0.5")
+)
+# Rows buffered before turns fall back to saving synchronously (backpressure)
+CONVERSATION_WRITER_MAX_PENDING = int(
+    os.getenv("CONVERSATION_WRITER_MAX_PENDING", "10000")
+)
+CONVERSATION_WRITER_RETRY_SECONDS = float(
+    os.getenv("CONVERSATION_WRITER_RETRY_SECONDS", "1")
+)
+CONVERSATION_WRITER_SHUTDOWN_ATTEMPTS = int(
+    os.getenv("CONVERSATION_WRITER_SHUTDOWN_ATTEMPTS", "3")
+)
+# Directory of the spool files keeping buffered rows across crashes, empty to disable
+CONVERSATION_WRITER_SPOOL_DIR = os.getenv("CONVERSATION_WRITER_SPOOL_DIR", "")
+# Seconds a turn waits for the rows of its session another worker has not
+# committed yet, see `wait_until_saved`
+CONVERSATION_WRITER_PENDING_WAIT_SECONDS = float(
+    os.getenv("CONVERSATION_WRITER_PENDING_WAIT_SECONDS", "5")
+)
+# Expiry of the pending markers, in case their worker dies before clearing them
+CONVERSATION_WRITER_PENDING_TTL_SECONDS = int(
+    os.getenv("CONVERSATION_WRITER_PENDING_TTL_SECONDS", "60")
+)
+
+# Marks a session with rows buffered by writers: a hash of the token of each
+# writer to the time its mark expires at, in case the writer dies
+PENDING_KEY_PREFIX = "conversation_pending:"
+
+# KEYS: pending marker of a session
+# ARGV: token, now, expires at, ttl
+# Marks the session for a writer, replies the other writers marking it
+MARK_PENDING_SCRIPT = """
+local other_tokens = {}
+local marks = redis.call('HGETALL', KEYS[1])
+for index = 1, #marks, 2 do
+    if tonumber(marks[index + 1]) <= tonumber(ARGV[2]) then
+        redis.call('HDEL', KEYS[1], marks[index])
+    elseif marks[index] ~= ARGV[1] then
+        table.insert(other_tokens, marks[index])
+    end
+end
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return other_tokens
+"""
+
+_mark_pending = PipelineScript(MARK_PENDING_SCRIPT)
+
+
+def _get_pending_key(user_id: str, session_id: str) -> str:
+    return f"{PENDING_KEY_PREFIX}{user_id}:{session_id}"
+
+
+def _get_process_start_time(pid: int) -> Optional[str]:
+    """
+    Start time of a process, in clock ticks since boot: tells a process from
+    a later one reusing its pid, as happens when a container restarts. None
+    where /proc is not available.
+    """
+    try:
+        with open(f"/proc/{pid}/stat", encoding="utf-8") as stat_file:
+            # The fields after the command name, which may hold spaces
+            return stat_file.read().rsplit(")", 1)[1].split()[19]
+    except (OSError, IndexError):
+        return None
+
+
+def _is_process_alive(pid: int, start_time: Optional[str] = None) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    if start_time is None:
+        return True
+    current_start_time = _get_process_start_time(pid)
+    return current_start_time is None or current_start_time == start_time
+
+
+class ConversationWriter(BaseModel):
+    """
+    Write-behind persistence of conversations.
+
+    Turns hand their new messages over with `enqueue` and return right away; a
+    background task groups the rows of every session into multi-row INSERTs and
+    commits them once `batch_size` rows are pending or every
+    `flush_interval_seconds`. Failed commits are retried, and the pending rows
+    are flushed on shutdown.
+
+    With `spool_dir` set, rows are also appended to a spool file of the worker
+    before being acknowledged, and the file is removed once they are committed.
+    Spool files left behind by a crashed worker are replayed on the next
+    startup, skipping the rows it committed before dying.
+
+    Sessions with buffered rows are marked in Redis (`queue_pending_markers`),
+    so a turn reloading one from the database first waits for them, and so
+    does a turn whose previous one was served by another worker before
+    enqueueing its own rows: rows are committed in the order of the turns,
+    see `wait_until_saved`.
+    """
+
+    batch_size: int = Field(default=CONVERSATION_WRITER_BATCH_SIZE, ge=1)
+    flush_interval_seconds: float = Field(
+        default=CONVERSATION_WRITER_FLUSH_INTERVAL_SECONDS, gt=0
+    )
+    max_pending: int = Field(default=CONVERSATION_WRITER_MAX_PENDING, ge=1)
+    spool_dir: Optional[str] = Field(default=CONVERSATION_WRITER_SPOOL_DIR or None)
+
+    @model_validator(mode="after")
+    def __after_init(self):
+        self._pending_rows: List[dict] = []
+        self._task: Optional[asyncio.Task] = None
+        self._wake_up: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+
+        # Spool segments: the open one receives new rows, the closed ones hold
+        # rows taken by a flush that has not been committed yet
+        self._spool_file = None
+        self._spool_segment = 0
+        self._closed_spool_paths: List[str] = []
+        # Tells the spool files of this process from the ones of a process
+        # that had the same pid before, set on start
+        self._spool_token: Optional[str] = None
+
+        # Buffered rows by session, and the token of the pending markers of
+        # this worker, set on start
+        self._pending_sessions: dict[tuple[str, str], int] = {}
+        self._token: Optional[str] = None
+
+        self._stats = {"enqueued": 0, "written": 0, "batches": 0, "failures": 0}
+        return self
+
+    @property
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def _spool_path(self, segment: int) -> str:
+        return os.path.join(
+            self.spool_dir,
+            f"conversations-{os.getpid()}-{self._spool_token}-{segment}.jsonl",
+        )
+
+    def _open_spool_segment(self) -> None:
+        # A new file every time, a segment is never appended to once closed
+        self._spool_segment += 1
+        self._spool_file = open(
+            self._spool_path(self._spool_segment), "x", encoding="utf-8"
+        )
+
+    def _rotate_spool(self) -> None:
+        """
+        Close the open spool segment, it holds exactly the rows being flushed.
+        """
+        if self._spool_file is None:
+            return
+        self._spool_file.close()
+        self._closed_spool_paths.append(self._spool_file.name)
+        self._open_spool_segment()
+
+    def _remove_closed_spool_segments(self) -> None:
+        for path in self._closed_spool_paths:
+            os.remove(path)
+        self._closed_spool_paths = []
+
+    def _replay_spool(self) -> None:
+        """
+        Commit the rows spooled by workers that died before flushing them.
+        """
+        for path in glob.glob(os.path.join(self.spool_dir, "conversations-*.jsonl")):
+            # conversations-{pid}-{start time or random token}-{segment}.jsonl
+            name_parts = os.path.basename(path).split("-")
+            pid = int(name_parts[1])
+            start_time = name_parts[2] if len(name_parts) == 4 else None
+            if _is_process_alive(pid, start_time):
+                continue
+
+            # Claim the file, so concurrently starting workers replay it once
+            claimed_path = f"{path}.replaying-{os.getpid()}"
+            try:
+                os.rename(path, claimed_path)
+            except FileNotFoundError:
+                continue
+
+            with open(claimed_path, encoding="utf-8") as spool_file:
+                rows = [json.loads(line) for line in spool_file if line.strip()]
+            for row in rows:
+                if isinstance(row["messages"], str):  # Spooled as JSON text
+                    row["messages"] = json.loads(row["messages"])
+                    row["message_type"] = row["messages"].get("type")
+            # The worker may have died between committing them and removing the file
+            unsaved_rows = drop_saved_conversation_rows(rows)
+            insert_conversation_rows(unsaved_rows, self.batch_size)
+            os.remove(claimed_path)
+            logging.info(
+                f"Replayed {len(unsaved_rows)} spooled conversation rows from {path}, "
+                f"{len(rows) - len(unsaved_rows)} were saved already"
+            )
+
+    async def start(self) -> None:
+        """
+        Replay leftover spool files and start the background flushes.
+        """
+        if self.is_running:
+            return
+
+        self._token = uuid.uuid4().hex
+        if self.spool_dir:
+            os.makedirs(self.spool_dir, exist_ok=True)
+            self._spool_token = _get_process_start_time(os.getpid()) or uuid.uuid4().hex
+            await asyncio.to_thread(self._replay_spool)
+            self._open_spool_segment()
+        else:
+            logging.warning(
+                "Conversation writer has no spool directory, "
+                "the rows it buffers are lost if the worker crashes"
+            )
+
+        self._wake_up = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Stop the background flushes and commit every pending row.
+        """
+        if not self.is_running:
+            return
+
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+        for _ in range(CONVERSATION_WRITER_SHUTDOWN_ATTEMPTS):
+            if await self.flush():
+                break
+            await asyncio.sleep(CONVERSATION_WRITER_RETRY_SECONDS)
+        else:
+            # Spooled rows are replayed by the next worker to start
+            logging.error(
+                f"Lost {len(self._pending_rows)} unsaved conversation rows on shutdown"
+                if self._spool_file is None
+                else f"Left {len(self._pending_rows)} unsaved conversation rows in the spool"
+            )
+
+        if self._spool_file is not None:
+            self._spool_file.close()
+            os.remove(self._spool_file.name)  # Empty, its rows were all flushed
+            self._spool_file = None
+
+    def enqueue(self, items: List[tuple[AgentStateModel, int]]) -> bool:
+        """
+        Buffer the last messages of several agent states for the next flush.
+
+        Args:
+            items: `(agent_state, number_of_last_messages)` pairs.
+        Returns:
+            bool: False when the writer is not running or too far behind, the
+                caller then has to save the conversations itself.
+        """
+        if not self.is_running:
+            return False
+
+        rows = _to_conversation_rows(items)
+        if len(self._pending_rows) + len(rows) > self.max_pending:
+            logging.warning("Conversation writer is behind, saving synchronously")
+            return False
+
+        if self._spool_file is not None:
+            self._spool_file.writelines(json.dumps(row) + "\n" for row in rows)
+            self._spool_file.flush()
+
+        self._pending_rows.extend(rows)
+        for row in rows:
+            key = (row["user_id"], row["session_id"])
+            self._pending_sessions[key] = self._pending_sessions.get(key, 0) + 1
+        self._stats["enqueued"] += len(rows)
+        if len(self._pending_rows) >= self.batch_size:
+            self._wake_up.set()
+        return True
+
+    async def flush(self) -> bool:
+        """
+        Commit the pending rows now.
+
+        Returns:
+            bool: False if the commit failed, the rows are then kept for a retry.
+        """
+        async with self._flush_lock:
+            if not self._pending_rows:
+                return True
+
+            rows, self._pending_rows = self._pending_rows, []
+            self._rotate_spool()
+            try:
+                await ainsert_conversation_rows(rows, self.batch_size)
+            except Exception:
+                logging.exception(f"Failed to save {len(rows)} conversation rows")
+                self._pending_rows = rows + self._pending_rows
+                self._stats["failures"] += 1
+                return False
+
+            if self._closed_spool_paths:
+                self._remove_closed_spool_segments()
+            self._stats["written"] += len(rows)
+            self._stats["batches"] += 1
+            await self._clear_pending_sessions(rows)
+            return True
+
+    def queue_pending_markers(
+        self, pipe: Pipeline, keys: List[tuple[str, str]]
+    ) -> None:
+        """
+        Queue the markers of sessions whose rows are about to be enqueued, in
+        a pipeline of the turn, so marking them costs no round trip of its
+        own. Each replies the tokens of the other writers with rows pending
+        for the session, to wait for (see `wait_until_saved`) before enqueueing.
+
+        Args:
+            keys: `(user_id, session_id)` pairs.
+        """
+        now = time.time()
+        for user_id, session_id in keys:
+            _mark_pending.queue(
+                pipe,
+                keys=[_get_pending_key(user_id, session_id)],
+                args=[
+                    self._token,
+                    now,
+                    now + CONVERSATION_WRITER_PENDING_TTL_SECONDS,
+                    CONVERSATION_WRITER_PENDING_TTL_SECONDS,
+                ],
+            )
+
+    async def clear_pending_markers(self, keys: List[tuple[str, str]]) -> None:
+        """
+        Clear the markers of this writer on sessions it has no rows of.
+
+        Args:
+            keys: `(user_id, session_id)` pairs.
+        """
+        saved_keys = [key for key in keys if key not in self._pending_sessions]
+        if not saved_keys:
+            return
+
+        try:
+            async with async_redis_client.pipeline(transaction=False) as pipe:
+                for user_id, session_id in saved_keys:
+                    pipe.hdel(_get_pending_key(user_id, session_id), self._token)
+                await pipe.execute()
+        except redis.RedisError as e:
+            logging.warning(f"Cannot clear the pending conversation markers: {e}")
+
+    async def _clear_pending_sessions(self, rows: List[dict]) -> None:
+        saved_keys = []
+        for row in rows:
+            key = (row["user_id"], row["session_id"])
+            self._pending_sessions[key] -= 1
+            if not self._pending_sessions[key]:
+                del self._pending_sessions[key]
+                saved_keys.append(key)
+        await self.clear_pending_markers(saved_keys)
+
+    async def wait_until_saved(self, keys: List[tuple[str, str]]) -> None:
+        """
+        Wait until the buffered rows of sessions are committed, before their
+        conversation is loaded from the database or rows of a later turn are
+        saved: flush the ones of this worker, and wait up to
+        `CONVERSATION_WRITER_PENDING_WAIT_SECONDS` for the ones of other workers.
+
+        Args:
+            keys: `(user_id, session_id)` pairs.
+        """
+        if self.is_running and any(key in self._pending_sessions for key in keys):
+            await self.flush()
+
+        pending_keys = [
+            _get_pending_key(user_id, session_id) for user_id, session_id in keys
+        ]
+        deadline = time.monotonic() + CONVERSATION_WRITER_PENDING_WAIT_SECONDS
+        while pending_keys:
+            try:
+                async with async_redis_client.pipeline(transaction=False) as pipe:
+                    for pending_key in pending_keys:
+                        pipe.hgetall(pending_key)
+                    marks = await pipe.execute()
+            except redis.RedisError as e:
+                logging.warning(f"Cannot read the pending conversation markers: {e}")
+                return
+            # The markers of this worker left after a failed flush are not waited for
+            now = time.time()
+            pending_keys = [
+                pending_key
+                for pending_key, session_marks in zip(pending_keys, marks)
+                if any(
+                    token != self._token and float(expires_at) > now
+                    for token, expires_at in session_marks.items()
+                )
+            ]
+            remaining_seconds = deadline - time.monotonic()
+            if pending_keys and remaining_seconds <= 0:
+                logging.warning(
+                    f"Loading {pending_keys} before other workers saved their last rows"
+                )
+                return
+            if pending_keys:
+                await asyncio.sleep(min(self.flush_interval_seconds, remaining_seconds))
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(
+                    self._wake_up.wait(), timeout=self.flush_interval_seconds
+                )
+            except asyncio.TimeoutError:
+                pass
+            self._wake_up.clear()
+
+            if not await self.flush():
+                await asyncio.sleep(CONVERSATION_WRITER_RETRY_SECONDS)
+
+    def get_stats(self) -> dict:
+        """
+        Row counters and backlog of this worker's writer.
+        """
+        return {
+            "running": self.is_running,
+            "pending": len(self._pending_rows),
+            "pending_sessions": len(self._pending_sessions),
+            **self._stats,
+        }
+
+
+conversation_writer = ConversationWriter()
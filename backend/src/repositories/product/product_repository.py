@@ -31,7 +31,7 @@ class ProductRepository(BaseLlmService, BaseEmbeddingService, BaseMilvusService)
             )
 
             fields = generate_milvus_field_schemas_from_pydantic(
-                pydantic_model=ProductModel, embedding_dim=self.embedding_dim
+                pydantic_model=ProductModel, embedding_dim=self.get_embedding_dim()
             )
 
             # create collection with schema
@@ -1,9 +1,13 @@
-from typing import Optional
+import asyncio
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
 
 from langgraph.graph import END, StateGraph
 from langgraph.prebuilt import ToolNode
 from pydantic import BaseModel, Field
 
+from src.common.metrics import AgentMetricsCallbackHandler
 from src.models.agent.agent_state_model import AgentStateModel
 from src.services.ai_agent.nodes.greeting import Greeting
 from src.services.ai_agent.nodes.intent_detection import IntentDetector
@@ -49,15 +53,14 @@ class AIAgent(BaseModel):
     def _add_nodes(self):
         """Add all nodes to the workflow"""
         # Add basic nodes
-        self.workflow.add_node("intent_detection", IntentDetector(llm_temperature=0))
-        self.workflow.add_node(
-            "greeting", Greeting(llm_temperature=self.llm_temperature)
-        )
+        intent_detection = IntentDetector(llm_temperature=0)
+        self.workflow.add_node("intent_detection", intent_detection)
+        greeting = Greeting(llm_temperature=self.llm_temperature)
+        self.workflow.add_node("greeting", greeting)
 
         # Add product related nodes
-        product_tools = ProductTools(
-            collection_name=self.collection_name
-        ).create_tools()
+        self._product_tools = ProductTools(collection_name=self.collection_name)
+        product_tools = self._product_tools.create_tools()
         self.workflow.add_node("product_tools", ToolNode(product_tools))
 
         product = Product(tools=product_tools, llm_temperature=self.llm_temperature)
@@ -68,6 +71,13 @@ class AIAgent(BaseModel):
         self.workflow.add_node("make_order", make_order)
         self.workflow.add_node("make_order_tools", ToolNode([make_order_tool]))
 
+        self._llm_nodes = {
+            "intent_detection": intent_detection,
+            "greeting": greeting,
+            "product": product,
+            "make_order": make_order,
+        }
+
     def _setup_edges(self):
         """Configure all edges and entry point"""
         # Set entry point
@@ -110,25 +120,79 @@ class AIAgent(BaseModel):
         # Terminal edges
         self.workflow.add_edge("greeting", END)
 
+    def get_warm_up_tasks(self) -> Dict[str, Callable[[], Any]]:
+        """
+        Independent steps opening the connections of the agent ahead of the
+        first request, to run concurrently at startup (see `run_startup_tasks`).
+        """
+        tasks = {f"llm.{name}": node.warm_up for name, node in self._llm_nodes.items()}
+        tasks.update(self._product_tools.get_warm_up_tasks())
+        return tasks
+
+    def _get_run_config(self) -> dict:
+        """Build the run config of one graph execution"""
+        return {"callbacks": [AgentMetricsCallbackHandler()]}
+
     def get_graph(self):
         """Get the compiled graph"""
         return self.graph
 
     def invoke(self, input_data):
-        """Execute the agent workflow"""
+        """
+        Execute the agent workflow, blocking until it finishes (see `ainvoke`).
+
+        Called from a running event loop (notebooks, async tests), the workflow
+        runs on a loop of its own thread, as `asyncio.run` cannot nest.
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self.ainvoke(input_data))
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            return executor.submit(asyncio.run, self.ainvoke(input_data)).result()
+
+    async def ainvoke(self, input_data):
+        """Execute the agent workflow asynchronously"""
         if not self.graph:
             raise ValueError(
                 "Graph not initialized. Please ensure workflow setup is complete."
             )
-        return self.graph.invoke(input_data)
+        return await self.graph.ainvoke(input_data, config=self._get_run_config())
 
-    def stream(self, input_data):
-        """Stream the agent workflow execution"""
+    def astream(self, input_data, stream_mode=("updates", "messages", "values")):
+        """Stream the agent workflow execution as `(mode, chunk)` tuples"""
         if not self.graph:
             raise ValueError(
                 "Graph not initialized. Please ensure workflow setup is complete."
             )
-        return self.graph.stream(input_data)
+        return self.graph.astream(
+            input_data, config=self._get_run_config(), stream_mode=list(stream_mode)
+        )
+
+    def stream(self, input_data):
+        """
+        Stream the agent workflow execution, blocking, as the update of each
+        node (see `astream`). The workflow runs on a loop of its own thread,
+        whether or not the caller runs one.
+        """
+        chunks = queue.Queue()
+        done = object()
+
+        async def produce():
+            try:
+                async for _, chunk in self.astream(
+                    input_data, stream_mode=("updates",)
+                ):
+                    chunks.put(chunk)
+            finally:
+                chunks.put(done)
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(asyncio.run, produce())
+            while (chunk := chunks.get()) is not done:
+                yield chunk
+            future.result()  # Raises the error of the workflow, if any
 
     def reset_workflow(self):
         """Reset and reinitialize the workflow"""
@@ -11,7 +11,7 @@ class Greeting(BaseAgentService):
     agent_prompt: str = prompt
     llm_model: str = "gemini-2.0-flash-lite"
 
-    def __call__(self, state) -> Dict[str, Any]:
+    async def __call__(self, state) -> Dict[str, Any]:
         """
         Phân loại ý định từ 'user_input' trong state và cập nhật state với 'intent' được phát hiện.
         """
@@ -23,7 +23,7 @@ class Greeting(BaseAgentService):
             "chat_history": messages,
         }
 
-        response = self.run(invoke_input)
+        response = await self.arun(invoke_input)
 
         return {
             "messages": [response],
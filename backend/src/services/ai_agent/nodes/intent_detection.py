@@ -1,11 +1,13 @@
+import hashlib
 import logging
-from typing import Any, Dict, Literal
+from typing import Any, Dict, Literal, Optional
 
-from langchain.output_parsers import PydanticOutputParser
 from langchain_core.messages import HumanMessage
-from pydantic import BaseModel
+from langchain_core.output_parsers import PydanticOutputParser
+from pydantic import BaseModel, model_validator
 
 from src.base.service.base_agent_service import BaseAgentService
+from src.cache.intent_cache import intent_cache
 
 list_intents = ["product", "greeting", "make_order"]
 
@@ -25,7 +27,15 @@ class IntentDetector(BaseAgentService):
     llm_model: str = "gemini-2.5-flash-preview-05-20"
     agent_prompt: str = prompt
 
-    def __call__(self, state) -> Dict[str, Any]:
+    @model_validator(mode="after")
+    def __after_init(self):
+        # Intents cached by another model or prompt are not reused
+        self._cache_scope = hashlib.sha1(
+            f"{self.llm_model}:{self.llm_temperature}:{self.agent_prompt}".encode()
+        ).hexdigest()[:16]
+        return self
+
+    async def __call__(self, state) -> Dict[str, Any]:
         """
         Classify intent from 'user_input' in state and update state with detected 'intent'.
         """
@@ -43,19 +53,15 @@ class IntentDetector(BaseAgentService):
                 # "format_instructions": output_parser.get_format_instructions(),
             }
 
-            response = self.run(invoke_input)
-
-            # parsed_output = output_parser.parse(response.content).model_dump()
-            # print(f"Parsed output: {parsed_output}")
-            # return parsed_output
-
-            detected_intent = response.content.strip().lower()
-
-            # (Optional) Check if intent is in valid list
-            if detected_intent not in list_intents:
-                logging.warning(
-                    f"Warning: LLM returned an unexpected intent: '{detected_intent}'. Defaulting to 'greeting'."
-                )
+            # Inputs classified before skip the LLM call
+            detected_intent = await intent_cache.get_or_detect(
+                user_input,
+                state.intent,
+                messages,
+                detect=lambda: self._detect_intent(invoke_input),
+                scope=self._cache_scope,
+            )
+            if detected_intent is None:
                 detected_intent = "greeting"
 
             logging.info(f"Input: '{user_input}' - Detected intent: {detected_intent}")
@@ -66,3 +72,23 @@ class IntentDetector(BaseAgentService):
             state["intent_error"] = str(e)
 
         return {"intent": detected_intent, "messages": HumanMessage(user_input)}
+
+    async def _detect_intent(self, invoke_input: dict) -> Optional[str]:
+        """
+        Intent detected by the LLM, None when it is not one of `list_intents`.
+        """
+        response = await self.arun(invoke_input)
+
+        # parsed_output = output_parser.parse(response.content).model_dump()
+        # print(f"Parsed output: {parsed_output}")
+        # return parsed_output
+
+        detected_intent = response.content.strip().lower()
+
+        # (Optional) Check if intent is in valid list
+        if detected_intent not in list_intents:
+            logging.warning(
+                f"Warning: LLM returned an unexpected intent: '{detected_intent}'. Defaulting to 'greeting'."
+            )
+            return None
+        return detected_intent
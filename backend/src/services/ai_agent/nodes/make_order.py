@@ -14,7 +14,7 @@ class MakeOder(BaseAgentService):
     llm_model: str = "gemini-2.0-flash-lite"
     tools: list = [make_order_tool]
 
-    def __call__(self, state) -> Dict[str, Any]:
+    async def __call__(self, state) -> Dict[str, Any]:
         """
         Phân loại ý định từ 'user_input' trong state và cập nhật state với 'intent' được phát hiện.
         """
@@ -26,7 +26,7 @@ class MakeOder(BaseAgentService):
             "chat_history": messages,
         }
 
-        response = self.run(invoke_input)
+        response = await self.arun(invoke_input)
 
         return {
             "messages": [response],
@@ -11,7 +11,7 @@ class Product(BaseAgentService):
     agent_prompt: str = prompt
     llm_model: str = "gemini-2.5-flash-preview-05-20"
 
-    def __call__(self, state) -> Dict[str, Any]:
+    async def __call__(self, state) -> Dict[str, Any]:
         """
         Handle product-related queries and tool usage
         """
@@ -23,7 +23,7 @@ class Product(BaseAgentService):
             "chat_history": messages,
         }
 
-        response = self.run(invoke_input)
+        response = await self.arun(invoke_input)
 
         return {
             "messages": [response],
@@ -1,3 +1,5 @@
+from typing import Any, Callable, Dict
+
 from src.base.service.base_milvus_service import BaseMilvusService
 from src.services.common.tools.get_categories_tool import GetCategoriesTool
 from src.services.common.tools.search_advanced_tool import SearchAdvancedTool
@@ -16,9 +18,21 @@ class ProductTools(BaseMilvusService):
             collection_name=self.collection_name
         )
 
+        self._search_advanced_service = search_advanced_service
+        self._get_categories_service = get_categories_service
+
         tools = [
             # SearchBasicTool(search_advanced_service=search_advanced_service),
             SearchAdvancedTool(search_advanced_service=search_advanced_service),
             GetCategoriesTool(get_categories_service=get_categories_service),
         ]
         return tools
+
+    def get_warm_up_tasks(self) -> Dict[str, Callable[[], Any]]:
+        """
+        Warm-up steps of the services behind the tools, see `create_tools`.
+        """
+        return {
+            "milvus.search_advanced": self._search_advanced_service.warm_up,
+            "milvus.get_categories": self._get_categories_service.warm_up,
+        }
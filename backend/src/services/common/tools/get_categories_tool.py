@@ -1,7 +1,7 @@
 import logging
 from typing import Optional, Type
 
-from langchain.tools import BaseTool
+from langchain_core.tools import BaseTool
 from pydantic import BaseModel, Field
 from src.services.product.get_categories_service import GetCategoriesService
 
@@ -1,6 +1,6 @@
 import logging
 
-from langchain.tools import tool
+from langchain_core.tools import tool
 from pydantic import validate_call, Field
 
 
@@ -2,7 +2,7 @@ import logging
 from typing import List, Optional, Type
 
 from dotenv import load_dotenv
-from langchain.tools import BaseTool
+from langchain_core.tools import BaseTool
 from pydantic import BaseModel, Field, validate_call
 from src.services.product.search_advanced_service import SearchAdvancedService
 
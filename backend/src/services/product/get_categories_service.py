@@ -1,10 +1,14 @@
 # src.services.product.common.tools.get_categories
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
 
 from pydantic import Field, model_validator, validate_call
-from pymilvus import Collection
 
 from src.base.service.base_milvus_service import BaseMilvusService
+from src.common.metrics import BACKEND_LATENCY, observe_latency
+from src.common.process_local import ProcessLocal
+
+if TYPE_CHECKING:
+    from pymilvus import Collection
 
 
 class GetCategoriesService(BaseMilvusService):
@@ -15,7 +19,7 @@ class GetCategoriesService(BaseMilvusService):
         """
         Hàm này được gọi sau khi khởi tạo đối tượng để thiết lập các thuộc tính cần thiết.
         """
-        self._collection = Collection(name=self.collection_name)
+        self._collection_client = ProcessLocal(self._create_collection)
 
         self._category_tier_map = {
             1: "category_tier_one",
@@ -25,6 +29,22 @@ class GetCategoriesService(BaseMilvusService):
 
         return self
 
+    def _create_collection(self) -> "Collection":
+        from pymilvus import Collection
+
+        self.connect()
+        return Collection(name=self.collection_name)
+
+    @property
+    def _collection(self) -> "Collection":
+        return self._collection_client.get()
+
+    def warm_up(self) -> None:
+        """
+        Connect to the collection ahead of the first request.
+        """
+        self._collection_client.get()
+
     @validate_call
     def get_categories(
         self,
@@ -93,13 +113,14 @@ class GetCategoriesService(BaseMilvusService):
 
         while True:
             # Truy vấn với limit và offset
-            query_results = self._collection.query(
-                expr=expr,
-                output_fields=[output_field],
-                limit=_limit,
-                offset=_offset,
-                consistency_level="Strong",  # make sure to use strong consistency
-            )
+            with observe_latency(BACKEND_LATENCY, backend="milvus", operation="query"):
+                query_results = self._collection.query(
+                    expr=expr,
+                    output_fields=[output_field],
+                    limit=_limit,
+                    offset=_offset,
+                    consistency_level="Strong",  # make sure to use strong consistency
+                )
 
             # break if no results found
             if not query_results:
@@ -1,16 +1,42 @@
 # src.services.product.search_advanced
 import logging
-from typing import List, Optional
+from typing import TYPE_CHECKING, List, Optional
 
-from langchain_milvus import Milvus
-from pydantic import Field, validate_call
+from pydantic import Field, model_validator, validate_call
 
 # for validation
 from src.base.service.base_embedding_service import BaseEmbeddingService
 from src.base.service.base_milvus_service import BaseMilvusService
+from src.common.metrics import BACKEND_LATENCY, observe_latency
+from src.common.process_local import ProcessLocal
+
+if TYPE_CHECKING:
+    from langchain_milvus import Milvus
 
 
 class SearchAdvancedService(BaseMilvusService, BaseEmbeddingService):
+
+    @model_validator(mode="after")
+    def __after_init(self):
+        self._milvus_client = ProcessLocal(self._create_milvus)
+        return self
+
+    def _create_milvus(self) -> "Milvus":
+        from langchain_milvus import Milvus
+
+        return Milvus(
+            embedding_function=self._embeddings,
+            collection_name=self.collection_name,
+            connection_args={"uri": self.milvus_uri, "token": self.milvus_token},
+        )
+
+    def warm_up(self) -> None:
+        """
+        Build the embedding client and the vector store ahead of the first request.
+        """
+        self.warm_up_embeddings()
+        self._milvus_client.get()
+
     @validate_call
     def search(
         self,
@@ -44,11 +70,7 @@ class SearchAdvancedService(BaseMilvusService, BaseEmbeddingService):
     ) -> List[str]:
         assert price_range[0] <= price_range[1], "Invalid Price Range!"
 
-        milvus = Milvus(
-            embedding_function=self._embeddings,
-            collection_name=self.collection_name,
-            connection_args={"uri": self.milvus_uri, "token": self.milvus_token},
-        )
+        milvus = self._milvus_client.get()
 
         expr = f"(price >= {price_range[0]} and price <= {price_range[1]}) "
 
@@ -67,11 +89,18 @@ class SearchAdvancedService(BaseMilvusService, BaseEmbeddingService):
             )
             expr += f" AND product_name NOT IN [{excluded_names_str}] "
 
-        result = milvus.similarity_search(
-            query=description,
-            k=product_amount + product_offset,  # Lấy nhiều hơn để có thể product_offset
-            expr=expr,
-        )
+        with observe_latency(
+            BACKEND_LATENCY, backend="embedding", operation="embed_query"
+        ):
+            embedding = self._embeddings.embed_query(description)
+
+        with observe_latency(BACKEND_LATENCY, backend="milvus", operation="search"):
+            result = milvus.similarity_search_by_vector(
+                embedding=embedding,
+                k=product_amount
+                + product_offset,  # Lấy nhiều hơn để có thể product_offset
+                expr=expr,
+            )
 
         # Trả về kết quả từ vị trí product_offset
         return result[product_offset : product_offset + product_amount]
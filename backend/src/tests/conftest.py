@@ -0,0 +1,42 @@
+import sys
+
+import fakeredis
+import pytest
+
+import src.cache
+
+REDIS_CLIENT_NAMES = (
+    "redis_client",
+    "redis_binary_client",
+    "async_redis_client",
+    "async_redis_binary_client",
+)
+
+
+@pytest.fixture
+def fake_redis(monkeypatch) -> dict:
+    """
+    Replace the Redis clients of `src.cache`, in every module that imported
+    them, by in-memory clients sharing one fake server.
+
+    Returns:
+        dict: the fake clients by name.
+    """
+    server = fakeredis.FakeServer()
+    fake_clients = {
+        "redis_client": fakeredis.FakeRedis(server=server, decode_responses=True),
+        "redis_binary_client": fakeredis.FakeRedis(server=server),
+        "async_redis_client": fakeredis.FakeAsyncRedis(
+            server=server, decode_responses=True
+        ),
+        "async_redis_binary_client": fakeredis.FakeAsyncRedis(server=server),
+    }
+    names = {id(getattr(src.cache, name)): name for name in REDIS_CLIENT_NAMES}
+    for module in list(sys.modules.values()):
+        if module is None or not module.__name__.startswith("src"):
+            continue
+        for attribute, value in list(vars(module).items()):
+            name = names.get(id(value))
+            if name is not None:
+                monkeypatch.setattr(module, attribute, fake_clients[name])
+    return fake_clients
@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+
+import src.cache.agent_state_cache_wrapper as agent_state_cache_wrapper
+import src.cache.session_queue as session_queue
+from src.cache.agent_state_cache_wrapper import (
+    agent_state_cache_wrapper as cache_wrapper,
+)
+from src.cache.agent_state_cache_wrapper import agent_state_stream_cache_wrapper
+from src.models.agent.agent_state_model import AgentStateModel
+
+
+@pytest.fixture(autouse=True)
+def stored_states(monkeypatch, fake_redis):
+    """
+    The turns stored by the wrappers, instead of the cache and the database.
+    """
+    stored_states = []
+
+    async def load_agent_state(agent_state):
+        return agent_state
+
+    async def store_agent_state(agent_state, result):
+        stored_states.append(result)
+
+    monkeypatch.setattr(session_queue, "SESSION_QUEUE_POLL_INTERVAL_SECONDS", 0.01)
+    monkeypatch.setattr(agent_state_cache_wrapper, "load_agent_state", load_agent_state)
+    monkeypatch.setattr(
+        agent_state_cache_wrapper, "store_agent_state", store_agent_state
+    )
+    return stored_states
+
+
+def _turn() -> AgentStateModel:
+    return AgentStateModel(session_id="session", user_id="user", user_input="xin chào")
+
+
+def _answer(agent_state: AgentStateModel) -> AgentStateModel:
+    return agent_state.model_copy(
+        update={
+            "messages": [
+                HumanMessage(content="xin chào", id="1"),
+                AIMessage(content="chào bạn", id="2"),
+            ],
+            "intent": "greeting",
+        }
+    )
+
+
+def test_duplicate_turns_get_the_messages_of_the_leader(stored_states):
+    @cache_wrapper
+    async def run(agent_state: AgentStateModel) -> AgentStateModel:
+        await asyncio.sleep(0.05)
+        return _answer(agent_state)
+
+    async def main():
+        return await asyncio.gather(run(_turn()), run(_turn()))
+
+    leader, duplicate = asyncio.run(main())
+    assert len(stored_states) == 1
+    assert isinstance(duplicate.messages[-1], AIMessage)
+    assert duplicate.messages[-1].content == leader.messages[-1].content
+    assert duplicate.intent == "greeting"
+
+
+def test_duplicate_streamed_turns_get_the_messages_of_the_leader(stored_states):
+    @agent_state_stream_cache_wrapper
+    async def stream(agent_state: AgentStateModel):
+        await asyncio.sleep(0.05)
+        yield "values", _answer(agent_state).model_dump()
+
+    async def collect():
+        return [chunk async for mode, chunk in stream(_turn()) if mode == "values"]
+
+    async def main():
+        return await asyncio.gather(collect(), collect())
+
+    _, duplicate_chunks = asyncio.run(main())
+    assert len(stored_states) == 1
+    assert duplicate_chunks[-1].messages[-1].content == "chào bạn"
@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+import src.cache.cache_namespace as cache_namespace
+from src.cache.cache_namespace import CacheNamespace
+
+
+@pytest.fixture(autouse=True)
+def fresh_versions(monkeypatch, fake_redis):
+    monkeypatch.setattr(cache_namespace, "CACHE_NAMESPACE_VERSION_TTL_SECONDS", 0)
+
+
+def test_invalidation_moves_every_worker_to_a_new_version(fake_redis):
+    namespace = CacheNamespace(name="test")
+    other_worker = CacheNamespace(name="test")
+    client = fake_redis["redis_client"]
+
+    client.set(namespace.key("a"), "1")
+    assert client.get(other_worker.key("a")) == "1"
+
+    version = asyncio.run(namespace.invalidate())
+    assert version == 0
+    assert namespace.key("a") == "test:v1:a"
+    assert client.get(other_worker.key("a")) is None
+
+
+def test_version_is_reused_within_its_ttl(monkeypatch, fake_redis):
+    monkeypatch.setattr(cache_namespace, "CACHE_NAMESPACE_VERSION_TTL_SECONDS", 60)
+    namespace = CacheNamespace(name="test")
+    other_worker = CacheNamespace(name="test")
+    assert other_worker.key("a") == "test:v0:a"
+
+    asyncio.run(namespace.invalidate())
+    assert other_worker.key("a") == "test:v0:a"
+    other_worker._version_read_at = 0
+    assert other_worker.key("a") == "test:v1:a"
+
+
+def test_version_checked_in_a_pipeline(fake_redis):
+    namespace = CacheNamespace(name="test")
+    client = fake_redis["redis_client"]
+    client.set(namespace.version_key, 3)
+
+    assert namespace.get_cached_version() == 0
+    with client.pipeline(transaction=False) as pipe:
+        namespace.queue_version(pipe)
+        (reply,) = pipe.execute()
+    assert namespace.update_version(reply) == 3
+    assert namespace.get_cached_version() == 3
+
+
+def test_unlink_version_removes_the_old_keys_only(fake_redis):
+    namespace = CacheNamespace(name="test")
+    client = fake_redis["async_redis_client"]
+
+    async def main():
+        for index in range(5):
+            await client.set(await namespace.akey(f"old{index}"), 1)
+        await client.set("other:v0:key", 1)
+        version = await namespace.invalidate()
+        await client.set(await namespace.akey("new"), 1)
+
+        assert await namespace.unlink_version(version) == 5
+        return sorted(await client.keys("*"))
+
+    assert asyncio.run(main()) == [
+        "cache_namespace:test:version",
+        "other:v0:key",
+        "test:v1:new",
+    ]
+    assert namespace.get_stats() == {
+        "version": 1,
+        "invalidations": 1,
+        "unlinked_keys": 5,
+    }
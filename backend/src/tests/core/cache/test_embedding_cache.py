@@ -0,0 +1,91 @@
+import asyncio
+from typing import List
+
+import numpy as np
+import pytest
+from langchain_core.embeddings import Embeddings
+
+import src.cache.cache_namespace as cache_namespace
+import src.cache.embedding_cache as embedding_cache
+from src.cache.embedding_cache import CachedEmbeddings, LocalEmbeddingCache
+
+
+class FakeEmbeddings(Embeddings):
+    def __init__(self):
+        self.calls = []
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls.append(list(texts))
+        return [[float(len(text)), 0.5] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        self.calls.append([text])
+        return [float(len(text)), -0.5]
+
+
+@pytest.fixture(autouse=True)
+def empty_local_cache(monkeypatch, fake_redis):
+    monkeypatch.setattr(cache_namespace, "CACHE_NAMESPACE_VERSION_TTL_SECONDS", 0)
+    monkeypatch.setattr(embedding_cache, "local_embedding_cache", LocalEmbeddingCache())
+
+
+@pytest.fixture
+def model() -> FakeEmbeddings:
+    return FakeEmbeddings()
+
+
+def test_local_cache_evicts_the_least_recently_used():
+    cache = LocalEmbeddingCache(max_size=2)
+    cache.set_many({"a": np.zeros(2), "b": np.zeros(2)})
+    cache.get_many(["a"])
+    cache.set_many({"c": np.zeros(2)})
+    assert set(cache.get_many(["a", "b", "c"])) == {"a", "c"}
+    assert len(cache) == 2
+
+
+def test_missing_texts_are_embedded_in_a_single_call(model):
+    embeddings = CachedEmbeddings(model, model="test")
+    embeddings.embed_documents(["xin chào"])
+
+    vectors = embeddings.embed_documents(["giá", "xin  chào", "giá", "bán"])
+
+    assert model.calls == [["xin chào"], ["giá", "bán"]]
+    assert vectors == [[3.0, 0.5], [8.0, 0.5], [3.0, 0.5], [3.0, 0.5]]
+
+
+def test_queries_and_documents_are_cached_apart(model):
+    embeddings = CachedEmbeddings(model, model="test")
+    assert embeddings.embed_documents(["giá"]) == [[3.0, 0.5]]
+    assert embeddings.embed_query("giá") == [3.0, -0.5]
+    assert embeddings.embed_query("giá") == [3.0, -0.5]
+    assert len(model.calls) == 2
+
+
+def test_workers_share_the_vectors_through_redis(monkeypatch, model, fake_redis):
+    asyncio.run(CachedEmbeddings(model, model="test").aembed_documents(["giá"]))
+    assert len(fake_redis["redis_binary_client"].keys("embedding:*")) == 1
+
+    # Another worker, with its own local cache
+    monkeypatch.setattr(embedding_cache, "local_embedding_cache", LocalEmbeddingCache())
+    other_model = FakeEmbeddings()
+    other_worker = CachedEmbeddings(other_model, model="test")
+
+    assert other_worker.embed_documents(["giá"]) == [[3.0, 0.5]]
+    assert asyncio.run(other_worker.aembed_documents(["giá"])) == [[3.0, 0.5]]
+    assert other_model.calls == []
+
+
+def test_disabled_redis_tier_is_not_written(model, fake_redis):
+    embeddings = CachedEmbeddings(model, model="test", ttl_seconds=0)
+    embeddings.embed_documents(["giá"])
+    assert fake_redis["redis_binary_client"].keys("*") == []
+
+
+def test_invalidation_empties_the_local_cache(model):
+    embeddings = CachedEmbeddings(model, model="test")
+    embeddings.embed_documents(["giá"])
+
+    asyncio.run(cache_namespace.embedding_cache_namespace.invalidate())
+
+    embeddings.embed_documents(["giá"])
+    assert model.calls == [["giá"], ["giá"]]
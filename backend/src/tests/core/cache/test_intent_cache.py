@@ -0,0 +1,147 @@
+import asyncio
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+
+import src.cache.cache_namespace as cache_namespace
+from src.cache.intent_cache import IntentCache, normalize_text
+from src.common.process_local import ProcessLocal
+
+VECTORS = {
+    "giá iphone 15": [1.0, 0.0, 0.0],
+    "giá của iphone 15": [0.99, 0.1, 0.0],
+    "xin chào": [0.0, 0.0, 1.0],
+}
+
+
+class FakeEmbeddings:
+    def __init__(self, events: list):
+        self.events = events
+
+    async def aembed_query(self, text: str) -> list:
+        self.events.append(("embed", text))
+        await asyncio.sleep(0.005)
+        self.events.append(("embedded", text))
+        return VECTORS.get(text, [0.0, 1.0, 0.0])
+
+
+@pytest.fixture(autouse=True)
+def fresh_versions(monkeypatch, fake_redis):
+    monkeypatch.setattr(cache_namespace, "CACHE_NAMESPACE_VERSION_TTL_SECONDS", 0)
+
+
+@pytest.fixture
+def events() -> list:
+    return []
+
+
+@pytest.fixture
+def intent_cache(events) -> IntentCache:
+    intent_cache = IntentCache(similarity_threshold=0.95)
+    intent_cache._embeddings_client = ProcessLocal(lambda: FakeEmbeddings(events))
+    return intent_cache
+
+
+def _detector(events: list, intent: str):
+    async def detect():
+        events.append(("detect", "start"))
+        await asyncio.sleep(0.01)
+        events.append(("detect", "end"))
+        return intent
+
+    return detect
+
+
+def test_normalize_text_keeps_diacritics():
+    assert normalize_text("  Giá  iPhone 15?! ") == "giá iphone 15"
+    assert normalize_text("ban") != normalize_text("bán")
+
+
+def test_exact_hits_skip_the_detection(intent_cache, events):
+    async def main():
+        detect = _detector(events, "product")
+        first = await intent_cache.get_or_detect("Giá iPhone 15?", None, [], detect)
+        second = await intent_cache.get_or_detect("giá  iphone 15", None, [], detect)
+        return first, second
+
+    assert asyncio.run(main()) == ("product", "product")
+    assert events.count(("detect", "start")) == 1
+    assert intent_cache.get_stats()["exact_hit"] == 1
+
+
+def test_misses_embed_during_the_detection(intent_cache, events):
+    async def main():
+        await intent_cache.get_or_detect(
+            "giá iphone 15", None, [], _detector(events, "product")
+        )
+        # The semantic tier is warm, the miss is still no slower
+        await intent_cache.get_or_detect(
+            "xin chào", None, [], _detector(events, "greeting")
+        )
+
+    asyncio.run(main())
+    assert events == [
+        ("embed", "giá iphone 15"),
+        ("detect", "start"),
+        ("embedded", "giá iphone 15"),
+        ("detect", "end"),
+        ("embed", "xin chào"),
+        ("detect", "start"),
+        ("embedded", "xin chào"),
+        ("detect", "end"),
+    ]
+    assert intent_cache.get_stats()["semantic_entries"] == 2
+
+
+def test_similar_inputs_reuse_the_intent(intent_cache, events):
+    async def main():
+        await intent_cache.get_or_detect(
+            "giá iphone 15", None, [], _detector(events, "product")
+        )
+        events.clear()
+        similar = await intent_cache.get_or_detect(
+            "giá của iphone 15", None, [], _detector(events, "greeting")
+        )
+        # Another previous intent does not share the semantic tier
+        other = await intent_cache.get_or_detect(
+            "giá của iphone 15", "greeting", [], _detector(events, "greeting")
+        )
+        return similar, other
+
+    assert asyncio.run(main()) == ("product", "greeting")
+    # The detection of the similar input was cancelled on the semantic hit
+    assert events[:3] == [
+        ("embed", "giá của iphone 15"),
+        ("detect", "start"),
+        ("embedded", "giá của iphone 15"),
+    ]
+    assert events.count(("detect", "end")) == 1
+    assert intent_cache.get_stats()["semantic_hit"] == 1
+
+
+def test_context_is_part_of_the_exact_key(intent_cache, events):
+    history = [HumanMessage(content="Xin chào"), AIMessage(content="Chào bạn")]
+
+    async def main():
+        await intent_cache.get_or_detect(
+            "giá iphone 15", None, [], _detector(events, "product")
+        )
+        return await intent_cache.get_or_detect(
+            "giá iphone 15", None, history, _detector(events, "greeting")
+        )
+
+    assert asyncio.run(main()) == "greeting"
+    assert events.count(("detect", "start")) == 2
+
+
+def test_disabled_cache_always_detects(events):
+    intent_cache = IntentCache(ttl_seconds=0)
+
+    async def main():
+        for _ in range(2):
+            await intent_cache.get_or_detect(
+                "xin chào", None, [], _detector(events, "greeting")
+            )
+
+    asyncio.run(main())
+    assert events.count(("detect", "start")) == 2
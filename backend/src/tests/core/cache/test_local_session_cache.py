@@ -0,0 +1,61 @@
+from langchain_core.messages import AIMessage, HumanMessage
+
+from src.cache.local_session_cache import LocalSessionCache
+from src.cache.message_log import MessageLog
+
+
+def _message_log(version: int) -> MessageLog:
+    return MessageLog([HumanMessage(content="xin chào", id="1")], "greeting", version)
+
+
+def test_entries_are_served_at_the_current_version_only():
+    cache = LocalSessionCache(max_size=2)
+    cache.set("session", _message_log(3))
+
+    assert cache.get_version("session") == 3
+    assert cache.get("session", 3).intent == "greeting"
+    # Updated by another worker: the stale copy is dropped
+    assert cache.get("session", 4) is None
+    assert cache.get_version("session") is None
+    assert cache.get("other", 1) is None
+    assert cache.get_stats() == {
+        "size": 0,
+        "max_size": 2,
+        "hit": 1,
+        "miss": 1,
+        "stale": 1,
+    }
+
+
+def test_copies_are_not_shared():
+    cache = LocalSessionCache(max_size=2)
+    message_log = _message_log(1)
+    cache.set("session", message_log)
+    message_log.messages.append(AIMessage(content="chào bạn"))
+
+    cached = cache.get("session", 1)
+    assert len(cached.messages) == 1
+    cached.messages.append(AIMessage(content="chào bạn"))
+    assert len(cache.get("session", 1).messages) == 1
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = LocalSessionCache(max_size=2)
+    cache.set("a", _message_log(1))
+    cache.set("b", _message_log(1))
+    cache.get("a", 1)
+    cache.set("c", _message_log(1))
+
+    assert cache.get_version("a") == 1
+    assert cache.get_version("b") is None
+    assert cache.get_version("c") == 1
+
+
+def test_disabled_or_unversioned_entries_are_not_kept():
+    disabled = LocalSessionCache(max_size=0)
+    disabled.set("session", _message_log(1))
+    assert disabled.get_version("session") is None
+
+    cache = LocalSessionCache(max_size=2)
+    cache.set("session", _message_log(0))
+    assert cache.get_version("session") is None
@@ -0,0 +1,50 @@
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+import src.cache.message_serializer as message_serializer
+from src.cache.message_serializer import (
+    MSGPACK_TAG,
+    SERIALIZERS,
+    ZSTD_MSGPACK_TAG,
+    dumps_message,
+    loads_message,
+    loads_message_dict,
+)
+from src.common.message_codec import message_to_dict
+
+MESSAGES = [
+    HumanMessage(content="xin chào", id="1"),
+    AIMessage(
+        content="",
+        id="2",
+        tool_calls=[{"name": "search", "args": {"query": "áo"}, "id": "call"}],
+    ),
+    ToolMessage(content="mô tả sản phẩm " * 100, tool_call_id="call", id="3"),
+]
+
+
+@pytest.mark.parametrize("serializer", SERIALIZERS)
+@pytest.mark.parametrize("message", MESSAGES, ids=lambda message: message.type)
+def test_round_trip(serializer, message):
+    data = dumps_message(message, serializer)
+    assert loads_message(data) == message
+    assert loads_message_dict(data) == message_to_dict(message)
+
+
+def test_formats_are_tagged():
+    short, long = MESSAGES[0], MESSAGES[2]
+    assert dumps_message(short, "json").startswith(b"{")
+    assert dumps_message(short, "msgpack").startswith(MSGPACK_TAG)
+    # Short messages are not worth compressing
+    assert dumps_message(short, "msgpack+zstd").startswith(MSGPACK_TAG)
+    compressed = dumps_message(long, "msgpack+zstd")
+    assert compressed.startswith(ZSTD_MSGPACK_TAG)
+    assert len(compressed) < len(dumps_message(long, "msgpack"))
+
+
+def test_dicts_are_written_as_they_are(monkeypatch):
+    monkeypatch.setattr(message_serializer, "SESSION_CACHE_COMPRESS_MIN_BYTES", 0)
+    message_dict = message_to_dict(MESSAGES[0])
+    for serializer in SERIALIZERS:
+        data = dumps_message(message_dict, serializer)
+        assert loads_message_dict(data) == message_dict
@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+from redis.exceptions import NoScriptError
+
+import src.cache.pipeline_script as pipeline_script
+from src.cache.pipeline_script import PipelineScript, execute_pipeline
+from src.cache.session_queue import session_lock
+
+_incr_by = PipelineScript("return redis.call('INCRBY', KEYS[1], ARGV[1])")
+
+
+@pytest.fixture
+def client(monkeypatch, fake_redis):
+    monkeypatch.setattr(pipeline_script, "_loaded_scripts", set())
+    return fake_redis["async_redis_client"]
+
+
+def test_scripts_refused_with_noscript_are_run_again(client):
+    async def main():
+        async with client.pipeline(transaction=False) as pipe:
+            pipe.set("counter", 1)
+            _incr_by.queue(pipe, ["counter"], [2])
+            _incr_by.queue(pipe, ["counter"], [3])
+            replies = await execute_pipeline(client, pipe)
+        return replies, await client.get("counter")
+
+    replies, counter = asyncio.run(main())
+    assert replies == [True, 3, 6]
+    assert counter == "6"
+
+
+def test_transactions_are_not_split_on_noscript(client):
+    async def run_transaction():
+        async with client.pipeline(transaction=True) as pipe:
+            pipe.incr("counter")
+            _incr_by.queue(pipe, ["counter"], [10])
+            return await execute_pipeline(client, pipe)
+
+    async def main():
+        with pytest.raises(NoScriptError):
+            await run_transaction()
+        # The script is loaded, the transaction can be run again as a whole
+        assert await run_transaction() == [2, 12]
+
+    asyncio.run(main())
+
+
+def test_loaded_scripts_survive_a_flush_in_transactions(client):
+    async def main():
+        await _incr_by.load(client)
+        assert await client.script_exists(_incr_by.sha) == [True]
+        await client.script_flush()
+        async with session_lock("session"):
+            assert await client.llen("session:queue") == 1
+
+    asyncio.run(main())
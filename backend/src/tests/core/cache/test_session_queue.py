@@ -0,0 +1,187 @@
+import asyncio
+
+import pytest
+import redis
+
+import src.cache.session_queue as session_queue
+from src.cache.session_queue import (
+    SessionQueueTimeoutError,
+    session_lock,
+    single_flight,
+)
+
+
+@pytest.fixture(autouse=True)
+def fast_queue(monkeypatch, fake_redis):
+    monkeypatch.setattr(session_queue, "SESSION_QUEUE_POLL_INTERVAL_SECONDS", 0.01)
+    monkeypatch.setattr(session_queue, "SESSION_QUEUE_TIMEOUT_SECONDS", 2)
+
+
+def test_turns_of_a_session_run_one_at_a_time_in_order():
+    events = []
+
+    async def turn(name: str):
+        async with session_lock("session"):
+            events.append(("start", name))
+            await asyncio.sleep(0.02)
+            events.append(("end", name))
+
+    async def main():
+        tasks = []
+        for name in "abc":
+            tasks.append(asyncio.create_task(turn(name)))
+            await asyncio.sleep(0.005)  # Enqueued in this order
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    assert events == [
+        ("start", "a"),
+        ("end", "a"),
+        ("start", "b"),
+        ("end", "b"),
+        ("start", "c"),
+        ("end", "c"),
+    ]
+
+
+def test_batch_locks_sharing_sessions_do_not_deadlock():
+    running = set()
+
+    async def turn(*keys: str):
+        async with session_lock(*keys):
+            assert not running & set(keys)
+            running.update(keys)
+            await asyncio.sleep(0.01)
+            running.difference_update(keys)
+
+    async def main():
+        await asyncio.wait_for(
+            asyncio.gather(
+                turn("a", "b"), turn("b", "a"), turn("a"), turn("b"), turn("b", "c")
+            ),
+            timeout=2,
+        )
+
+    asyncio.run(main())
+
+
+def test_lock_times_out_and_leaves_the_queue(monkeypatch, fake_redis):
+    monkeypatch.setattr(session_queue, "SESSION_QUEUE_TIMEOUT_SECONDS", 0.1)
+    client = fake_redis["async_redis_client"]
+
+    async def main():
+        async with session_lock("session"):
+            with pytest.raises(SessionQueueTimeoutError):
+                async with session_lock("session"):
+                    pass
+            assert await client.llen("session:queue") == 1
+        assert await client.llen("session:queue") == 0
+
+    asyncio.run(main())
+
+
+def test_lost_ticket_is_queued_again_on_every_session(fake_redis):
+    client = fake_redis["async_redis_client"]
+    order = []
+
+    async def hold(key: str, release: asyncio.Event):
+        async with session_lock(key):
+            await release.wait()
+
+    async def batch():
+        async with session_lock("a", "b"):
+            order.append("batch")
+
+    async def single():
+        async with session_lock("a"):
+            order.append("single")
+
+    async def main():
+        release = asyncio.Event()
+        holder = asyncio.create_task(hold("b", release))
+        await asyncio.sleep(0.02)
+        batch_task = asyncio.create_task(batch())
+        await asyncio.sleep(0.02)  # The batch holds "a" and waits for "b"
+        single_task = asyncio.create_task(single())
+        await asyncio.sleep(0.02)
+
+        # The batch misses its heartbeats: its ticket is dropped from "b"
+        batch_token = await client.lindex("a:queue", 0)
+        await client.lrem("b:queue", 0, batch_token)
+        await asyncio.sleep(0.05)
+
+        # It gave "a" up to the single turn, and queued again on both sessions
+        assert order == ["single"]
+        assert await client.lrange("a:queue", 0, -1) == [batch_token]
+        assert batch_token in await client.lrange("b:queue", 0, -1)
+        release.set()
+        await asyncio.gather(holder, batch_task, single_task)
+
+    asyncio.run(main())
+    assert order == ["single", "batch"]
+
+
+def test_heartbeat_survives_redis_errors(monkeypatch, fake_redis):
+    monkeypatch.setattr(session_queue, "SESSION_QUEUE_LEASE_SECONDS", 1)
+    client = fake_redis["async_redis_client"]
+    pipeline = client.pipeline
+    calls = []
+
+    def failing_once_pipeline(*args, **kwargs):
+        calls.append(1)
+        if len(calls) == 1:
+            raise redis.ConnectionError("connection lost")
+        return pipeline(*args, **kwargs)
+
+    async def main():
+        await client.set(session_queue.ALIVE_KEY_PREFIX + "token", 1, ex=1)
+        monkeypatch.setattr(client, "pipeline", failing_once_pipeline)
+        heartbeat = asyncio.create_task(session_queue._heartbeat("token", ["key"]))
+        await asyncio.sleep(1.1)
+        heartbeat.cancel()
+        assert await client.exists(session_queue.ALIVE_KEY_PREFIX + "token")
+
+    asyncio.run(main())
+    assert len(calls) >= 2
+
+
+def test_duplicate_turns_reuse_the_result_of_the_leader():
+    runs = []
+
+    async def turn():
+        async with single_flight("session", "xin chào") as flight:
+            if flight.result is not None:
+                return flight.result
+            runs.append(1)
+            await asyncio.sleep(0.05)
+            flight.set_result("result")
+            return "result"
+
+    async def main():
+        return await asyncio.gather(turn(), turn(), turn())
+
+    assert asyncio.run(main()) == ["result"] * 3
+    assert len(runs) == 1
+
+
+def test_duplicate_runs_again_when_the_leader_failed():
+    runs = []
+
+    async def turn(fail: bool):
+        async with single_flight("session", "xin chào") as flight:
+            if flight.result is not None:
+                return flight.result
+            runs.append(fail)
+            await asyncio.sleep(0.05)
+            if fail:
+                raise RuntimeError("turn failed")
+            flight.set_result("result")
+            return "result"
+
+    async def main():
+        return await asyncio.gather(turn(True), turn(False), return_exceptions=True)
+
+    failed, result = asyncio.run(main())
+    assert isinstance(failed, RuntimeError)
+    assert result == "result"
+    assert runs == [True, False]
@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+
+import src.common.admission_controller as admission_controller
+from src.common.admission_controller import (
+    AdmissionController,
+    AdmissionRejectedError,
+)
+
+
+@pytest.fixture(autouse=True)
+def fast_polling(monkeypatch, fake_redis):
+    monkeypatch.setattr(admission_controller, "ADMISSION_POLL_INTERVAL_SECONDS", 0.01)
+
+
+def test_slots_are_limited_and_released():
+    controller = AdmissionController(name="test", max_in_flight=2, max_wait_seconds=0)
+
+    async def main():
+        async with controller.slot():
+            async with controller.slot():
+                assert (await controller.get_stats())["in_flight"] == 2
+                with pytest.raises(AdmissionRejectedError):
+                    async with controller.slot():
+                        pass
+        async with controller.slot():
+            assert (await controller.get_stats())["in_flight"] == 1
+
+    asyncio.run(main())
+
+
+def test_queue_full_is_rejected_at_once():
+    controller = AdmissionController(
+        name="test", max_in_flight=1, max_queue=0, max_wait_seconds=5
+    )
+
+    async def main():
+        async with controller.slot():
+            with pytest.raises(AdmissionRejectedError):
+                async with controller.slot():
+                    pass
+        return await controller.get_stats()
+
+    assert asyncio.run(main())["rejected_queue_full"] == 1
+
+
+def test_waiters_are_admitted_before_new_arrivals():
+    controller = AdmissionController(name="test", max_in_flight=1, max_wait_seconds=2)
+    admitted = []
+
+    async def turn(name: str, duration: float):
+        async with controller.slot():
+            admitted.append(name)
+            await asyncio.sleep(duration)
+
+    async def main():
+        first = asyncio.create_task(turn("first", 0.05))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.create_task(turn("waiter", 0.01))
+        await asyncio.sleep(0.02)
+        # Arrives while the waiter is queued, right when the slot frees up
+        await first
+        await turn("new", 0.01)
+        await waiter
+
+    asyncio.run(main())
+    assert admitted == ["first", "waiter", "new"]
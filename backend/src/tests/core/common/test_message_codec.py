@@ -0,0 +1,98 @@
+import pytest
+from langchain_core.messages import (
+    AIMessage,
+    AIMessageChunk,
+    HumanMessage,
+    RemoveMessage,
+    SystemMessage,
+    ToolMessage,
+)
+
+from src.common.message_codec import (
+    MESSAGE_CLASSES,
+    LazyMessageList,
+    iter_message_payloads,
+    message_from_dict,
+    message_from_json,
+    message_to_dict,
+    message_to_json,
+)
+from src.models.agent.agent_state_model import add_messages
+
+MESSAGES = {
+    "human": HumanMessage(content="xin chào", id="1"),
+    "ai": AIMessage(content="chào bạn", id="2"),
+    "AIMessageChunk": AIMessageChunk(content="chào", id="3"),
+    "tool": ToolMessage(content="[]", tool_call_id="call", id="4"),
+    "system": SystemMessage(content="summary", id="5"),
+}
+
+
+def test_every_message_class_is_covered():
+    assert set(MESSAGES) == set(MESSAGE_CLASSES)
+
+
+@pytest.mark.parametrize("message_type", MESSAGES)
+def test_round_trip(message_type):
+    message = MESSAGES[message_type]
+    rebuilt = message_from_dict(message_to_dict(message))
+    assert isinstance(rebuilt, MESSAGE_CLASSES[message_type])
+    assert rebuilt.content == message.content
+    assert rebuilt.id == message.id
+    assert message_from_json(message_to_json(message)) == rebuilt
+
+
+def test_unknown_type_raises():
+    with pytest.raises(ValueError):
+        message_from_dict(message_to_dict(object()))
+
+
+def test_unknown_types_are_skipped_from_a_history():
+    messages = LazyMessageList(
+        [
+            message_to_dict(MESSAGES["human"]),
+            message_to_dict(object()),
+            message_to_dict(MESSAGES["ai"]),
+        ]
+    )
+    assert [message.id for message in messages] == ["1", "2"]
+
+
+def test_lazy_list_builds_messages_on_access():
+    messages = LazyMessageList(message_to_dict(m) for m in MESSAGES.values())
+    payloads = list(iter_message_payloads(messages))
+    assert all(isinstance(payload, dict) for payload in payloads)
+
+    assert messages[-1] == MESSAGES["system"]
+    payloads = list(iter_message_payloads(messages))
+    assert isinstance(payloads[-1], SystemMessage)
+    assert all(isinstance(payload, dict) for payload in payloads[:-1])
+
+    # Copies share the built messages
+    assert messages.copy()[-1] is messages[-1]
+    assert messages.message_ids() == {"1", "2", "3", "4", "5"}
+
+
+def test_add_messages_appends_without_building_the_history():
+    history = LazyMessageList(
+        message_to_dict(m) for m in (MESSAGES["human"], MESSAGES["ai"])
+    )
+    messages = add_messages(history, [HumanMessage(content="thêm")])
+
+    assert isinstance(messages, LazyMessageList)
+    assert len(messages) == 3
+    payloads = list(iter_message_payloads(messages))
+    assert all(isinstance(payload, dict) for payload in payloads[:2])
+    assert messages[2].content == "thêm" and messages[2].id is not None
+    assert len(history) == 2
+
+
+def test_add_messages_replaces_and_removes_like_langgraph():
+    history = LazyMessageList(
+        message_to_dict(m) for m in (MESSAGES["human"], MESSAGES["ai"])
+    )
+    replaced = add_messages(history, [AIMessage(content="sửa", id="2")])
+    assert [message.content for message in replaced] == ["xin chào", "sửa"]
+
+    removed = add_messages(history, [RemoveMessage(id="1")])
+    assert [message.id for message in removed] == ["2"]
@@ -22,7 +22,7 @@ def setup_milvus_collection():
         collection_name=collection_name,
         milvus_uri=milvus_uri,
         milvus_token=milvus_token,
-    )
+    ).connect()
 
     if utility.has_collection(collection_name):
         utility.drop_collection(collection_name)
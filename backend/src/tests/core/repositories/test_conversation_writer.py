@@ -0,0 +1,231 @@
+import asyncio
+import json
+import os
+import time
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+from sqlalchemy import insert, text
+from sqlalchemy.pool import StaticPool
+from sqlmodel import create_engine
+
+import src.cache.agent_state_cache_wrapper as agent_state_cache_wrapper
+import src.repositories.agent.conversation_repository as conversation_repository
+import src.repositories.agent.conversation_writer as conversation_writer_module
+from src.cache.agent_state_cache_wrapper import store_agent_states
+from src.cache.pipeline_script import execute_pipeline
+from src.models.agent.agent_state_model import AgentStateModel
+from src.repositories.agent.conversation_repository import (
+    ConversationRepository,
+    _to_conversation_rows,
+    drop_saved_conversation_rows,
+)
+from src.repositories.agent.conversation_writer import (
+    ConversationWriter,
+    _get_pending_key,
+    _get_process_start_time,
+)
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    # The columns of the table, which SQLite cannot create as is (the
+    # autoincrement of its composite primary key)
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                f"CREATE TABLE {ConversationRepository.__tablename__} ("
+                "id INTEGER PRIMARY KEY, session_id TEXT, user_id TEXT, "
+                "messages JSON, message_type TEXT, intent TEXT, created_at TIMESTAMP)"
+            )
+        )
+    monkeypatch.setattr(conversation_repository, "engine", engine)
+    return engine
+
+
+@pytest.fixture
+def inserted_rows(monkeypatch):
+    """
+    The rows committed by the writer, instead of the database.
+    """
+    inserted_rows = []
+
+    def insert_conversation_rows(rows, batch_size=None):
+        inserted_rows.extend(rows)
+
+    async def ainsert_conversation_rows(rows, batch_size=None):
+        inserted_rows.extend(rows)
+
+    monkeypatch.setattr(
+        conversation_writer_module, "insert_conversation_rows", insert_conversation_rows
+    )
+    monkeypatch.setattr(
+        conversation_writer_module,
+        "ainsert_conversation_rows",
+        ainsert_conversation_rows,
+    )
+    return inserted_rows
+
+
+def _rows(session_id: str = "session") -> list[dict]:
+    agent_state = AgentStateModel(
+        session_id=session_id,
+        user_id="user",
+        messages=[
+            HumanMessage(content="xin chào", id=f"{session_id}-1"),
+            AIMessage(content="chào bạn", id=f"{session_id}-2"),
+        ],
+        intent="greeting",
+    )
+    return _to_conversation_rows([(agent_state, 2)])
+
+
+def _save(engine, rows: list[dict]) -> None:
+    with engine.begin() as connection:
+        connection.execute(insert(ConversationRepository).values(rows))
+
+
+def _write_spool(spool_dir, name: str, rows: list[dict]) -> str:
+    path = os.path.join(spool_dir, name)
+    with open(path, "w", encoding="utf-8") as spool_file:
+        spool_file.writelines(json.dumps(row) + "\n" for row in rows)
+    return path
+
+
+def test_saved_rows_are_dropped(engine):
+    rows = _rows("a") + _rows("b")
+    _save(engine, rows[:3])
+    assert drop_saved_conversation_rows(rows) == rows[3:]
+
+
+def test_spool_of_a_reused_pid_is_replayed_without_duplicates(
+    tmp_path, engine, inserted_rows
+):
+    rows = _rows()
+    _save(engine, rows[:1])  # Committed before the worker died
+    # Same pid as this process, but another start time: a dead worker
+    path = _write_spool(tmp_path, f"conversations-{os.getpid()}-1-1.jsonl", rows)
+
+    ConversationWriter(spool_dir=str(tmp_path))._replay_spool()
+
+    assert inserted_rows == rows[1:]
+    assert not os.path.exists(path)
+
+
+def test_spool_of_a_live_worker_is_left_alone(tmp_path, inserted_rows):
+    start_time = _get_process_start_time(os.getpid())
+    if start_time is None:
+        pytest.skip("/proc is not available")
+    name = f"conversations-{os.getpid()}-{start_time}-1.jsonl"
+    path = _write_spool(tmp_path, name, _rows())
+
+    ConversationWriter(spool_dir=str(tmp_path))._replay_spool()
+
+    assert inserted_rows == []
+    assert os.path.exists(path)
+
+
+def test_spool_segments_are_new_files(tmp_path, fake_redis, inserted_rows):
+    writer = ConversationWriter(spool_dir=str(tmp_path), flush_interval_seconds=60)
+
+    async def main():
+        await writer.start()
+        first_path = writer._spool_file.name
+        writer._pending_rows.extend(_rows())
+        writer._pending_sessions[("user", "session")] = 2
+        await writer.flush()
+        second_path = writer._spool_file.name
+        await writer.stop()
+        return first_path, second_path
+
+    first_path, second_path = asyncio.run(main())
+    assert first_path != second_path
+    assert os.path.basename(first_path).count("-") == 3
+    assert os.listdir(tmp_path) == []
+
+
+def test_loads_wait_for_the_rows_of_the_sessions(
+    monkeypatch, fake_redis, inserted_rows
+):
+    monkeypatch.setattr(
+        conversation_writer_module, "CONVERSATION_WRITER_PENDING_WAIT_SECONDS", 0.1
+    )
+    client = fake_redis["async_redis_client"]
+    writer = ConversationWriter(flush_interval_seconds=60)
+    agent_state = AgentStateModel(
+        session_id="session",
+        user_id="user",
+        messages=[HumanMessage(content="xin chào")],
+    )
+
+    async def main():
+        await writer.start()
+        assert writer.enqueue([(agent_state, 1)])
+        async with client.pipeline(transaction=False) as pipe:
+            writer.queue_pending_markers(pipe, [("user", "session")])
+            await execute_pipeline(client, pipe)
+
+        # Rows of this worker are flushed, and their marker cleared
+        await writer.wait_until_saved([("user", "session")])
+        assert len(inserted_rows) == 1
+        assert not await client.exists(_get_pending_key("user", "session"))
+
+        # Rows of another worker are waited for, up to the wait limit
+        await client.hset(_get_pending_key("user", "other"), "other", time.time() + 60)
+        started_at = asyncio.get_running_loop().time()
+        await writer.wait_until_saved([("user", "other")])
+        assert asyncio.get_running_loop().time() - started_at >= 0.1
+        await writer.stop()
+
+    asyncio.run(main())
+
+
+def test_turns_are_saved_in_order_across_workers(
+    monkeypatch, fake_redis, inserted_rows
+):
+    first_worker = ConversationWriter(flush_interval_seconds=60)
+    second_worker = ConversationWriter(flush_interval_seconds=0.01)
+    first_turn = AgentStateModel(
+        session_id="session",
+        user_id="user",
+        messages=[
+            HumanMessage(content="xin chào", id="1"),
+            AIMessage(content="chào", id="2"),
+        ],
+    )
+    second_turn = first_turn.model_copy(
+        update={
+            "messages": first_turn.messages
+            + [HumanMessage(content="giá", id="3"), AIMessage(content="100k", id="4")]
+        }
+    )
+
+    async def store(writer, cached_agent_state, result):
+        monkeypatch.setattr(agent_state_cache_wrapper, "conversation_writer", writer)
+        await store_agent_states([(cached_agent_state, result)])
+
+    async def main():
+        await first_worker.start()
+        await second_worker.start()
+        await store(first_worker, AgentStateModel(), first_turn)
+
+        # The next turn, on another worker, waits for the rows of the first one
+        second_store = asyncio.create_task(
+            store(second_worker, first_turn, second_turn)
+        )
+        await asyncio.sleep(0.05)
+        assert not second_store.done()
+        await first_worker.flush()
+        await second_store
+
+        await second_worker.stop()
+        await first_worker.stop()
+
+    asyncio.run(main())
+    assert [row["messages"]["id"] for row in inserted_rows] == ["1", "2", "3", "4"]
+    client = fake_redis["async_redis_client"]
+    assert not asyncio.run(client.exists(_get_pending_key("user", "session")))
@@ -0,0 +1,41 @@
+import pytest
+
+import src.repositories.agent.conversation_repository as conversation_repository
+from src.repositories.agent.conversation_repository import _get_due_sessions
+
+
+@pytest.fixture(autouse=True)
+def thresholds(monkeypatch):
+    monkeypatch.setattr(conversation_repository, "CONVERSATION_SNAPSHOT_MESSAGES", 3)
+    monkeypatch.setattr(conversation_repository, "CONVERSATION_SNAPSHOT_BYTES", 0)
+    monkeypatch.setattr(
+        conversation_repository, "CONVERSATION_SNAPSHOT_SETTLE_SECONDS", 60
+    )
+    monkeypatch.setattr(
+        conversation_repository,
+        "_inserted_since_check",
+        conversation_repository.OrderedDict(),
+    )
+
+
+def _rows(session_id: str, count: int) -> list[dict]:
+    return [
+        {"user_id": "user", "session_id": session_id, "messages": {"type": "human"}}
+    ] * count
+
+
+def test_sessions_are_checked_once_enough_rows_were_inserted():
+    assert _get_due_sessions(_rows("a", 2)) == []
+    assert _get_due_sessions(_rows("a", 1) + _rows("b", 1)) == [("user", "a")]
+    # Not snapshotted yet: checked again once its rows settled only
+    assert _get_due_sessions(_rows("a", 1)) == []
+
+
+def test_snapshotted_sessions_are_counted_again(monkeypatch):
+    monkeypatch.setattr(
+        conversation_repository, "snapshot_conversations", lambda keys: keys
+    )
+    assert _get_due_sessions(_rows("a", 3)) == [("user", "a")]
+    conversation_repository._snapshot_sessions([("user", "a")])
+    assert _get_due_sessions(_rows("a", 2)) == []
+    assert _get_due_sessions(_rows("a", 1)) == [("user", "a")]